@@ -0,0 +1,102 @@
+"""Compare moo_vm.VM with moo_closures.ClosureEngine on the same verbs.
+
+Each verb is parsed once and compiled for both engines; the fastest of
+several runs is reported for each, along with how many times faster the
+closure engine was and the ticks each engine charged. The closure engine
+charges a tick per statement rather than per instruction, so its counts are
+lower.
+"""
+import argparse
+import time
+
+import moo_ast
+import moo_closures
+from moo_compiler import compile_verb
+from moo_runtime import Frame, World
+from moo_vm import VM, ExecutionResult
+
+VERBS = {
+  'while_loop': """
+    i = 0;
+    while (i < N)
+      i = i + 1;
+    endwhile
+    return i;
+  """,
+  'arithmetic': """
+    total = 0;
+    for i in [1..N]
+      if ((i % 3) == 0 || (i % 5) == 0)
+        total = total + i * 2;
+      else
+        total = total - 1;
+      endif
+    endfor
+    return total;
+  """,
+  'list_building': """
+    result = {};
+    for i in [1..N]
+      result = listappend(result, i);
+    endfor
+    return length(result);
+  """,
+  'properties': """
+    for i in [1..N]
+      this.counter = this.counter + i;
+    endfor
+    return this.counter;
+  """,
+  'verb_calls': """
+    result = 0;
+    for i in [1..N]
+      result = this:increment(result);
+    endfor
+    return result;
+  """,
+}
+
+INCREMENT = "return args[1] + 1;"
+
+DEFAULT_SIZE = 20000
+
+ENGINES = {
+  'vm': (compile_verb, lambda world: VM(world=world, max_ticks=float('inf'))),
+  'closures': (moo_closures.compile_verb, lambda world: moo_closures.ClosureEngine(world=world, max_ticks=float('inf'))),
+}
+
+def run_benchmark(name, engine, size=None, repeat=3):
+  """Run a verb on one engine and return (return value, best wall time in seconds, ticks)."""
+  compile, make_engine = ENGINES[engine]
+  program = compile(moo_ast.parse(VERBS[name].replace('N', str(size or DEFAULT_SIZE))))
+  best = None
+  for _ in range(repeat):
+    world = World()
+    thing = world.create(name="bench")
+    world.add_property(thing, "counter", 0)
+    world.add_verb(thing, "increment", compile(moo_ast.parse(INCREMENT)))
+    runner = make_engine(world)
+    start = time.perf_counter()
+    result = runner.run_program(program, Frame(this=thing))
+    elapsed = time.perf_counter() - start
+    if result is not ExecutionResult.RETURN:
+      raise RuntimeError("Benchmark {} on {} did not return: {} {}".format(name, engine, result, runner.error))
+    best = elapsed if best is None else min(best, elapsed)
+  return runner.return_value, best, runner.ticks
+
+def main(args):
+  print("{:<16} {:>10} {:>10} {:>8} {:>10} {:>10}".format("verb", "vm", "closures", "speedup", "vm ticks", "ticks"))
+  for name in args.verbs or VERBS:
+    results = {engine: run_benchmark(name, engine, args.size, args.repeat) for engine in ENGINES}
+    if results['vm'][0] != results['closures'][0]:
+      raise RuntimeError("Engines disagree on {}: {!r} != {!r}".format(name, results['vm'][0], results['closures'][0]))
+    (vm, vm_ticks), (closures, ticks) = results['vm'][1:], results['closures'][1:]
+    print("{:<16} {:>10.4f} {:>10.4f} {:>7.2f}x {:>10} {:>10}".format(name, vm, closures, vm / closures, vm_ticks, ticks))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-b", "--verb", help="Verb to run; may be repeated. Defaults to all of them.", action="append", dest="verbs", choices=list(VERBS))
+  parser.add_argument("-n", "--size", help="Loop iterations per verb.", type=int)
+  parser.add_argument("-r", "--repeat", help="Runs per verb and engine; the fastest is reported.", type=int, default=3)
+  args = parser.parse_args()
+  main(args)
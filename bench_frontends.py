@@ -0,0 +1,58 @@
+"""Compare the astroid and stdlib ast frontends of the transpiler.
+
+Cold start is measured in a fresh interpreter that imports mooingsnake and
+parses an empty module; parse and convert times are the best of several runs
+over every file in the corpus.
+"""
+import argparse
+import io
+import os
+import subprocess
+import sys
+import time
+
+from mooingsnake import FRONTENDS, collect_inputs, get_frontend, read_source
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+COLD_START = "import mooingsnake; mooingsnake.get_frontend({!r}).parse('')"
+
+def best_of(repeat, run):
+  best = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best
+
+def cold_start(frontend, repeat=3):
+  command = [sys.executable, "-W", "ignore", "-c", COLD_START.format(frontend)]
+  return best_of(repeat, lambda: subprocess.run(command, cwd=HERE, check=True))
+
+def corpus_times(frontend, sources, repeat=3):
+  """Return (parse seconds, convert seconds) for the whole corpus."""
+  converter = get_frontend(frontend)
+  parse = best_of(repeat, lambda: [converter.parse(source) for source in sources])
+  modules = [converter.parse(source) for source in sources]
+  convert = best_of(repeat, lambda: [converter.convert_module(module, io.StringIO()) for module in modules])
+  return parse, convert
+
+def main(args):
+  inputs = collect_inputs(args.input)
+  sources = [read_source(fname) for fname in inputs]
+  print("{} files, {} lines".format(len(sources), sum(source.count("\n") for source in sources)))
+  print("{:<10} {:>12} {:>12} {:>12} {:>14}".format("frontend", "cold start", "parse", "convert", "ms/file"))
+  for frontend in args.frontends or FRONTENDS:
+    startup = cold_start(frontend, args.repeat)
+    parse, convert = corpus_times(frontend, sources, args.repeat)
+    per_file = 1000 * (parse + convert) / len(sources)
+    print("{:<10} {:>12.4f} {:>12.4f} {:>12.4f} {:>14.3f}".format(frontend, startup, parse, convert, per_file))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-i", "--input", help="Python files, directories or glob patterns making up the corpus.", nargs="+", default=[os.path.join(HERE, 'sample_obj.py')])
+  parser.add_argument("-f", "--frontend", help="Frontend to measure; may be repeated. Defaults to all of them.", action="append", dest="frontends", choices=FRONTENDS)
+  parser.add_argument("-r", "--repeat", help="Runs per measurement; the fastest is reported.", type=int, default=3)
+  args = parser.parse_args()
+  main(args)
@@ -0,0 +1,63 @@
+"""Parse time of mooparse.grammar against input size and nesting depth.
+
+Each input is generated at a range of sizes or depths; the time per unit
+should stay flat as they grow if parsing is linear.
+"""
+import argparse
+import time
+
+from mooparse import grammar
+
+STATEMENTS = """\
+x = this.items[i] + f(a, b) * 2;
+if ((x > 3) && (y != "s")) player:tell("x is ", x); elseif (x == 0) return; endif
+for item in (this.contents) item:moveto(#-1); endfor
+"""
+
+SIZES = {
+  # Statements in a verb.
+  'statements': lambda n: STATEMENTS * n,
+  # Operands in one expression.
+  'operators': lambda n: "x = " + " + ".join("a%d * 2" % i for i in range(n)) + ";",
+}
+
+DEPTHS = {
+  'calls': lambda n: "x = " + "f(" * n + "1" + ")" * n + ";",
+  'lists': lambda n: "x = " + "{1, " * n + "2" + "}" * n + ";",
+  'parens': lambda n: "x = " + "(1 + " * n + "2" + ")" * n + ";",
+  'subscripts': lambda n: "x = a" + "[b]" * n + ";",
+  'verb_calls': lambda n: "x = this" + ":v(1)" * n + ";",
+  'ifs': lambda n: "if (x) " * n + "y = 1;" + " endif" * n,
+}
+
+def time_parse(code, repeat):
+  best = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = grammar.parse(code)
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  if not result.is_valid:
+    raise RuntimeError("Benchmark input does not parse: {!r}".format(code[:80]))
+  return best
+
+def run(title, generators, steps, repeat):
+  print("{:<12} {:>8} {:>10} {:>12}".format(title, "n", "seconds", "usec per n"))
+  for name, generate in generators.items():
+    for n in steps:
+      elapsed = time_parse(generate(n), repeat)
+      print("{:<12} {:>8} {:>10.4f} {:>12.1f}".format(name, n, elapsed, elapsed / n * 1e6))
+
+def main(args):
+  run("size", SIZES, [args.size * 2 ** i for i in range(args.steps)], args.repeat)
+  print()
+  run("depth", DEPTHS, [2 ** i for i in range(1, args.max_depth.bit_length())], args.repeat)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-n", "--size", help="Smallest size; each step doubles it.", type=int, default=25)
+  parser.add_argument("-s", "--steps", help="Number of sizes to time.", type=int, default=5)
+  parser.add_argument("-d", "--max-depth", help="Greatest nesting depth to time.", type=int, default=32)
+  parser.add_argument("-r", "--repeat", help="Parses per input; the fastest is reported.", type=int, default=3)
+  args = parser.parse_args()
+  main(args)
@@ -0,0 +1,101 @@
+"""Throughput benchmarks for moo_vm.VM.
+
+Each benchmark is a hand-assembled program; the results report ticks/sec so
+they can be compared with the same programs run on a LambdaMOO server.
+"""
+import argparse
+import time
+
+from moo_opcodes import opcodes
+from moo_runtime import BUILTIN_VARIABLES, Frame, World
+from moo_vm import VM, ExecutionResult, Label, Program
+
+VARS = BUILTIN_VARIABLES + ['i', 'result']
+I = VARS.index('i')
+RESULT = VARS.index('result')
+
+def while_loop(n):
+  top = Label()
+  end = Label()
+  return [
+    opcodes.IMM, 0, opcodes.PUT, I, opcodes.POP,
+    top, opcodes.PUSH, I, opcodes.IMM, n, opcodes.LT, opcodes.WHILE, end,
+    opcodes.PUSH, I, opcodes.IMM, 1, opcodes.ADD, opcodes.PUT, I, opcodes.POP,
+    opcodes.JUMP, top,
+    end, opcodes.PUSH, I, opcodes.RETURN,
+  ]
+
+def for_range(body):
+  def program(n):
+    top = Label()
+    end = Label()
+    return [
+      opcodes.IMM, 1, opcodes.IMM, n,
+      top, opcodes.FOR_RANGE, I, end,
+      *body,
+      opcodes.JUMP, top,
+      end, opcodes.PUSH, RESULT, opcodes.RETURN,
+    ]
+  return program
+
+def init(value):
+  return [opcodes.IMM, value, opcodes.PUT, RESULT, opcodes.POP]
+
+def with_init(value, program):
+  return lambda n: init(value) + program(n)
+
+list_building = with_init((), for_range([
+  opcodes.PUSH, RESULT, opcodes.PUSH, I, opcodes.list_append, opcodes.PUT, RESULT, opcodes.POP,
+]))
+
+map_insertion = lambda n: [opcodes.MAP_CREATE, opcodes.PUT, RESULT, opcodes.POP] + for_range([
+  opcodes.PUSH, RESULT, opcodes.PUSH, I, opcodes.PUSH, I, opcodes.map_insert, opcodes.PUT, RESULT, opcodes.POP,
+])(n)
+
+verb_calls = with_init(0, for_range([
+  opcodes.PUSH, VARS.index('this'), opcodes.IMM, "increment", opcodes.PUSH, RESULT, opcodes.MAKE_SINGLETON_LIST,
+  opcodes.CALL_VERB, opcodes.PUT, RESULT, opcodes.POP,
+]))
+
+INCREMENT = [
+  opcodes.PUSH, VARS.index('args'), opcodes.IMM, 1, opcodes.REF, opcodes.IMM, 1, opcodes.ADD, opcodes.RETURN,
+]
+
+BENCHMARKS = {
+  'while_loop': (while_loop, 100000),
+  'list_building': (list_building, 5000),
+  'map_insertion': (map_insertion, 5000),
+  'verb_calls': (verb_calls, 20000),
+}
+
+def run_benchmark(name, size=None, repeat=3):
+  """Run a benchmark and return (ticks, best wall time in seconds)."""
+  build, default_size = BENCHMARKS[name]
+  program = Program.assemble(build(size or default_size), VARS)
+  world = World()
+  thing = world.create(name="bench")
+  world.add_verb(thing, "increment", Program.assemble(INCREMENT, VARS))
+  best = None
+  for _ in range(repeat):
+    vm = VM(world=world, max_ticks=float('inf'))
+    start = time.perf_counter()
+    result = vm.run_program(program, Frame(this=thing))
+    elapsed = time.perf_counter() - start
+    if result is not ExecutionResult.RETURN:
+      raise RuntimeError("Benchmark {} did not return: {} {}".format(name, result, vm.error))
+    best = elapsed if best is None else min(best, elapsed)
+  return vm.ticks, best
+
+def main(args):
+  print("{:<16} {:>10} {:>10} {:>14}".format("benchmark", "ticks", "seconds", "ticks/sec"))
+  for name in args.benchmarks or BENCHMARKS:
+    ticks, elapsed = run_benchmark(name, args.size, args.repeat)
+    print("{:<16} {:>10} {:>10.4f} {:>14.0f}".format(name, ticks, elapsed, ticks / elapsed))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-b", "--benchmark", help="Benchmark to run; may be repeated. Defaults to all of them.", action="append", dest="benchmarks", choices=list(BENCHMARKS))
+  parser.add_argument("-n", "--size", help="Iterations per benchmark, overriding each benchmark's default.", type=int)
+  parser.add_argument("-r", "--repeat", help="Runs per benchmark; the fastest is reported.", type=int, default=3)
+  args = parser.parse_args()
+  main(args)
@@ -0,0 +1,94 @@
+"""Evaluate constant Python expressions the way the emitted MOO code would.
+
+Only operations whose MOO result is certain are folded. Anything that would
+raise on the server (mixing ints and floats, comparing different types,
+overflow) or whose MOO meaning differs from Python's (integer / and %) is
+left for the server to evaluate.
+"""
+import math
+
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+
+class NotConstant(Exception):
+  pass
+
+def kind(value):
+  if isinstance(value, bool):
+    return int
+  if value is None:
+    return None
+  return type(value)
+
+def constant(value):
+  """value itself if the transpiler writes it as a MOO literal."""
+  if kind(value) not in (int, float, str, None):
+    raise NotConstant()
+  return value
+
+def moo_truth(value):
+  if kind(value) in (int, float, str):
+    return bool(value)
+  # None becomes $nothing, an object number, and objects are false.
+  return False
+
+def check(value):
+  if kind(value) is int and not INT_MIN <= value <= INT_MAX:
+    raise NotConstant()
+  if kind(value) is float and not math.isfinite(value):
+    raise NotConstant()
+  return value
+
+def power(lhs, rhs):
+  # MOO truncates negative integer powers to 0, and huge powers are not worth computing just to be refused.
+  if kind(lhs) is int and (rhs < 0 or (abs(lhs) > 1 and rhs > 64)):
+    raise NotConstant()
+  try:
+    result = lhs ** rhs
+  except (OverflowError, ZeroDivisionError):
+    raise NotConstant() from None
+  if type(result) is complex:
+    raise NotConstant()
+  return result
+
+ARITHMETIC = {
+  '+': lambda l, r: l + r,
+  '-': lambda l, r: l - r,
+  '*': lambda l, r: l * r,
+  '**': power,
+}
+
+def fold_binary(op, lhs, rhs):
+  if op not in ARITHMETIC or kind(lhs) != kind(rhs) or kind(lhs) not in (int, float, str):
+    raise NotConstant()
+  if kind(lhs) is str and op != '+':
+    raise NotConstant()
+  return check(ARITHMETIC[op](int(lhs) if kind(lhs) is int else lhs, int(rhs) if kind(rhs) is int else rhs))
+
+ORDERING = {
+  '<': lambda l, r: l < r,
+  '<=': lambda l, r: l <= r,
+  '>': lambda l, r: l > r,
+  '>=': lambda l, r: l >= r,
+}
+
+def comparable(value):
+  # MOO compares strings case-insensitively.
+  return value.lower() if kind(value) is str else value
+
+def fold_compare(op, lhs, rhs):
+  if op in ('==', 'is', '!=', 'is not'):
+    equal = kind(lhs) == kind(rhs) and comparable(lhs) == comparable(rhs)
+    return int(equal if op in ('==', 'is') else not equal)
+  if op in ORDERING and kind(lhs) == kind(rhs) and kind(lhs) in (int, float, str):
+    return int(ORDERING[op](comparable(lhs), comparable(rhs)))
+  raise NotConstant()
+
+def fold_bool(op, values, fold):
+  """Fold an and/or of values like MOO's && and ||, calling fold on each value only as far as needed."""
+  result = None
+  for value in values:
+    result = fold(value)
+    if moo_truth(result) == (op == 'or'):
+      break
+  return result
@@ -0,0 +1,91 @@
+"""Find methods small and pure enough to be inlined at their this:verb() call sites.
+
+A method qualifies when its body is a single return (after an optional
+docstring) of an expression that only reads its parameters, constants and
+properties of self, and calls nothing but side-effect-free builtins. Such a
+method cannot recurse and evaluating it twice is the same as evaluating it
+once, so a call to it can be replaced by its expression.
+"""
+import ast
+import textwrap
+
+from attr import attr, attributes
+
+DEFAULT_THRESHOLD = 12
+
+# Builtins, by their Python names, that only compute a value.
+PURE_BUILTINS = {'len', 'str', 'int', 'float', 'abs', 'min', 'max'}
+
+PURE_NODES = (ast.BinOp, ast.BoolOp, ast.Compare, ast.Name, ast.Constant, ast.Attribute, ast.Subscript, ast.Slice,
+  ast.List, ast.Tuple, ast.Dict, ast.Call)
+
+# Parts of the tree that are not expressions of their own.
+SYNTAX_NODES = (ast.operator, ast.boolop, ast.cmpop, ast.expr_context)
+
+@attributes
+class Candidate:
+  name = attr()
+  # The parameters in the order MOO passes them in args; a leading self is not one of them.
+  params = attr()
+  # Number of trailing parameters that have defaults.
+  defaults = attr()
+  size = attr()
+
+  def bind(self, args, keywords, default_nodes):
+    """Map each parameter to the node it is called with, or return None if the call cannot be matched."""
+    if len(args) > len(self.params):
+      return None
+    bindings = dict(zip(self.params, args))
+    for keyword in keywords or ():
+      if keyword.arg not in self.params or keyword.arg in bindings:
+        return None
+      bindings[keyword.arg] = keyword.value
+    first_default = len(self.params) - self.defaults
+    for n, param in enumerate(self.params):
+      if param not in bindings:
+        if n < first_default:
+          return None
+        bindings[param] = default_nodes[n - first_default]
+    return bindings
+
+def expression_size(node, allowed_names):
+  """The number of expression nodes in node, or None if node is not pure."""
+  size = 0
+  for child in ast.walk(node):
+    if isinstance(child, SYNTAX_NODES):
+      continue
+    if not isinstance(child, PURE_NODES):
+      return None
+    if isinstance(child, ast.Call):
+      if not isinstance(child.func, ast.Name) or child.func.id not in PURE_BUILTINS or child.keywords:
+        return None
+      if any(isinstance(arg, ast.Starred) for arg in child.args):
+        return None
+    elif isinstance(child, ast.Name):
+      if not isinstance(child.ctx, ast.Load):
+        return None
+      if child.id not in allowed_names and child.id not in PURE_BUILTINS:
+        return None
+    size += 1
+  return size
+
+def find_candidate(source, threshold=DEFAULT_THRESHOLD):
+  """A Candidate for the method whose source is given, or None if it should not be inlined."""
+  definition = ast.parse(textwrap.dedent(source)).body[0]
+  if not isinstance(definition, ast.FunctionDef) or definition.decorator_list:
+    return None
+  arguments = definition.args
+  if arguments.vararg or arguments.kwarg or arguments.kwonlyargs or arguments.posonlyargs:
+    return None
+  body = definition.body
+  if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant):
+    body = body[1:]
+  if len(body) != 1 or not isinstance(body[0], ast.Return) or body[0].value is None:
+    return None
+  params = [arg.arg for arg in arguments.args]
+  if params and params[0] == 'self':
+    params = params[1:]
+  size = expression_size(body[0].value, set(params) | {'self'})
+  if size is None or size > threshold:
+    return None
+  return Candidate(definition.name, params, len(arguments.defaults), size)
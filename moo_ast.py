@@ -1,48 +1,47 @@
-from attr import attr, attributes, Factory
-from abc import abstractmethod
+from attr import attr, attributes
 import lark
+import moo_parser
+import re
 import typing
 
 def parse(code):
-  import moo_parser
-  parse_tree = moo_parser.parser.parse(code)
-  return build_ast(parse_tree)
+  return as_verb(moo_parser.get_parser(AST_BUILDER).parse(code))
 
-def build_ast(parse_tree, current_node=None):
+def parse_many(codes):
+  """Parse many verb programs with one shared parser, yielding a Verb or the parse error for each.
+
+  Errors are yielded rather than raised so that one broken program does not
+  stop a batch.
+  """
+  parser = moo_parser.get_parser(AST_BUILDER)
+  for code in codes:
+    try:
+      yield as_verb(parser.parse(code))
+    except (lark.exceptions.LarkError, ValueError) as e:
+      yield e
+
+def build_ast(parse_tree):
+  """Build the AST for a parse tree produced by moo_parser.parser, without recursion."""
   if isinstance(parse_tree, lark.Token):
-    transformer = TOKEN_TRANSFORMERS.get(parse_tree.type)
-    if transformer:
-      current_node = transformer(value=parse_tree.value)
-    else:
-      raise ValueError("Unknown token type " + parse_tree.type)
-    return current_node
-  if current_node == None and parse_tree.data == 'start':
-    current_node = Verb()
-    for child in parse_tree.children:
-      current_node.body.append(build_ast(child, current_node))
-    return current_node
-  if parse_tree.data in ('expression', "statement", "flow_statement") and len(parse_tree.children) == 1:
-    return build_ast(parse_tree.children[0], current_node)
-  node_type = NODE_BUILDERS.get(parse_tree.data)
-  if callable(node_type):
-    current_node = node_type.build_from_parse_tree(parse_tree.children)
-  else:
-    raise ValueError("Unknown node type " + parse_tree.data)
-  return current_node
+    return AST_BUILDER.token(parse_tree)
+  return as_verb(lark.visitors.Transformer_NonRecursive.transform(AST_BUILDER, parse_tree))
+
+def as_verb(result):
+  if type(result) is list:
+    return Verb(body=result)
+  return result
 
 @attributes(auto_attribs=True, slots=True)
 class ASTNode:
 
-  @classmethod
-  @abstractmethod
-  def build_from_parse_tree(cls, children: typing.List):
-    pass
+  def evaluate(self, frame=None, world=None):
+    """The value of this node as a MOO expression, run by moo_closures in frame and world."""
+    import moo_closures
+    return moo_closures.evaluate(self, frame, world)
 
 @attributes(auto_attribs=True, slots=True)
 class ASTValueNode(ASTNode):
-
-  def evaluate(self):
-    return this.value
+  pass
 
 @attributes(auto_attribs=True, slots=True)
 class Int(ASTValueNode):
@@ -54,11 +53,11 @@ class Float(ASTValueNode):
 
 @attributes(auto_attribs=True, slots=True)
 class ObjNum(ASTValueNode):
-  value: float = attr(default=-1)
+  value: int = attr(default=-1)
 
 @attributes(auto_attribs=True, slots=True)
 class List(ASTValueNode):
-  value: tuple = attr(default=())
+  value: typing.Tuple[ASTNode, ...] = attr(default=())
 
 @attributes(auto_attribs=True, slots=True)
 class String(ASTValueNode):
@@ -66,126 +65,361 @@ class String(ASTValueNode):
 
 @attributes(auto_attribs=True, slots=True)
 class Map(ASTValueNode):
-  value: dict = attr(default={})
+  # (key, value) pairs in source order.
+  value: typing.Tuple[typing.Tuple[ASTNode, ASTNode], ...] = attr(default=())
 
 @attributes(auto_attribs=True, slots=True)
 class Variable(ASTNode):
-  name: str = attr(default='')
+  name: str
+
+@attributes(auto_attribs=True, slots=True)
+class PropRef(ASTNode):
+  obj: ASTNode
+  name: ASTNode
 
-  @classmethod
-  def build_from_parse_tree(cls, children):
-    node = cls()
-    node.name = build_ast(children[0], node)
-    return node
+@attributes(auto_attribs=True, slots=True)
+class Splice(ASTNode):
+  """@value in a list or argument list"""
+  value: ASTNode
+
+@attributes(auto_attribs=True, slots=True)
+class Subscript(ASTNode):
+  base: ASTNode
+  index: ASTNode
+
+@attributes(auto_attribs=True, slots=True)
+class Range(ASTNode):
+  start: ASTNode
+  end: ASTNode
 
 @attributes(auto_attribs=True, slots=True)
 class VerbCall(ASTNode):
-  obj: ASTNode = Factory(ASTNode)
-  verb: str = attr(default="")
-  args: typing.Tuple[ASTNode] = Factory(tuple)
-
-  @classmethod
-  def build_from_parse_tree(cls, children):
-    node = cls()
-    node.obj = build_ast(children[0], node)
-    verb = children[1]
-    verb = String(value=verb.value)
-    node.verb = verb
-    args = children[2].children
-    node.args = tuple([build_ast(arg, node) for arg in args])
-    return node
+  obj: ASTNode
+  verb: ASTNode
+  args: typing.Tuple[ASTNode, ...]
 
 @attributes(auto_attribs=True, slots=True)
 class FunctionCall(ASTNode):
-  function: str = attr(default="")
-  args: typing.Tuple[ASTNode] = Factory(tuple)
-
-  @classmethod
-  def build_from_parse_tree(cls, children):
-    node = cls()
-    node.function = build_ast(children[0], node)
-    args = children[1].children
-    node.args = tuple([build_ast(arg, node) for arg in args])
-    return node
+  function: str
+  args: typing.Tuple[ASTNode, ...]
 
 @attributes(auto_attribs=True, slots=True)
 class Return(ASTNode):
-  value: ASTNode = Factory(ASTNode)
+  value: typing.Optional[ASTNode] = None
 
-  @classmethod
-  def build_from_parse_tree(cls, children):
-    node = cls()
-    node.value = build_ast(children[0], node)
-    return node
+@attributes(auto_attribs=True, slots=True)
+class Break(ASTNode):
+  label: typing.Optional[str] = None
+
+@attributes(auto_attribs=True, slots=True)
+class Continue(ASTNode):
+  label: typing.Optional[str] = None
+
+@attributes(auto_attribs=True, slots=True)
+class ElseIf(ASTNode):
+  condition: ASTNode
+  body: typing.List[ASTNode]
 
 @attributes(auto_attribs=True, slots=True)
 class If(ASTNode):
-  condition: ASTNode = Factory(ASTNode)
-  body: typing.List['ASTNode'] = Factory(list)
+  condition: ASTNode
+  body: typing.List[ASTNode]
+  elseifs: typing.List[ElseIf] = attr(default=())
+  orelse: typing.List[ASTNode] = attr(default=())
+
+@attributes(auto_attribs=True, slots=True)
+class While(ASTNode):
+  condition: ASTNode
+  body: typing.List[ASTNode]
+  label: typing.Optional[str] = None
+
+@attributes(auto_attribs=True, slots=True)
+class For(ASTNode):
+  """for variable[, index] in (iterable)"""
+  variable: str
+  iterable: ASTNode
+  body: typing.List[ASTNode]
+  index: typing.Optional[str] = None
+
+@attributes(auto_attribs=True, slots=True)
+class ForRange(ASTNode):
+  """for variable in [start..end]"""
+  variable: str
+  start: ASTNode
+  end: ASTNode
+  body: typing.List[ASTNode]
+
+@attributes(auto_attribs=True, slots=True)
+class Except(ASTNode):
+  # None for ANY.
+  codes: typing.Optional[ASTNode]
+  variable: typing.Optional[str]
+  body: typing.List[ASTNode]
+
+@attributes(auto_attribs=True, slots=True)
+class Try(ASTNode):
+  body: typing.List[ASTNode]
+  excepts: typing.List[Except]
+
+@attributes(auto_attribs=True, slots=True)
+class CompactTry(ASTNode):
+  expression: ASTNode
+  # None for ANY.
+  codes: typing.Optional[ASTNode]
+  default: typing.Optional[ASTNode] = None
+
+@attributes(auto_attribs=True, slots=True)
+class Fork(ASTNode):
+  delay: ASTNode
+  body: typing.List[ASTNode]
+  # The variable that gets the task id.
+  variable: typing.Optional[str] = None
+
+@attributes(auto_attribs=True, slots=True)
+class Ternary(ASTNode):
+  condition: ASTNode
+  if_true: ASTNode
+  if_false: ASTNode
 
-  @classmethod
-  def build_from_parse_tree(cls, children):
-    node = cls()
-    node.condition = build_ast(children[0], node)
-    for child in children[1].children:
-      node.body.append(build_ast(child, node))
-    return node
+@attributes(auto_attribs=True, slots=True)
+class Not(ASTNode):
+  operand: ASTNode
+
+@attributes(auto_attribs=True, slots=True)
+class UnaryMinus(ASTNode):
+  operand: ASTNode
 
 @attributes(auto_attribs=True, slots=True)
 class Comparison(ASTNode):
-  condition1: ASTNode = Factory(ASTNode)
-  operator: str = attr(default='')
-  condition2: ASTNode = Factory(ASTNode)
+  condition1: ASTNode
+  operator: str
+  condition2: ASTNode
 
-  @classmethod
-  def build_from_parse_tree(cls, children):
-    node = cls()
-    node.condition1 = build_ast(children[0], node)
-    node.operator = children[1].value
-    node.condition2 = build_ast(children[2], node)
-    return node
+@attributes(auto_attribs=True, slots=True)
+class LogicalOp(ASTNode):
+  """&& and ||"""
+  lhs: ASTNode
+  operator: str
+  rhs: ASTNode
+
+@attributes(auto_attribs=True, slots=True)
+class BinaryOp(ASTNode):
+  lhs: ASTNode
+  operator: str
+  rhs: ASTNode
 
 @attributes(auto_attribs=True, slots=True)
 class Assign(ASTNode):
-  lhs: ASTNode = Factory(ASTNode)
-  rhs: ASTNode = Factory(ASTNode)
+  lhs: ASTNode
+  rhs: ASTNode
 
-  @classmethod
-  def build_from_parse_tree(cls, children):
-    node = cls()
-    node.lhs= build_ast(children[0], node)
-    node.rhs = build_ast(children[1], node)
-    return node
+@attributes(auto_attribs=True, slots=True)
+class ScatterTarget(ASTNode):
+  name: str
+  # 'required', 'optional' or 'rest'.
+  kind: str = 'required'
+  default: typing.Optional[ASTNode] = None
 
 @attributes(auto_attribs=True, slots=True)
 class ScatterAssign(ASTNode):
-  lhs: typing.List[ASTNode] = Factory(list)
-  rhs: ASTNode = Factory(ASTNode)
-
-  @classmethod
-  def build_from_parse_tree(cls, children):
-    node = cls()
-    node.lhs = build_ast(children[0], node)
-    node.rhs = build_ast(children[1], node)
-    return node
+  lhs: typing.List[ScatterTarget]
+  rhs: ASTNode
 
 @attributes(auto_attribs=True, slots=True)
 class Verb(ASTNode):
-  body: typing.List['ASTNode'] = Factory(list)
-
-TOKEN_TRANSFORMERS = {
-  'SIGNED_INT': Int,
-  'ESCAPED_STRING': String,
-  'OBJ_NUM': ObjNum,
-  'VAR': lambda value: Variable(name=value),
-}
-
-NODE_BUILDERS = {
-  'if': If,
-  'comparison': Comparison,
-  'assignment': Assign,
-  'return': Return,
-  'function_call': FunctionCall,
-  'verb_call': VerbCall,
-  'scatter_assignment': ScatterAssign,
-}
+  body: typing.List['ASTNode']
+
+def unquote(value):
+  return re.sub(r'\\(.)', r'\1', value[1:-1])
+
+def name_of(node):
+  return node.name if type(node) is Variable else str(node)
+
+def any_codes(codes):
+  """Error codes of an except clause, None meaning ANY."""
+  if type(codes) is Variable and codes.name == 'ANY':
+    return None
+  return codes
+
+def left_fold(node_type, children):
+  """Build a left-associative chain of node_type from operand, operator, operand, ..."""
+  node = children[0]
+  for i in range(1, len(children), 2):
+    node = node_type(node, str(children[i]), children[i + 1])
+  return node
+
+class ASTBuilder(lark.Transformer):
+  """Turns moo.lark parse trees into AST nodes bottom-up, building every node once.
+
+  Given to the LALR parser it runs as the parser reduces each rule, so no parse
+  tree is kept and no recursion is involved; build_ast applies it to an
+  existing tree with lark's non-recursive transformer.
+  """
+
+  def token(self, token):
+    callback = getattr(self, token.type, None)
+    if callback is None:
+      raise ValueError("Unknown token type " + token.type)
+    return callback(token)
+
+  def __default_token__(self, token):
+    return self.token(token) if hasattr(self, token.type) else token
+
+  def SIGNED_INT(self, token):
+    return Int(token)
+
+  def SIGNED_FLOAT(self, token):
+    return Float(token)
+
+  def ESCAPED_STRING(self, token):
+    return String(unquote(token))
+
+  def OBJ_NUM(self, token):
+    return ObjNum(int(token[1:]))
+
+  def VAR(self, token):
+    return Variable(str(token))
+
+  def ANY(self, token):
+    return Variable(str(token))
+
+  def negation(self, children):
+    return Not(children[1])
+
+  def unary_minus(self, children):
+    return UnaryMinus(children[1])
+
+  def splice(self, children):
+    return Splice(children[1])
+
+  def list(self, children):
+    return List(tuple(child for child in children if child is not None))
+
+  def map(self, children):
+    return Map(tuple(child for child in children if child is not None))
+
+  def map_item(self, children):
+    return (children[0], children[1])
+
+  def prop_ref(self, children):
+    obj, name = children
+    return PropRef(obj, String(name.name))
+
+  def computed_prop_ref(self, children):
+    return PropRef(children[0], children[1])
+
+  def arg_list(self, children):
+    return tuple(child for child in children if child is not None)
+
+  def function_call(self, children):
+    return FunctionCall(name_of(children[0]), children[1])
+
+  def verb_call(self, children):
+    obj, verb, args = children
+    return VerbCall(obj, String(verb.name), args)
+
+  def computed_verb_call(self, children):
+    return VerbCall(*children)
+
+  def flow_statement(self, children):
+    return children[0]
+
+  def break_(self, children):
+    return Break(name_of(children[0]) if children[0] is not None else None)
+
+  def continue_(self, children):
+    return Continue(name_of(children[0]) if children[0] is not None else None)
+
+  def return_(self, children):
+    return Return(children[0])
+
+  def assignment(self, children):
+    return Assign(children[0], children[1])
+
+  def default_val(self, children):
+    return ScatterTarget(name_of(children[0]), 'optional', children[1])
+
+  def scatter_names(self, children):
+    targets = []
+    rest = False
+    for child in children:
+      if type(child) is lark.Token:
+        rest = True
+      elif child is not None:
+        targets.append(child if type(child) is ScatterTarget else ScatterTarget(name_of(child), 'rest' if rest else 'required'))
+        rest = False
+    return targets
+
+  def scatter_assignment(self, children):
+    return ScatterAssign(children[0], children[1])
+
+  def bin_expr(self, children):
+    return BinaryOp(children[0], str(children[1]), children[2])
+
+  def subscript(self, children):
+    return Subscript(children[0], children[1])
+
+  def slice(self, children):
+    return Range(children[0], children[1])
+
+  def statement(self, children):
+    return children[0] if children else None
+
+  def comparison(self, children):
+    return left_fold(Comparison, children)
+
+  def multi_comparison(self, children):
+    return left_fold(LogicalOp, children)
+
+  def if_(self, children):
+    condition, body, *rest = children
+    orelse = rest.pop() if rest and type(rest[-1]) is tuple else ()
+    return If(condition, body, list(rest), list(orelse))
+
+  def elseif(self, children):
+    return ElseIf(children[0], children[1])
+
+  def else_(self, children):
+    return tuple(children[0])
+
+  def for_(self, children):
+    variable, index, iterable, body = children
+    if type(iterable) is Range:
+      return ForRange(name_of(variable), iterable.start, iterable.end, body)
+    return For(name_of(variable), iterable, body, name_of(index) if index is not None else None)
+
+  def while_(self, children):
+    label = None
+    if len(children) == 3:
+      label = name_of(children.pop(0))
+    return While(children[0], children[1], label)
+
+  def try_(self, children):
+    return Try(children[0], [child for child in children[1:] if child is not None])
+
+  def except_(self, children):
+    variable, codes, body = children
+    return Except(any_codes(codes), name_of(variable) if variable is not None else None, body)
+
+  def code_list(self, children):
+    return List(tuple(children))
+
+  def compact_try(self, children):
+    expression, codes, default = children
+    return CompactTry(expression, any_codes(codes), default)
+
+  def fork(self, children):
+    variable, delay, body = children
+    return Fork(delay, body, name_of(variable) if variable is not None else None)
+
+  def ternary(self, children):
+    return Ternary(children[0], children[1], children[2])
+
+  def start(self, children):
+    return [child for child in children if child is not None]
+
+# Rules named after Python keywords.
+for rule in ('break', 'continue', 'return', 'if', 'else', 'for', 'while', 'try', 'except'):
+  setattr(ASTBuilder, rule, getattr(ASTBuilder, rule + '_'))
+
+AST_BUILDER = ASTBuilder()
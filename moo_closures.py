@@ -0,0 +1,538 @@
+"""Run moo_ast trees by compiling them to nested Python closures.
+
+Each node of a verb becomes one closure taking (engine, variables), built once
+when the verb is compiled, so running it involves no per-node dispatch.
+Statements return None to carry on or a (kind, value) signal to return from
+the verb or leave a loop. ClosureEngine runs the result against the same
+Frame and World as moo_vm.VM.
+"""
+from attr import attr, attributes, Factory
+import time
+
+import moo_ast
+from moo_compiler import FOLDERS, NotConstant, fold, objnum
+from moo_runtime import (BUILTIN_VARIABLES, UNBOUND, Engine, Error, Frame, MooError, ObjRef, World, catches, moo_index,
+  moo_index_set, moo_negate, moo_range, moo_range_set)
+from moo_vm import ExecutionResult, ForkedTask, OutOfTicks
+
+RETURN, BREAK, CONTINUE = 'return', 'break', 'continue'
+
+SYSTEM_OBJECT = ObjRef(0)
+
+@attributes(slots=True)
+class ClosureProgram:
+  """A compiled verb, ready to be attached to an object in the World."""
+  body = attr(repr=False)
+  var_names: list = attr(default=Factory(lambda: list(BUILTIN_VARIABLES)))
+
+def constant(value):
+  return lambda vm, v: value
+
+def escapes(signal, label):
+  """Whether a signal from a loop body is meant for the verb or an enclosing loop rather than this loop."""
+  return signal[0] is RETURN or signal[1] not in (None, label)
+
+@attributes
+class ClosureCompiler:
+  """Compile one moo_ast.Verb into a ClosureProgram."""
+  var_names: list = attr(default=Factory(lambda: list(BUILTIN_VARIABLES)))
+
+  def __attrs_post_init__(self):
+    self.statement_compilers = {
+      moo_ast.If: self.compile_if,
+      moo_ast.While: self.compile_while,
+      moo_ast.For: self.compile_for,
+      moo_ast.ForRange: self.compile_for_range,
+      moo_ast.Try: self.compile_try,
+      moo_ast.Return: self.compile_return,
+      moo_ast.Break: self.compile_jump,
+      moo_ast.Continue: self.compile_jump,
+      moo_ast.Fork: self.compile_fork,
+    }
+    self.expression_compilers = {
+      moo_ast.Int: self.compile_value,
+      moo_ast.Float: self.compile_value,
+      moo_ast.String: self.compile_value,
+      moo_ast.ObjNum: self.compile_objnum,
+      moo_ast.List: self.compile_list,
+      moo_ast.Map: self.compile_map,
+      moo_ast.Variable: self.compile_variable,
+      moo_ast.PropRef: self.compile_prop_ref,
+      moo_ast.Subscript: self.compile_subscript,
+      moo_ast.Assign: self.compile_assign,
+      moo_ast.ScatterAssign: self.compile_scatter,
+      moo_ast.BinaryOp: self.compile_binary,
+      moo_ast.Comparison: self.compile_binary,
+      moo_ast.LogicalOp: self.compile_logical,
+      moo_ast.Not: self.compile_not,
+      moo_ast.UnaryMinus: self.compile_unary_minus,
+      moo_ast.Ternary: self.compile_ternary,
+      moo_ast.CompactTry: self.compile_compact_try,
+      moo_ast.FunctionCall: self.compile_function_call,
+      moo_ast.VerbCall: self.compile_verb_call,
+    }
+
+  def compile(self, verb):
+    return ClosureProgram(self.compile_block(verb.body), self.var_names)
+
+  def var(self, name):
+    try:
+      return self.var_names.index(name)
+    except ValueError:
+      self.var_names.append(name)
+      return len(self.var_names) - 1
+
+  def compile_block(self, statements):
+    statements = tuple(self.compile_statement(statement) for statement in statements)
+    def block(vm, v):
+      for statement in statements:
+        vm.tick()
+        signal = statement(vm, v)
+        if signal is not None:
+          return signal
+    return block
+
+  def compile_statement(self, node):
+    compiler = self.statement_compilers.get(type(node))
+    if compiler is not None:
+      return compiler(node)
+    expression = self.compile_expression(node)
+    def statement(vm, v):
+      expression(vm, v)
+    return statement
+
+  def compile_expression(self, node):
+    try:
+      return constant(fold(node))
+    except NotConstant:
+      pass
+    compiler = self.expression_compilers.get(type(node))
+    if compiler is None:
+      raise NotImplementedError("Cannot compile %s" % type(node).__name__)
+    return compiler(node)
+
+  def compile_if(self, node):
+    condition = self.compile_expression(node.condition)
+    body = self.compile_block(node.body)
+    orelse = self.compile_block(node.orelse)
+    if not node.elseifs:
+      def run_if(vm, v):
+        if condition(vm, v):
+          return body(vm, v)
+        return orelse(vm, v)
+      return run_if
+    branches = ((condition, body),) + tuple(
+      (self.compile_expression(elseif.condition), self.compile_block(elseif.body)) for elseif in node.elseifs)
+    def run_if_chain(vm, v):
+      for condition, body in branches:
+        if condition(vm, v):
+          return body(vm, v)
+      return orelse(vm, v)
+    return run_if_chain
+
+  def compile_while(self, node):
+    condition = self.compile_expression(node.condition)
+    body = self.compile_block(node.body)
+    label = node.label
+    def run_while(vm, v):
+      while condition(vm, v):
+        vm.tick()
+        signal = body(vm, v)
+        if signal is not None:
+          if escapes(signal, label):
+            return signal
+          if signal[0] is BREAK:
+            break
+    return run_while
+
+  def compile_for(self, node):
+    iterable = self.compile_expression(node.iterable)
+    body = self.compile_block(node.body)
+    slot = self.var(node.variable)
+    index_slot = self.var(node.index) if node.index is not None else None
+    # A for loop is labelled by its variable.
+    label = node.variable
+    def run_for(vm, v):
+      items = iterable(vm, v)
+      if type(items) is tuple:
+        pairs = enumerate(items, 1)
+      elif type(items) is dict:
+        pairs = items.items()
+      else:
+        raise MooError(Error.E_TYPE)
+      for index, value in pairs:
+        vm.tick()
+        v[slot] = value
+        if index_slot is not None:
+          v[index_slot] = index
+        signal = body(vm, v)
+        if signal is not None:
+          if escapes(signal, label):
+            return signal
+          if signal[0] is BREAK:
+            break
+    return run_for
+
+  def compile_for_range(self, node):
+    start = self.compile_expression(node.start)
+    end = self.compile_expression(node.end)
+    body = self.compile_block(node.body)
+    slot = self.var(node.variable)
+    label = node.variable
+    def run_for_range(vm, v):
+      first = start(vm, v)
+      last = end(vm, v)
+      if type(first) is not int or type(last) is not int:
+        raise MooError(Error.E_TYPE)
+      for value in range(first, last + 1):
+        vm.tick()
+        v[slot] = value
+        signal = body(vm, v)
+        if signal is not None:
+          if escapes(signal, label):
+            return signal
+          if signal[0] is BREAK:
+            break
+    return run_for_range
+
+  def compile_try(self, node):
+    body = self.compile_block(node.body)
+    handlers = tuple((
+      self.compile_expression(handler.codes) if handler.codes is not None else None,
+      self.var(handler.variable) if handler.variable is not None else None,
+      self.compile_block(handler.body),
+    ) for handler in node.excepts)
+    def run_try(vm, v):
+      try:
+        return body(vm, v)
+      except MooError as e:
+        for codes, slot, handler in handlers:
+          if codes is None or catches(codes(vm, v), e.error):
+            if slot is not None:
+              v[slot] = e.as_value()
+            return handler(vm, v)
+        raise
+    return run_try
+
+  def compile_fork(self, node):
+    delay = self.compile_expression(node.delay)
+    body = ClosureProgram(self.compile_block(node.body), self.var_names)
+    slot = self.var(node.variable) if node.variable is not None else None
+    def run_fork(vm, v):
+      when = delay(vm, v)
+      task_id = vm.new_task_id(when)
+      if slot is not None:
+        v[slot] = task_id
+      # Like the VM, the task gets a copy of the variables as they are now.
+      vm.forked.append(ForkedTask(task_id, when, body, None, list(v), vm.frame))
+    return run_fork
+
+  def compile_return(self, node):
+    if node.value is None:
+      return constant((RETURN, 0))
+    value = self.compile_expression(node.value)
+    return lambda vm, v: (RETURN, value(vm, v))
+
+  def compile_jump(self, node):
+    return constant((BREAK if type(node) is moo_ast.Break else CONTINUE, node.label))
+
+  def compile_value(self, node):
+    return constant(node.value)
+
+  def compile_objnum(self, node):
+    return constant(objnum(node))
+
+  def compile_list(self, node):
+    return self.compile_arguments(node.value)
+
+  def compile_arguments(self, items):
+    if any(type(item) is moo_ast.Splice for item in items):
+      return self.compile_splices(items)
+    items = tuple(self.compile_expression(item) for item in items)
+    if not items:
+      return constant(())
+    return lambda vm, v: tuple([item(vm, v) for item in items])
+
+  def compile_splices(self, items):
+    items = tuple((type(item) is moo_ast.Splice, self.compile_expression(item.value if type(item) is moo_ast.Splice else item))
+      for item in items)
+    def splice(vm, v):
+      result = []
+      for spliced, item in items:
+        value = item(vm, v)
+        if not spliced:
+          result.append(value)
+        elif type(value) is tuple:
+          result.extend(value)
+        else:
+          raise MooError(Error.E_TYPE)
+      return tuple(result)
+    return splice
+
+  def compile_map(self, node):
+    items = tuple((self.compile_expression(key), self.compile_expression(value)) for key, value in node.value)
+    def build_map(vm, v):
+      result = {}
+      for key, value in items:
+        # Each value is evaluated before its key, as in the VM.
+        item = value(vm, v)
+        result[key(vm, v)] = item
+      return result
+    return build_map
+
+  def compile_variable(self, node):
+    name = node.name
+    if name in Error.__members__:
+      return constant(Error[name])
+    if name.startswith('$'):
+      prop = name[1:]
+      return lambda vm, v: vm.world.get_prop(SYSTEM_OBJECT, prop)
+    slot = self.var(name)
+    def read(vm, v):
+      value = v[slot]
+      if value is UNBOUND:
+        raise MooError(Error.E_VARNF, "Variable not found: %s" % name)
+      return value
+    return read
+
+  def compile_prop_ref(self, node):
+    obj = self.compile_expression(node.obj)
+    name = self.compile_expression(node.name)
+    return lambda vm, v: vm.world.get_prop(obj(vm, v), name(vm, v))
+
+  def compile_subscript(self, node):
+    base = self.compile_expression(node.base)
+    if type(node.index) is moo_ast.Range:
+      start = self.compile_expression(node.index.start)
+      end = self.compile_expression(node.index.end)
+      return lambda vm, v: moo_range(base(vm, v), start(vm, v), end(vm, v))
+    index = self.compile_expression(node.index)
+    return lambda vm, v: moo_index(base(vm, v), index(vm, v))
+
+  def compile_assign(self, node):
+    value = self.compile_expression(node.rhs)
+    if type(node.lhs) is moo_ast.Variable and not node.lhs.name.startswith('$'):
+      slot = self.var(node.lhs.name)
+      def assign_variable(vm, v):
+        v[slot] = result = value(vm, v)
+        return result
+      return assign_variable
+    store = self.compile_store(node.lhs)
+    def assign(vm, v):
+      result = value(vm, v)
+      store(vm, v, result)
+      return result
+    return assign
+
+  def compile_store(self, node):
+    """Compile an assignment target to a closure taking (engine, variables, value)."""
+    kind = type(node)
+    if kind is moo_ast.Variable:
+      if node.name.startswith('$'):
+        prop = node.name[1:]
+        return lambda vm, v, value: vm.world.put_prop(SYSTEM_OBJECT, prop, value)
+      slot = self.var(node.name)
+      def store_variable(vm, v, value):
+        v[slot] = value
+      return store_variable
+    if kind is moo_ast.PropRef:
+      obj = self.compile_expression(node.obj)
+      name = self.compile_expression(node.name)
+      return lambda vm, v, value: vm.world.put_prop(obj(vm, v), name(vm, v), value)
+    if kind is moo_ast.Subscript:
+      # Lists and strings are values, so the updated copy is stored back where the base came from.
+      if type(node.base) is moo_ast.Subscript and type(node.base.index) is moo_ast.Range:
+        raise NotImplementedError("Cannot assign to an element of a range")
+      base = self.compile_expression(node.base)
+      store_base = self.compile_store(node.base)
+      if type(node.index) is moo_ast.Range:
+        start = self.compile_expression(node.index.start)
+        end = self.compile_expression(node.index.end)
+        return lambda vm, v, value: store_base(vm, v, moo_range_set(base(vm, v), start(vm, v), end(vm, v), value))
+      index = self.compile_expression(node.index)
+      return lambda vm, v, value: store_base(vm, v, moo_index_set(base(vm, v), index(vm, v), value))
+    raise NotImplementedError("Cannot assign to %s" % kind.__name__)
+
+  def compile_scatter(self, node):
+    value = self.compile_expression(node.rhs)
+    targets = tuple((
+      self.var(target.name),
+      target.kind,
+      self.compile_expression(target.default) if target.default is not None else None,
+    ) for target in node.lhs)
+    required = sum(1 for slot, kind, default in targets if kind == 'required')
+    optional = sum(1 for slot, kind, default in targets if kind == 'optional')
+    most = float('inf') if any(kind == 'rest' for slot, kind, default in targets) else required + optional
+    def scatter(vm, v):
+      values = value(vm, v)
+      if type(values) is not tuple:
+        raise MooError(Error.E_TYPE)
+      if not required <= len(values) <= most:
+        raise MooError(Error.E_ARGS)
+      supplied = min(optional, len(values) - required)
+      rest = len(values) - required - supplied
+      position = 0
+      for slot, kind, default in targets:
+        if kind == 'rest':
+          v[slot] = values[position:position + rest]
+          position += rest
+        elif kind == 'required' or supplied:
+          if kind == 'optional':
+            supplied -= 1
+          v[slot] = values[position]
+          position += 1
+        elif default is not None:
+          v[slot] = default(vm, v)
+      return values
+    return scatter
+
+  def compile_binary(self, node):
+    lhs, rhs = (node.condition1, node.condition2) if type(node) is moo_ast.Comparison else (node.lhs, node.rhs)
+    lhs = self.compile_expression(lhs)
+    rhs = self.compile_expression(rhs)
+    operator = FOLDERS[node.operator]
+    return lambda vm, v: operator(lhs(vm, v), rhs(vm, v))
+
+  def compile_logical(self, node):
+    lhs = self.compile_expression(node.lhs)
+    rhs = self.compile_expression(node.rhs)
+    # Like MOO's && and ||, Python's and/or give the deciding operand itself.
+    if node.operator == '&&':
+      return lambda vm, v: lhs(vm, v) and rhs(vm, v)
+    return lambda vm, v: lhs(vm, v) or rhs(vm, v)
+
+  def compile_not(self, node):
+    operand = self.compile_expression(node.operand)
+    return lambda vm, v: int(not operand(vm, v))
+
+  def compile_unary_minus(self, node):
+    operand = self.compile_expression(node.operand)
+    return lambda vm, v: moo_negate(operand(vm, v))
+
+  def compile_ternary(self, node):
+    condition = self.compile_expression(node.condition)
+    if_true = self.compile_expression(node.if_true)
+    if_false = self.compile_expression(node.if_false)
+    return lambda vm, v: if_true(vm, v) if condition(vm, v) else if_false(vm, v)
+
+  def compile_compact_try(self, node):
+    expression = self.compile_expression(node.expression)
+    codes = self.compile_expression(node.codes) if node.codes is not None else None
+    default = self.compile_expression(node.default) if node.default is not None else None
+    def compact_try(vm, v):
+      try:
+        return expression(vm, v)
+      except MooError as e:
+        if codes is not None and not catches(codes(vm, v), e.error):
+          raise
+        return e.error if default is None else default(vm, v)
+    return compact_try
+
+  def compile_function_call(self, node):
+    name = node.function
+    args = self.compile_arguments(node.args)
+    return lambda vm, v: vm.call_builtin(name, args(vm, v))
+
+  def compile_verb_call(self, node):
+    obj = self.compile_expression(node.obj)
+    verb = self.compile_expression(node.verb)
+    args = self.compile_arguments(node.args)
+    return lambda vm, v: vm.call_verb(obj(vm, v), verb(vm, v), args(vm, v))
+
+@attributes
+class ClosureEngine(Engine):
+  """Runs ClosurePrograms with the same Frame, World and limits as moo_vm.VM.
+
+  A tick is charged for every statement and loop iteration rather than for
+  every instruction, so a verb uses fewer ticks here than in the VM and gets
+  further before max_ticks stops it. Side effects happen in the same order.
+  """
+  world: World = attr(default=Factory(World), repr=False)
+  frame: Frame = attr(default=Factory(Frame), repr=False)
+  return_value = attr(default=0)
+  ticks: int = attr(default=0)
+  max_ticks: int = attr(default=30000)
+  max_seconds: float = attr(default=5.0)
+  max_depth: int = attr(default=50)
+  error = attr(default=None)
+  forked: list = attr(default=Factory(list), repr=False)
+
+  def __attrs_post_init__(self):
+    self.depth = 0
+    self.next_task_id = 1
+    self.init_builtins()
+
+  def run_program(self, program, frame=None) -> ExecutionResult:
+    frame = frame if frame is not None else Frame()
+    return self.run_task(program.body, frame.variables(program.var_names), frame)
+
+  def run_forked(self):
+    """Run queued forked tasks in order of their delay, including any they fork themselves."""
+    results = []
+    while self.forked:
+      self.forked.sort(key=lambda task: task.delay)
+      task = self.forked.pop(0)
+      results.append((task, self.run_task(task.program.body, task.variables, task.frame)))
+    return results
+
+  def run_task(self, body, variables, frame):
+    self.ticks = 0
+    self.error = None
+    self.return_value = 0
+    self.depth = 0
+    self.started = time.monotonic()
+    self.frame = frame
+    try:
+      self.return_value = self.run_body(body, variables)
+    except MooError as e:
+      self.error = e
+      return ExecutionResult.RAISE
+    except RecursionError:
+      self.error = MooError(Error.E_MAXREC)
+      return ExecutionResult.RAISE
+    except OutOfTicks:
+      return ExecutionResult.KILL
+    return ExecutionResult.RETURN
+
+  def execute(self, program, frame):
+    return self.run_body(program.body, frame.variables(program.var_names))
+
+  def run_body(self, body, variables):
+    signal = body(self, variables)
+    if signal is not None and signal[0] is RETURN:
+      return signal[1]
+    return 0
+
+  def tick(self):
+    self.ticks += 1
+    if self.ticks > self.max_ticks:
+      raise OutOfTicks()
+
+  def call_verb(self, obj, name, args):
+    """Run verb name on obj with args in a new activation and return its value."""
+    verb = self.world.find_verb(obj, name)
+    if callable(verb):
+      return verb(self, obj, args)
+    if self.depth >= self.max_depth:
+      raise MooError(Error.E_MAXREC)
+    caller = self.frame
+    self.frame = Frame(this=obj, verb=name, args=args, player=caller.player, caller=caller.this)
+    self.depth += 1
+    try:
+      return self.execute(verb, self.frame)
+    finally:
+      self.depth -= 1
+      self.frame = caller
+
+def compile_verb(verb):
+  return ClosureCompiler().compile(verb)
+
+def evaluate(node, frame=None, world=None):
+  """The value of the expression node, raising the MooError it raises."""
+  engine = ClosureEngine(world=world if world is not None else World())
+  result = engine.run_program(compile_verb(moo_ast.Verb(body=[moo_ast.Return(node)])), frame)
+  if result is ExecutionResult.RAISE:
+    raise engine.error
+  if result is ExecutionResult.KILL:
+    raise OutOfTicks()
+  return engine.return_value
@@ -0,0 +1,614 @@
+"""Lower moo_ast trees to moo_vm bytecode."""
+from attr import attr, attributes, Factory
+import math
+
+import moo_ast
+from moo_opcodes import opcodes, extended_opcodes
+from moo_runtime import (BUILTIN_VARIABLES, INT_MAX, INT_MIN, Error, MooError, ObjRef, moo_add, moo_compare, moo_div,
+  moo_equal, moo_exp, moo_in, moo_mod, moo_mul, moo_negate, moo_sub)
+from moo_vm import Label, Program
+
+class NotConstant(Exception):
+  pass
+
+BINARY_OPCODES = {
+  '+': opcodes.ADD,
+  '-': opcodes.MINUS,
+  '*': opcodes.MULT,
+  '/': opcodes.DIV,
+  '%': opcodes.MOD,
+  '==': opcodes.EQ,
+  '!=': opcodes.NE,
+  '<': opcodes.LT,
+  '<=': opcodes.LE,
+  '>': opcodes.GT,
+  '>=': opcodes.GE,
+  'in': opcodes.IN,
+}
+
+# How the compiler evaluates each operator when both operands are constants.
+FOLDERS = {
+  '+': moo_add,
+  '-': moo_sub,
+  '*': moo_mul,
+  '/': moo_div,
+  '%': moo_mod,
+  '^': moo_exp,
+  '==': lambda l, r: int(moo_equal(l, r)),
+  '!=': lambda l, r: int(not moo_equal(l, r)),
+  '<': lambda l, r: int(moo_compare(l, r) < 0),
+  '<=': lambda l, r: int(moo_compare(l, r) <= 0),
+  '>': lambda l, r: int(moo_compare(l, r) > 0),
+  '>=': lambda l, r: int(moo_compare(l, r) >= 0),
+  'in': moo_in,
+}
+
+# Instructions after which control never falls through to the next one.
+TERMINATORS = {opcodes.JUMP, opcodes.RETURN, opcodes.RETURN_0, opcodes.DONE}
+
+# Instructions whose last operand is a jump target.
+JUMPS = {opcodes.IF, opcodes.WHILE, opcodes.EIF, opcodes.IF_QUES, opcodes.AND, opcodes.OR, opcodes.JUMP,
+  opcodes.FOR_RANGE, opcodes.FOR_LIST, opcodes.FORK, opcodes.FORK_WITH_ID}
+
+@attributes
+class Compiler:
+  """Compile one moo_ast.Verb into a Program.
+
+  Instructions are collected as (opcode, *operands) tuples with Label markers
+  in between, then optimized by peephole() before being assembled.
+  """
+  optimize: bool = attr(default=True)
+  instructions: list = attr(default=Factory(list))
+  var_names: list = attr(default=Factory(lambda: list(BUILTIN_VARIABLES)))
+  # (label, top, end, body depth, exit depth) of each loop being compiled, innermost last.
+  loops: list = attr(default=Factory(list))
+  # Values the statement being compiled has below it on the stack: for loop state and try markers.
+  depth: int = attr(default=0)
+
+  def __attrs_post_init__(self):
+    self.statement_compilers = {
+      moo_ast.If: self.compile_if,
+      moo_ast.Return: self.compile_return,
+      moo_ast.While: self.compile_while,
+      moo_ast.For: self.compile_for,
+      moo_ast.ForRange: self.compile_for_range,
+      moo_ast.Try: self.compile_try,
+      moo_ast.Break: self.compile_jump,
+      moo_ast.Continue: self.compile_jump,
+      moo_ast.Fork: self.compile_fork,
+    }
+    self.expression_compilers = {
+      moo_ast.Int: self.compile_value,
+      moo_ast.Float: self.compile_value,
+      moo_ast.String: self.compile_value,
+      moo_ast.ObjNum: self.compile_objnum,
+      moo_ast.List: self.compile_list,
+      moo_ast.Map: self.compile_map,
+      moo_ast.Variable: self.compile_variable,
+      moo_ast.Assign: self.compile_assign,
+      moo_ast.ScatterAssign: self.compile_scatter,
+      moo_ast.BinaryOp: self.compile_binary,
+      moo_ast.Comparison: self.compile_comparison,
+      moo_ast.LogicalOp: self.compile_logical,
+      moo_ast.Not: self.compile_not,
+      moo_ast.UnaryMinus: self.compile_unary_minus,
+      moo_ast.Ternary: self.compile_ternary,
+      moo_ast.CompactTry: self.compile_compact_try,
+      moo_ast.PropRef: self.compile_prop_ref,
+      moo_ast.Subscript: self.compile_subscript,
+      moo_ast.FunctionCall: self.compile_function_call,
+      moo_ast.VerbCall: self.compile_verb_call,
+    }
+
+  def compile(self, verb):
+    for statement in verb.body:
+      self.compile_statement(statement)
+    self.emit(opcodes.DONE)
+    instructions = peephole(self.instructions) if self.optimize else self.instructions
+    return Program.assemble(flatten(instructions), self.var_names)
+
+  def emit(self, *instruction):
+    self.instructions.append(instruction)
+
+  def place(self, label):
+    self.instructions.append(label)
+
+  def var(self, name):
+    try:
+      return self.var_names.index(name)
+    except ValueError:
+      self.var_names.append(name)
+      return len(self.var_names) - 1
+
+  def compile_statement(self, node):
+    compiler = self.statement_compilers.get(type(node))
+    if compiler is not None:
+      return compiler(node)
+    self.compile_expression(node)
+    self.emit(opcodes.POP)
+
+  def compile_expression(self, node):
+    if self.optimize:
+      try:
+        value = fold(node)
+      except NotConstant:
+        pass
+      else:
+        return self.emit(opcodes.IMM, value)
+    compiler = self.expression_compilers.get(type(node))
+    if compiler is None:
+      raise NotImplementedError("Cannot compile %s" % type(node).__name__)
+    compiler(node)
+
+  def compile_if(self, node):
+    if self.optimize:
+      try:
+        condition = fold(node.condition)
+      except NotConstant:
+        pass
+      else:
+        if condition:
+          for statement in node.body:
+            self.compile_statement(statement)
+        elif node.elseifs:
+          first, *rest = node.elseifs
+          self.compile_if(moo_ast.If(first.condition, first.body, rest, node.orelse))
+        else:
+          for statement in node.orelse:
+            self.compile_statement(statement)
+        return
+    end = Label()
+    branch = Label()
+    self.compile_expression(node.condition)
+    self.emit(opcodes.IF, branch)
+    for statement in node.body:
+      self.compile_statement(statement)
+    for elseif in node.elseifs:
+      self.emit(opcodes.JUMP, end)
+      self.place(branch)
+      branch = Label()
+      self.compile_expression(elseif.condition)
+      self.emit(opcodes.EIF, branch)
+      for statement in elseif.body:
+        self.compile_statement(statement)
+    if node.orelse:
+      self.emit(opcodes.JUMP, end)
+      self.place(branch)
+      for statement in node.orelse:
+        self.compile_statement(statement)
+    else:
+      self.place(branch)
+    self.place(end)
+
+  def compile_while(self, node):
+    top = Label()
+    end = Label()
+    self.place(top)
+    self.compile_expression(node.condition)
+    self.emit(opcodes.WHILE, end)
+    self.compile_loop_body(node.body, node.label, top, end, 0)
+    self.place(end)
+
+  def compile_for(self, node):
+    top = Label()
+    end = Label()
+    self.compile_expression(node.iterable)
+    self.emit(opcodes.IMM, 1)
+    self.place(top)
+    index = self.var(node.index) + 1 if node.index is not None else 0
+    self.emit(opcodes.FOR_LIST, self.var(node.variable), index, end)
+    self.compile_loop_body(node.body, node.variable, top, end, 2)
+    self.place(end)
+
+  def compile_for_range(self, node):
+    top = Label()
+    end = Label()
+    self.compile_expression(node.start)
+    self.compile_expression(node.end)
+    self.place(top)
+    self.emit(opcodes.FOR_RANGE, self.var(node.variable), end)
+    self.compile_loop_body(node.body, node.variable, top, end, 2)
+    self.place(end)
+
+  def compile_loop_body(self, body, label, top, end, state):
+    """Compile a loop body that jumps back to top, with state values of loop state on the stack while it runs."""
+    self.depth += state
+    self.loops.append((label, top, end, self.depth, self.depth - state))
+    for statement in body:
+      self.compile_statement(statement)
+    self.loops.pop()
+    self.depth -= state
+    self.emit(opcodes.JUMP, top)
+
+  def compile_jump(self, node):
+    """break and continue: a for loop is named by its variable, a while loop by its optional label."""
+    for label, top, end, depth, exit_depth in reversed(self.loops):
+      if node.label is None or node.label == label:
+        break
+    else:
+      raise ValueError("%s outside of a loop named %s" % (type(node).__name__.lower(), node.label or "anything"))
+    target, target_depth = (end, exit_depth) if type(node) is moo_ast.Break else (top, depth)
+    if target_depth == self.depth:
+      return self.emit(opcodes.JUMP, target)
+    self.emit(opcodes.EXTENDED, extended_opcodes.EXIT, target_depth, target)
+
+  def compile_try(self, node):
+    end = Label()
+    handlers = [Label() for handler in node.excepts]
+    for handler in node.excepts:
+      self.compile_codes(handler.codes)
+    self.emit(opcodes.EXTENDED, extended_opcodes.TRY_EXCEPT, tuple(handlers))
+    self.depth += 1
+    for statement in node.body:
+      self.compile_statement(statement)
+    self.depth -= 1
+    self.emit(opcodes.EXTENDED, extended_opcodes.END_EXCEPT, end)
+    for handler, label in zip(node.excepts, handlers):
+      # The error's {code, message, value, traceback} is on the stack.
+      self.place(label)
+      if handler.variable is not None:
+        self.emit(opcodes.PUT, self.var(handler.variable))
+      self.emit(opcodes.POP)
+      for statement in handler.body:
+        self.compile_statement(statement)
+      self.emit(opcodes.JUMP, end)
+    self.place(end)
+
+  def compile_fork(self, node):
+    """The forked task starts after the FORK with an empty stack and stops at the end of the body."""
+    end = Label()
+    self.compile_expression(node.delay)
+    if node.variable is None:
+      self.emit(opcodes.FORK, end)
+    else:
+      self.emit(opcodes.FORK_WITH_ID, self.var(node.variable), end)
+    loops, depth = self.loops, self.depth
+    self.loops, self.depth = [], 0
+    for statement in node.body:
+      self.compile_statement(statement)
+    self.loops, self.depth = loops, depth
+    self.emit(opcodes.DONE)
+    self.place(end)
+
+  def compile_codes(self, codes):
+    if codes is None:
+      self.emit(opcodes.IMM, None)
+    else:
+      self.compile_expression(codes)
+
+  def compile_return(self, node):
+    if node.value is None:
+      return self.emit(opcodes.RETURN_0)
+    self.compile_expression(node.value)
+    self.emit(opcodes.RETURN)
+
+  def compile_value(self, node):
+    self.emit(opcodes.IMM, node.value)
+
+  def compile_objnum(self, node):
+    self.emit(opcodes.IMM, objnum(node))
+
+  def compile_list(self, node):
+    self.compile_arguments(node.value)
+
+  def compile_arguments(self, items):
+    if not items:
+      return self.emit(opcodes.MAKE_EMPTY_LIST)
+    first, *rest = items
+    if type(first) is moo_ast.Splice:
+      self.compile_expression(first.value)
+      self.emit(opcodes.CHECK_LIST_FOR_SPLICE)
+    else:
+      self.compile_expression(first)
+      self.emit(opcodes.MAKE_SINGLETON_LIST)
+    for item in rest:
+      if type(item) is moo_ast.Splice:
+        self.compile_expression(item.value)
+        self.emit(opcodes.LIST_ADD_TAIL)
+      else:
+        self.compile_expression(item)
+        self.emit(opcodes.list_append)
+
+  def compile_map(self, node):
+    self.emit(opcodes.MAP_CREATE)
+    for key, value in node.value:
+      self.compile_expression(value)
+      self.compile_expression(key)
+      self.emit(opcodes.map_insert)
+
+  def compile_variable(self, node):
+    if node.name in Error.__members__:
+      return self.emit(opcodes.IMM, Error[node.name])
+    if node.name.startswith('$'):
+      return self.compile_prop_ref(system_property(node))
+    self.emit(opcodes.PUSH, self.var(node.name))
+
+  def compile_prop_ref(self, node):
+    self.compile_expression(node.obj)
+    self.compile_expression(node.name)
+    self.emit(opcodes.GET_PROP)
+
+  def compile_subscript(self, node):
+    self.compile_expression(node.base)
+    if type(node.index) is moo_ast.Range:
+      self.compile_expression(node.index.start)
+      self.compile_expression(node.index.end)
+      return self.emit(opcodes.RANGE_REF)
+    self.compile_expression(node.index)
+    self.emit(opcodes.REF)
+
+  def compile_scatter(self, node):
+    done = Label()
+    defaults = [Label() if target.default is not None else None for target in node.lhs]
+    targets = tuple((self.var(target.name), target.kind, label) for target, label in zip(node.lhs, defaults))
+    self.compile_expression(node.rhs)
+    self.emit(opcodes.EXTENDED, extended_opcodes.SCATTER, targets, done)
+    # SCATTER jumps to the first default needed; the optional targets after it need theirs too.
+    for target, label in zip(node.lhs, defaults):
+      if label is not None:
+        self.place(label)
+        self.compile_expression(target.default)
+        self.emit(opcodes.PUT, self.var(target.name))
+        self.emit(opcodes.POP)
+    self.place(done)
+
+  def compile_assign(self, node):
+    lhs = system_property(node.lhs)
+    if type(lhs) is moo_ast.Subscript:
+      return self.compile_indexed_assign(lhs, node.rhs)
+    if type(lhs) is moo_ast.PropRef:
+      self.compile_expression(lhs.obj)
+      self.compile_expression(lhs.name)
+      self.compile_expression(node.rhs)
+      return self.emit(opcodes.PUT_PROP)
+    if type(lhs) is not moo_ast.Variable:
+      raise NotImplementedError("Cannot assign to %s" % type(lhs).__name__)
+    self.compile_expression(node.rhs)
+    self.emit(opcodes.PUT, self.var(lhs.name))
+
+  def compile_indexed_assign(self, lhs, rhs):
+    """x[i][j] = v: update copies of the lists from the innermost one out and store the outermost back into x.
+
+    The value of the assignment is kept aside with PUT_TEMP while the copies are made.
+    """
+    path = []
+    while type(lhs) is moo_ast.Subscript:
+      path.insert(0, lhs.index)
+      lhs = system_property(lhs.base)
+    if type(lhs) is moo_ast.PropRef:
+      self.compile_expression(lhs.obj)
+      self.compile_expression(lhs.name)
+      self.emit(opcodes.PUSH_GET_PROP)
+    elif type(lhs) is moo_ast.Variable:
+      self.compile_expression(lhs)
+    else:
+      raise NotImplementedError("Cannot assign to %s" % type(lhs).__name__)
+    *outer, last = path
+    for index in outer:
+      if type(index) is moo_ast.Range:
+        raise NotImplementedError("Cannot assign to an element of a range")
+      self.compile_expression(index)
+      self.emit(opcodes.PUSH_REF)
+    if type(last) is moo_ast.Range:
+      self.compile_expression(last.start)
+      self.compile_expression(last.end)
+    else:
+      self.compile_expression(last)
+    self.compile_expression(rhs)
+    self.emit(opcodes.PUT_TEMP)
+    if type(last) is moo_ast.Range:
+      self.emit(opcodes.EXTENDED, extended_opcodes.RANGESET)
+    else:
+      self.emit(opcodes.INDEX_SET)
+    for index in outer:
+      self.emit(opcodes.INDEX_SET)
+    if type(lhs) is moo_ast.PropRef:
+      self.emit(opcodes.PUT_PROP)
+    else:
+      self.emit(opcodes.PUT, self.var(lhs.name))
+    self.emit(opcodes.POP)
+    self.emit(opcodes.PUSH_TEMP)
+
+  def compile_binary(self, node):
+    self.compile_expression(node.lhs)
+    self.compile_expression(node.rhs)
+    if node.operator == '^':
+      self.emit(opcodes.EXTENDED, extended_opcodes.EXP)
+    else:
+      self.emit(BINARY_OPCODES[node.operator])
+
+  def compile_comparison(self, node):
+    self.compile_expression(node.condition1)
+    self.compile_expression(node.condition2)
+    self.emit(BINARY_OPCODES[node.operator])
+
+  def compile_logical(self, node):
+    end = Label()
+    self.compile_expression(node.lhs)
+    self.emit(opcodes.AND if node.operator == '&&' else opcodes.OR, end)
+    self.compile_expression(node.rhs)
+    self.place(end)
+
+  def compile_not(self, node):
+    self.compile_expression(node.operand)
+    self.emit(opcodes.NOT)
+
+  def compile_unary_minus(self, node):
+    self.compile_expression(node.operand)
+    self.emit(opcodes.UNARY_MINUS)
+
+  def compile_ternary(self, node):
+    orelse = Label()
+    end = Label()
+    self.compile_expression(node.condition)
+    self.emit(opcodes.IF_QUES, orelse)
+    self.compile_expression(node.if_true)
+    self.emit(opcodes.JUMP, end)
+    self.place(orelse)
+    self.compile_expression(node.if_false)
+    self.place(end)
+
+  def compile_compact_try(self, node):
+    handler = Label()
+    end = Label()
+    self.compile_codes(node.codes)
+    self.emit(opcodes.EXTENDED, extended_opcodes.CATCH, handler)
+    self.compile_expression(node.expression)
+    self.emit(opcodes.EXTENDED, extended_opcodes.END_CATCH, end)
+    self.place(handler)
+    if node.default is None:
+      # The value is the error code from the error's list.
+      self.emit(opcodes.IMM, 1)
+      self.emit(opcodes.REF)
+    else:
+      self.emit(opcodes.POP)
+      self.compile_expression(node.default)
+    self.place(end)
+
+  def compile_function_call(self, node):
+    name = node.function.name if type(node.function) is moo_ast.Variable else node.function
+    self.compile_arguments(node.args)
+    self.emit(opcodes.BI_FUNC_CALL, name)
+
+  def compile_verb_call(self, node):
+    self.compile_expression(node.obj)
+    verb = node.verb
+    if type(verb) is str:
+      self.emit(opcodes.IMM, verb)
+    else:
+      self.compile_expression(verb)
+    self.compile_arguments(node.args)
+    self.emit(opcodes.CALL_VERB)
+
+def fold(node):
+  """Return the value of node if it can be computed at compile time, raising NotConstant otherwise."""
+  kind = type(node)
+  if kind in (moo_ast.Int, moo_ast.Float, moo_ast.String):
+    return node.value
+  if kind is moo_ast.ObjNum:
+    return objnum(node)
+  if kind is moo_ast.Variable and node.name in Error.__members__:
+    return Error[node.name]
+  if kind is moo_ast.List:
+    return tuple(fold(item) for item in node.value)
+  if kind is moo_ast.UnaryMinus:
+    return fold_operation(moo_negate, fold(node.operand))
+  if kind in (moo_ast.BinaryOp, moo_ast.Comparison):
+    lhs, rhs = operands(node)
+    return fold_operation(FOLDERS[node.operator], fold(lhs), fold(rhs))
+  raise NotConstant()
+
+def fold_operation(operation, *values):
+  """The result of operation, unless it raises or is a number MOO cannot hold; those are left to the running verb."""
+  try:
+    result = operation(*values)
+  except (MooError, ArithmeticError):
+    raise NotConstant() from None
+  if type(result) is int and not INT_MIN <= result <= INT_MAX:
+    raise NotConstant()
+  if type(result) is float and not math.isfinite(result):
+    raise NotConstant()
+  return result
+
+def system_property(node):
+  """$name is the property name of #0."""
+  if type(node) is moo_ast.Variable and node.name.startswith('$'):
+    return moo_ast.PropRef(moo_ast.ObjNum(0), moo_ast.String(node.name[1:]))
+  return node
+
+def operands(node):
+  if type(node) is moo_ast.Comparison:
+    return node.condition1, node.condition2
+  return node.lhs, node.rhs
+
+def objnum(node):
+  value = node.value
+  if type(value) is str:
+    value = int(value.lstrip('#'))
+  return ObjRef(value)
+
+def flatten(instructions):
+  for instruction in instructions:
+    if isinstance(instruction, Label):
+      yield instruction
+    else:
+      yield from instruction
+
+def peephole(instructions):
+  """Optimize a list of (opcode, *operands) tuples and Labels until nothing changes."""
+  changed = True
+  while changed:
+    before = len(instructions)
+    instructions = thread_jumps(instructions)
+    instructions = drop_unreachable(instructions)
+    instructions = simplify_pairs(instructions)
+    changed = len(instructions) != before
+  return instructions
+
+def thread_jumps(instructions):
+  """Point jumps that land on an unconditional JUMP straight at its destination."""
+  forward = {}
+  for i, instruction in enumerate(instructions):
+    if isinstance(instruction, Label):
+      target = next((later for later in instructions[i + 1:] if not isinstance(later, Label)), None)
+      if target is not None and target[0] is opcodes.JUMP and target[-1] is not instruction:
+        forward[instruction] = target[-1]
+  def destination(label):
+    seen = set()
+    while label in forward and label not in seen:
+      seen.add(label)
+      label = forward[label]
+    return label
+  return [instruction if isinstance(instruction, Label) or instruction[0] not in JUMPS
+    else instruction[:-1] + (destination(instruction[-1]),) for instruction in instructions]
+
+def drop_unreachable(instructions):
+  """Remove instructions after a terminator up to the next label that is jumped to, and unused labels."""
+  used = {instruction[-1] for instruction in instructions if not isinstance(instruction, Label) and instruction[0] in JUMPS}
+  used.update(label for instruction in instructions if not isinstance(instruction, Label) and instruction[0] is opcodes.EXTENDED
+    for operand in instruction[1:] for label in labels_in(operand))
+  result = []
+  reachable = True
+  for instruction in instructions:
+    if isinstance(instruction, Label):
+      if instruction in used:
+        reachable = True
+        result.append(instruction)
+      continue
+    if reachable:
+      result.append(instruction)
+      if instruction[0] in TERMINATORS:
+        reachable = False
+  return result
+
+def labels_in(operand):
+  if isinstance(operand, Label):
+    yield operand
+  elif type(operand) is tuple:
+    for item in operand:
+      yield from labels_in(item)
+
+def simplify_pairs(instructions):
+  """Rewrite wasteful adjacent instruction pairs."""
+  result = []
+  for instruction in instructions:
+    previous = result[-1] if result and not isinstance(result[-1], Label) else None
+    if previous is not None and not isinstance(instruction, Label):
+      # A constant pushed only to be discarded.
+      if previous[0] is opcodes.IMM and instruction[0] is opcodes.POP:
+        result.pop()
+        continue
+      # PUT x; POP; PUSH x leaves x on the stack just like PUT x does.
+      if instruction[0] is opcodes.PUSH and len(result) >= 2 and previous[0] is opcodes.POP:
+        before = result[-2]
+        if not isinstance(before, Label) and before[0] is opcodes.PUT and before[1] == instruction[1]:
+          result.pop()
+          continue
+    # A jump to the very next instruction.
+    if isinstance(instruction, Label) and previous is not None and previous[0] is opcodes.JUMP and previous[1] is instruction:
+      result.pop()
+    result.append(instruction)
+  return result
+
+def compile_verb(verb, optimize=True):
+  return Compiler(optimize=optimize).compile(verb)
@@ -0,0 +1,148 @@
+"""Parse every verb program in a LambdaMOO database dump.
+
+read_programs streams the "#obj:verb" program sections out of a dump one at a
+time. parse_dump parses them in batches across a process pool with at most a
+fixed number of batches in flight, so memory stays bounded however large the
+dump is, and yields the results in dump order.
+"""
+import argparse
+import collections
+import itertools
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import lark
+from attr import attr, attributes
+
+import moo_ast
+
+HEADER_RE = re.compile(r'^\*\* LambdaMOO Database, Format Version (\d+) \*\*$')
+PROGRAM_RE = re.compile(r'^#(-?\d+):(\d+)$')
+
+@attributes
+class VerbProgram:
+  obj = attr()
+  verb = attr()
+  code = attr()
+  # Line of the dump the program's "#obj:verb" header is on.
+  line = attr()
+
+@attributes
+class ParseFailure:
+  message = attr()
+  line = attr(default=None)
+  column = attr(default=None)
+
+@attributes
+class ParsedVerb:
+  obj = attr()
+  verb = attr()
+  line = attr()
+  # A moo_ast.Verb, or None if the program did not parse.
+  ast = attr(default=None)
+  error = attr(default=None)
+
+class DumpFormatError(Exception):
+  pass
+
+def read_programs(f):
+  """Yield a VerbProgram for each verb program in the dump open as f, reading one line at a time.
+
+  The number of programs comes from the header; the program section starts at
+  the first "#obj:verb" line after the objects.
+  """
+  lines = enumerate(f, 1)
+  header = next(lines, (1, ""))[1].rstrip("\n")
+  if not HEADER_RE.match(header):
+    raise DumpFormatError("Not a LambdaMOO database: {!r}".format(header[:80]))
+  try:
+    counts = [int(next(lines)[1]) for _ in range(2)]
+  except (StopIteration, ValueError):
+    raise DumpFormatError("Truncated database header") from None
+  nprogs = counts[1]
+  found = 0
+  for number, line in lines:
+    if found == nprogs:
+      return
+    match = PROGRAM_RE.match(line.rstrip("\n"))
+    if not match:
+      continue
+    code = []
+    for _, code_line in lines:
+      code_line = code_line.rstrip("\n")
+      if code_line == ".":
+        break
+      code.append(code_line)
+    else:
+      raise DumpFormatError("Program #{}:{} on line {} is not terminated".format(match[1], match[2], number))
+    found += 1
+    yield VerbProgram(int(match[1]), int(match[2]), "\n".join(code) + "\n" if code else "", number)
+  if found < nprogs:
+    raise DumpFormatError("Expected {} programs but found {}".format(nprogs, found))
+
+def parse_programs(programs):
+  """Parse a batch of VerbPrograms, returning a ParsedVerb for each."""
+  results = []
+  nonempty = [program for program in programs if program.code]
+  parsed = iter(moo_ast.parse_many(program.code for program in nonempty))
+  for program in programs:
+    result = ParsedVerb(program.obj, program.verb, program.line)
+    outcome = next(parsed) if program.code else moo_ast.Verb(body=[])
+    if isinstance(outcome, Exception):
+      result.error = failure(outcome)
+    else:
+      result.ast = outcome
+    results.append(result)
+  return results
+
+def failure(error):
+  # Lark's errors keep a reference to the parser state, so only the details cross the process boundary.
+  if isinstance(error, lark.exceptions.UnexpectedInput):
+    return ParseFailure(str(error).strip().splitlines()[0], error.line, error.column)
+  return ParseFailure("{}: {}".format(type(error).__name__, error))
+
+def batches(iterable, size):
+  iterator = iter(iterable)
+  while batch := list(itertools.islice(iterator, size)):
+    yield batch
+
+def parse_dump(fname, jobs=None, batch_size=64, window=None):
+  """Yield a ParsedVerb for every program in the dump fname, in dump order.
+
+  At most window batches of batch_size programs are read ahead of the results
+  being consumed; window defaults to twice the number of workers.
+  """
+  with open(fname, encoding='latin-1') as f:
+    programs = read_programs(f)
+    if jobs == 1:
+      for batch in batches(programs, batch_size):
+        yield from parse_programs(batch)
+      return
+    workers = jobs or os.cpu_count() or 1
+    window = window or 2 * workers
+    pending = collections.deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+      for batch in batches(programs, batch_size):
+        pending.append(pool.submit(parse_programs, batch))
+        if len(pending) >= window:
+          yield from pending.popleft().result()
+      while pending:
+        yield from pending.popleft().result()
+
+def main(args):
+  total = failed = 0
+  for result in parse_dump(args.dump, args.jobs, args.batch_size):
+    total += 1
+    if result.error is not None:
+      failed += 1
+      print("#{}:{} (dump line {}): {}".format(result.obj, result.verb, result.line, result.error.message))
+  print("Parsed {} verbs, {} failed".format(total, failed))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("dump", help="LambdaMOO database file")
+  parser.add_argument("-j", "--jobs", help="Number of worker processes. Defaults to the CPU count.", type=int)
+  parser.add_argument("-b", "--batch-size", help="Programs sent to a worker at a time.", type=int, default=64)
+  args = parser.parse_args()
+  main(args)
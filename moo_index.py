@@ -0,0 +1,205 @@
+"""An index of the objects defined across every input file.
+
+The transpiler uses it to create objects from their parent class and to warn
+about this:verb() calls that no class defines. Saved as JSON it also lets
+deploy tooling tell which objects changed between two builds.
+
+The index is built with the stdlib ast module whatever frontend converts the
+files, so the extra pass stays cheap.
+"""
+import ast
+import hashlib
+import json
+
+from attr import asdict, attr, attributes, Factory
+
+INDEX_VERSION = 1
+
+@attributes
+class ObjectInfo:
+  name = attr()
+  file = attr()
+  line = attr()
+  parents = attr(default=Factory(list))
+  verbs = attr(default=Factory(list))
+  properties = attr(default=Factory(list))
+  # Hash of the class's source, to find the objects that changed between builds.
+  digest = attr(default=None)
+
+class DuplicateObjectError(Exception):
+  pass
+
+def base_name(node):
+  if isinstance(node, ast.Name):
+    return node.id
+  if isinstance(node, ast.Attribute):
+    return node.attr
+  return None
+
+@attributes
+class ProgramIndex:
+  objects = attr(default=Factory(dict))
+  # Object name -> the verbs its descendants define, built on first use.
+  descendant_verbs = attr(default=None, init=False, eq=False, repr=False)
+
+  @classmethod
+  def build(cls, fnames):
+    index = cls()
+    for fname in fnames:
+      with open(fname, encoding='UTF-8') as f:
+        index.add_source(fname, f.read())
+    return index
+
+  def add_source(self, fname, code):
+    for node in ast.parse(code, fname).body:
+      if isinstance(node, ast.ClassDef):
+        self.add_class(fname, node, code)
+
+  def add_class(self, fname, node, code):
+    # Objects are found by name in the MOO, so two classes with one name would be one object.
+    existing = self.objects.get(node.name)
+    if existing is not None:
+      raise DuplicateObjectError("{} is defined in {}:{} and again in {}:{}".format(
+        node.name, existing.file, existing.line, fname, node.lineno))
+    info = ObjectInfo(node.name, fname, node.lineno)
+    info.parents = [name for name in map(base_name, node.bases) if name not in (None, 'object')]
+    for subnode in node.body:
+      if isinstance(subnode, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        info.verbs.append(subnode.name)
+      elif isinstance(subnode, ast.Assign):
+        info.properties.extend(target.id for target in subnode.targets if isinstance(target, ast.Name))
+      elif isinstance(subnode, ast.ClassDef):
+        self.add_class(fname, subnode, code)
+    info.digest = hashlib.sha256(ast.get_source_segment(code, node).encode('utf-8')).hexdigest()
+    self.objects[node.name] = info
+    self.descendant_verbs = None
+
+  def parent(self, name):
+    """The indexed class an object should be created from, or None."""
+    info = self.objects.get(name)
+    if info is None:
+      return None
+    return next((parent for parent in info.parents if parent in self.objects), None)
+
+  def defined_before(self, first, second):
+    order = list(self.objects)
+    return order.index(first) < order.index(second)
+
+  def created_from(self, name):
+    """The indexed parent name is created from, or None when that parent is only defined after it."""
+    parent = self.parent(name)
+    if parent is None or not self.defined_before(parent, name):
+      return None
+    return parent
+
+  def reparented(self, name):
+    """The children of name defined before it, which are created from #1 and moved under it once it exists."""
+    children = []
+    for other in self.objects:
+      if other == name:
+        break
+      if self.parent(other) == name:
+        children.append(other)
+    return children
+
+  def sort_files(self, fnames):
+    """Return fnames with every file after the files that define its classes' parents, unless they form a cycle.
+
+    The objects are put in the same order, so defined_before follows the order
+    the files are converted in.
+    """
+    needs = {}
+    for info in self.objects.values():
+      parent = self.parent(info.name)
+      if parent is not None and self.objects[parent].file != info.file:
+        needs.setdefault(info.file, []).append(self.objects[parent].file)
+    wanted = set(fnames)
+    ordered = []
+    seen = set()
+    def visit(fname):
+      if fname in seen:
+        return
+      seen.add(fname)
+      for other in needs.get(fname, ()):
+        visit(other)
+      if fname in wanted:
+        ordered.append(fname)
+    for fname in fnames:
+      visit(fname)
+    position = {fname: n for n, fname in enumerate(ordered)}
+    self.objects = dict(sorted(self.objects.items(), key=lambda item: position.get(item[1].file, len(position))))
+    return ordered
+
+  def has_verb(self, name, verb):
+    """Whether name or one of its ancestors defines verb; None when an ancestor is not indexed."""
+    seen = set()
+    pending = [name]
+    known = True
+    while pending:
+      current = pending.pop()
+      if current in seen:
+        continue
+      seen.add(current)
+      info = self.objects.get(current)
+      if info is None:
+        known = False
+        continue
+      if verb in info.verbs:
+        return True
+      pending.extend(info.parents)
+    return False if known else None
+
+  def ancestors(self, name):
+    """The indexed ancestors of name, nearest first."""
+    result = []
+    pending = list(self.objects[name].parents) if name in self.objects else []
+    while pending:
+      current = pending.pop(0)
+      if current in result or current == name or current not in self.objects:
+        continue
+      result.append(current)
+      pending.extend(self.objects[current].parents)
+    return result
+
+  def overridden(self, name):
+    """The verbs of name that one of its indexed descendants defines again."""
+    if self.descendant_verbs is None:
+      self.descendant_verbs = {}
+      for info in self.objects.values():
+        for ancestor in self.ancestors(info.name):
+          self.descendant_verbs.setdefault(ancestor, set()).update(info.verbs)
+    info = self.objects.get(name)
+    if info is None:
+      return set()
+    return self.descendant_verbs.get(name, set()) & set(info.verbs)
+
+  def file_key(self, fname):
+    """What the conversion of fname depends on besides its own source."""
+    return sorted((info.name, self.created_from(info.name), self.reparented(info.name), sorted(self.overridden(info.name)))
+      for info in self.objects.values() if info.file == fname)
+
+  def to_json(self):
+    return {'version': INDEX_VERSION, 'objects': {name: asdict(info) for name, info in self.objects.items()}}
+
+  @classmethod
+  def from_json(cls, data):
+    if data.get('version') != INDEX_VERSION:
+      raise ValueError("Unsupported index version {!r}".format(data.get('version')))
+    return cls({name: ObjectInfo(**info) for name, info in data['objects'].items()})
+
+  def save(self, fname):
+    with open(fname, 'w', encoding='UTF-8') as f:
+      json.dump(self.to_json(), f, indent=1)
+
+  @classmethod
+  def load(cls, fname):
+    with open(fname, encoding='UTF-8') as f:
+      return cls.from_json(json.load(f))
+
+def changed_objects(old, new):
+  """Return the sorted names of the objects added, changed and removed between two indexes."""
+  added = sorted(new.objects.keys() - old.objects.keys())
+  removed = sorted(old.objects.keys() - new.objects.keys())
+  changed = sorted(name for name in new.objects.keys() & old.objects.keys()
+    if new.objects[name].digest != old.objects[name].digest)
+  return added, changed, removed
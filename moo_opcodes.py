@@ -62,3 +62,20 @@ class opcodes(Enum):
   EXTENDED = auto()
   MAP_CREATE = auto()
   map_insert = auto()
+
+class extended_opcodes(Enum):
+  # Operations reached through EXTENDED, charged 1 tick each.
+  RANGESET = 0
+  LENGTH = auto()
+  EXP = auto()
+  SCATTER = auto()
+  # try/except and `expr ! codes => default' push a marker on the stack that errors unwind to.
+  TRY_EXCEPT = auto()
+  END_EXCEPT = auto()
+  CATCH = auto()
+  END_CATCH = auto()
+  # Leave loops for break and continue, dropping the stack down to the loop's level.
+  EXIT = auto()
+
+# Ticks charged for each opcode, following the groupings above.
+TICKS = {op: 1 if op.value < opcodes.JUMP.value else 0 for op in opcodes}
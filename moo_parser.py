@@ -0,0 +1,36 @@
+"""The LALR parser for moo.lark, built once per process.
+
+Lark caches the analysed grammar tables on disk (keyed by the grammar's hash
+and the parser options), so after the first run creating the parser is a load
+rather than a grammar compile. Set MOO_PARSER_CACHE to choose the cache file.
+"""
+import os
+
+import lark
+
+GRAMMAR_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'moo.lark')
+
+_parsers = {}
+
+def build_parser(cache=None, transformer=None):
+  """Build a new parser; cache is a file name for the grammar tables, or True for Lark's default location.
+
+  A transformer is applied as each rule is reduced, instead of building a parse tree.
+  """
+  if cache is None:
+    cache = os.environ.get('MOO_PARSER_CACHE') or True
+  with open(GRAMMAR_FILE, encoding='UTF-8') as f:
+    grammar = f.read()
+  return lark.Lark(grammar, parser='lalr', cache=cache, transformer=transformer)
+
+def get_parser(transformer=None):
+  """Return the process-wide parser for transformer, building it on first use."""
+  parser = _parsers.get(transformer)
+  if parser is None:
+    parser = _parsers[transformer] = build_parser(transformer=transformer)
+  return parser
+
+def __getattr__(name):
+  if name == 'parser':
+    return get_parser()
+  raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
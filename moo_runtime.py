@@ -0,0 +1,551 @@
+"""Values, objects and builtin functions shared by the MOO execution engines."""
+from attr import attr, attributes, Factory
+from enum import Enum, auto
+import inspect
+import math
+import random
+import time
+
+# MOO integers are 64 bits.
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+
+class Error(Enum):
+  E_NONE = 0
+  E_TYPE = auto()
+  E_DIV = auto()
+  E_PERM = auto()
+  E_PROPNF = auto()
+  E_VERBNF = auto()
+  E_VARNF = auto()
+  E_INVIND = auto()
+  E_RECMOVE = auto()
+  E_MAXREC = auto()
+  E_RANGE = auto()
+  E_ARGS = auto()
+  E_NACC = auto()
+  E_INVARG = auto()
+  E_QUOTA = auto()
+  E_FLOAT = auto()
+
+  def __bool__(self):
+    return False
+
+class MooError(Exception):
+  """A MOO error value raised by running code."""
+
+  def __init__(self, error, message=None, value=0):
+    super().__init__(message or error.name)
+    self.error = error
+    self.value = value
+
+  def as_value(self):
+    """The {code, message, value, traceback} list an except clause binds its variable to."""
+    return (self.error, str(self), self.value, ())
+
+def catches(codes, error):
+  """Whether the codes of an except clause, an Error or a list of them, include error; None is ANY."""
+  return codes is None or codes is error or (type(codes) is tuple and error in codes)
+
+@attributes(frozen=True, slots=True)
+class ObjRef:
+  number: int = attr()
+
+  def __bool__(self):
+    return False
+
+  def __str__(self):
+    return "#%d" % self.number
+
+NOTHING = ObjRef(-1)
+
+# Type codes, as returned by typeof() and bound to NUM, OBJ, ... in every frame.
+INT, OBJ, STR, ERR, LIST, FLOAT, MAP = 0, 1, 2, 3, 4, 9, 10
+
+def typeof(value):
+  kind = type(value)
+  if kind is int:
+    return INT
+  if kind is str:
+    return STR
+  if kind is tuple:
+    return LIST
+  if kind is ObjRef:
+    return OBJ
+  if kind is float:
+    return FLOAT
+  if kind is dict:
+    return MAP
+  if kind is Error:
+    return ERR
+  raise MooError(Error.E_TYPE, "Not a MOO value: %r" % (value,))
+
+# Builtin variables every verb starts with, in LambdaMOO's order.
+BUILTIN_VARIABLES = ['NUM', 'OBJ', 'STR', 'LIST', 'ERR', 'player', 'this', 'caller', 'verb', 'args', 'argstr', 'dobj', 'dobjstr', 'prepstr', 'iobj', 'iobjstr', 'INT', 'FLOAT', 'MAP']
+
+class Unbound:
+  """Marker for a variable that has not been assigned yet."""
+
+  def __repr__(self):
+    return 'UNBOUND'
+
+UNBOUND = Unbound()
+
+@attributes
+class Frame:
+  """The variables a verb activation sees, shared by every execution engine."""
+  this = attr(default=NOTHING)
+  verb = attr(default="")
+  args = attr(default=())
+  player = attr(default=NOTHING)
+  caller = attr(default=NOTHING)
+
+  def builtin_values(self):
+    return {
+      'NUM': INT, 'INT': INT, 'OBJ': OBJ, 'STR': STR, 'LIST': LIST, 'ERR': ERR, 'FLOAT': FLOAT, 'MAP': MAP,
+      'player': self.player, 'this': self.this, 'caller': self.caller, 'verb': self.verb,
+      'args': tuple(self.args), 'argstr': "", 'dobj': NOTHING, 'dobjstr': "",
+      'prepstr': "", 'iobj': NOTHING, 'iobjstr': "",
+    }
+
+  def variables(self, var_names):
+    """Return the initial variable slots for a program with the given variable names."""
+    values = self.builtin_values()
+    return [values.get(name, UNBOUND) for name in var_names]
+
+@attributes
+class MooObject:
+  parent: ObjRef = attr(default=NOTHING)
+  name: str = attr(default="")
+  properties: dict = attr(default=Factory(dict))
+  verbs: dict = attr(default=Factory(dict))
+
+@attributes
+class World:
+  """An in-memory object database that running verbs read and write."""
+  objects: dict = attr(default=Factory(dict))
+
+  def create(self, parent=NOTHING, name=""):
+    ref = ObjRef(len(self.objects))
+    self.objects[ref] = MooObject(parent=parent, name=name)
+    return ref
+
+  def valid(self, obj):
+    return obj in self.objects
+
+  def get(self, obj):
+    try:
+      return self.objects[obj]
+    except (KeyError, TypeError):
+      raise MooError(Error.E_INVIND, "Invalid object %s" % (obj,)) from None
+
+  def ancestors(self, obj):
+    while obj != NOTHING:
+      found = self.get(obj)
+      yield found
+      obj = found.parent
+
+  def get_prop(self, obj, name):
+    if type(name) is not str:
+      raise MooError(Error.E_TYPE)
+    for found in self.ancestors(obj):
+      if name in found.properties:
+        return found.properties[name]
+    if name == 'name':
+      return self.get(obj).name
+    raise MooError(Error.E_PROPNF, "Property %s.%s not found" % (obj, name))
+
+  def put_prop(self, obj, name, value):
+    if type(name) is not str:
+      raise MooError(Error.E_TYPE)
+    target = self.get(obj)
+    if name == 'name':
+      target.name = value
+      return
+    for found in self.ancestors(obj):
+      if name in found.properties:
+        target.properties[name] = value
+        return
+    raise MooError(Error.E_PROPNF, "Property %s.%s not found" % (obj, name))
+
+  def add_property(self, obj, name, value=0):
+    self.get(obj).properties[name] = value
+
+  def add_verb(self, obj, name, program):
+    """Attach a verb to obj: an engine-specific program, or a Python callable f(engine, this, args)."""
+    self.get(obj).verbs[name] = program
+
+  def find_verb(self, obj, name):
+    if type(name) is not str:
+      raise MooError(Error.E_TYPE)
+    for found in self.ancestors(obj):
+      verb = found.verbs.get(name)
+      if verb is not None:
+        return verb
+    raise MooError(Error.E_VERBNF, "Verb %s:%s not found" % (obj, name))
+
+def moo_equal(lhs, rhs):
+  """MOO equality: same type, strings compared case-insensitively, lists element by element."""
+  if type(lhs) is not type(rhs):
+    return False
+  if type(lhs) is str:
+    return lhs.lower() == rhs.lower()
+  if type(lhs) is tuple:
+    return len(lhs) == len(rhs) and all(moo_equal(l, r) for l, r in zip(lhs, rhs))
+  if type(lhs) is dict:
+    return len(lhs) == len(rhs) and all(k in rhs and moo_equal(v, rhs[k]) for k, v in lhs.items())
+  return lhs == rhs
+
+def moo_compare(lhs, rhs):
+  """Return -1, 0 or 1 for two numbers or strings of the same type."""
+  kind = type(lhs)
+  if kind is not type(rhs) or kind not in (int, float, str, ObjRef, Error):
+    raise MooError(Error.E_TYPE)
+  if kind is str:
+    lhs, rhs = lhs.lower(), rhs.lower()
+  elif kind is ObjRef:
+    lhs, rhs = lhs.number, rhs.number
+  elif kind is Error:
+    lhs, rhs = lhs.value, rhs.value
+  return (lhs > rhs) - (lhs < rhs)
+
+def moo_add(lhs, rhs):
+  kind = type(lhs)
+  if kind is not type(rhs) or kind not in (int, float, str):
+    raise MooError(Error.E_TYPE)
+  return lhs + rhs
+
+def moo_arith(operator):
+  def apply(lhs, rhs):
+    kind = type(lhs)
+    if kind is not type(rhs) or kind not in (int, float):
+      raise MooError(Error.E_TYPE)
+    return operator(lhs, rhs)
+  return apply
+
+def _div(lhs, rhs):
+  if rhs == 0:
+    raise MooError(Error.E_DIV)
+  if type(lhs) is float:
+    return lhs / rhs
+  quotient = abs(lhs) // abs(rhs)
+  return quotient if (lhs < 0) == (rhs < 0) else -quotient
+
+def _mod(lhs, rhs):
+  if rhs == 0:
+    raise MooError(Error.E_DIV)
+  if type(lhs) is float:
+    return math.fmod(lhs, rhs)
+  return lhs - rhs * _div(lhs, rhs)
+
+def _exp(lhs, rhs):
+  if type(lhs) is int and type(rhs) is int:
+    if rhs < 0:
+      return 0 if abs(lhs) != 1 else lhs ** rhs
+    # Any base above 1 overflows 64 bits long before an exponent of 64, so huge powers are never computed.
+    if abs(lhs) > 1 and rhs > 64:
+      raise MooError(Error.E_FLOAT, "Integer overflow")
+    result = lhs ** rhs
+    if not INT_MIN <= result <= INT_MAX:
+      raise MooError(Error.E_FLOAT, "Integer overflow")
+    return result
+  if type(lhs) is float and type(rhs) in (int, float):
+    try:
+      result = lhs ** rhs
+    except OverflowError:
+      raise MooError(Error.E_FLOAT, "Floating-point overflow") from None
+    if type(result) is complex:
+      raise MooError(Error.E_INVARG)
+    return result
+  raise MooError(Error.E_TYPE)
+
+moo_sub = moo_arith(lambda l, r: l - r)
+moo_mul = moo_arith(lambda l, r: l * r)
+moo_div = moo_arith(_div)
+moo_mod = moo_arith(_mod)
+moo_exp = _exp
+
+def moo_negate(value):
+  if type(value) not in (int, float):
+    raise MooError(Error.E_TYPE)
+  return -value
+
+def moo_in(element, container):
+  if type(container) is tuple:
+    for n, item in enumerate(container):
+      if moo_equal(element, item):
+        return n + 1
+    return 0
+  if type(container) is dict:
+    for n, item in enumerate(container.values()):
+      if moo_equal(element, item):
+        return n + 1
+    return 0
+  raise MooError(Error.E_TYPE)
+
+def moo_index(base, index):
+  """base[index] with MOO's 1-based indexing."""
+  kind = type(base)
+  if kind is dict:
+    try:
+      return base[index]
+    except (KeyError, TypeError):
+      raise MooError(Error.E_RANGE) from None
+  if kind not in (tuple, str):
+    raise MooError(Error.E_TYPE)
+  if type(index) is not int:
+    raise MooError(Error.E_TYPE)
+  if index < 1 or index > len(base):
+    raise MooError(Error.E_RANGE)
+  return base[index - 1]
+
+def moo_range(base, start, end):
+  """base[start..end] with MOO's inclusive 1-based ranges."""
+  if type(base) not in (tuple, str) or type(start) is not int or type(end) is not int:
+    raise MooError(Error.E_TYPE)
+  if start > end:
+    return base[0:0]
+  if start < 1 or end > len(base):
+    raise MooError(Error.E_RANGE)
+  return base[start - 1:end]
+
+def moo_index_set(base, index, value):
+  """Return a copy of base with base[index] replaced by value."""
+  kind = type(base)
+  if kind is dict:
+    updated = dict(base)
+    updated[index] = value
+    return updated
+  if type(index) is not int:
+    raise MooError(Error.E_TYPE)
+  if kind not in (tuple, str):
+    raise MooError(Error.E_TYPE)
+  if index < 1 or index > len(base):
+    raise MooError(Error.E_RANGE)
+  if kind is str:
+    if type(value) is not str or len(value) != 1:
+      raise MooError(Error.E_INVARG)
+    return base[:index - 1] + value + base[index:]
+  return base[:index - 1] + (value,) + base[index:]
+
+def moo_range_set(base, start, end, value):
+  """Return a copy of base with base[start..end] replaced by value."""
+  if type(base) is not type(value) or type(base) not in (tuple, str) or type(start) is not int or type(end) is not int:
+    raise MooError(Error.E_TYPE)
+  if start < 1 or end > len(base) or end < start - 1:
+    raise MooError(Error.E_RANGE)
+  return base[:start - 1] + value + base[end:]
+
+def tostr(*args):
+  return "".join(to_literal(arg) if type(arg) in (tuple, dict) else str(arg) if type(arg) is not Error else arg.name for arg in args)
+
+def to_literal(value):
+  kind = type(value)
+  if kind is str:
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+  if kind is tuple:
+    return "{" + ", ".join(to_literal(v) for v in value) + "}"
+  if kind is dict:
+    return "[" + ", ".join(to_literal(k) + " -> " + to_literal(v) for k, v in value.items()) + "]"
+  if kind is Error:
+    return value.name
+  return str(value)
+
+def toint(value):
+  if type(value) is str:
+    try:
+      return int(float(value.strip() or 0))
+    except ValueError:
+      return 0
+  if type(value) is ObjRef:
+    return value.number
+  if type(value) is Error:
+    return value.value
+  if type(value) in (int, float):
+    return int(value)
+  raise MooError(Error.E_TYPE)
+
+def tofloat(value):
+  if type(value) is str:
+    try:
+      return float(value.strip() or 0)
+    except ValueError:
+      return 0.0
+  if type(value) in (int, float):
+    return float(value)
+  raise MooError(Error.E_TYPE)
+
+def length(value):
+  if type(value) not in (tuple, str, dict):
+    raise MooError(Error.E_TYPE)
+  return len(value)
+
+def check_list(value):
+  if type(value) is not tuple:
+    raise MooError(Error.E_TYPE)
+  return value
+
+def listappend(lst, value, index=None):
+  check_list(lst)
+  index = len(lst) if index is None else index
+  return lst[:index] + (value,) + lst[index:]
+
+def listinsert(lst, value, index=1):
+  check_list(lst)
+  return lst[:index - 1] + (value,) + lst[index - 1:]
+
+def listdelete(lst, index):
+  check_list(lst)
+  if index < 1 or index > len(lst):
+    raise MooError(Error.E_RANGE)
+  return lst[:index - 1] + lst[index:]
+
+def setadd(lst, value):
+  return lst if moo_in(value, lst) else check_list(lst) + (value,)
+
+def setremove(lst, value):
+  index = moo_in(value, lst)
+  return listdelete(lst, index) if index else lst
+
+def mapkeys(value):
+  if type(value) is not dict:
+    raise MooError(Error.E_TYPE)
+  return tuple(value)
+
+def mapvalues(value):
+  if type(value) is not dict:
+    raise MooError(Error.E_TYPE)
+  return tuple(value.values())
+
+def mapdelete(value, key):
+  if type(value) is not dict:
+    raise MooError(Error.E_TYPE)
+  if key not in value:
+    raise MooError(Error.E_RANGE)
+  updated = dict(value)
+  del updated[key]
+  return updated
+
+def moo_raise(error, message=None, value=0):
+  raise MooError(error, message, value)
+
+def moo_random(mod=None):
+  if mod is None:
+    return random.randint(1, 2 ** 31 - 1)
+  if type(mod) is not int:
+    raise MooError(Error.E_TYPE)
+  if mod < 1:
+    raise MooError(Error.E_INVARG)
+  return random.randint(1, mod)
+
+def moo_min_max(choose):
+  def apply(value, *values):
+    values = (value,) + values
+    if type(value) not in (int, float) or any(type(other) is not type(value) for other in values):
+      raise MooError(Error.E_TYPE)
+    return choose(values)
+  return apply
+
+# Builtin functions that need nothing but their arguments.
+BUILTINS = {
+  'typeof': typeof,
+  'tostr': tostr,
+  'toliteral': to_literal,
+  'toint': toint,
+  'tonum': toint,
+  'tofloat': tofloat,
+  'toobj': lambda value: ObjRef(toint(value)),
+  'length': length,
+  'listappend': listappend,
+  'listinsert': listinsert,
+  'listdelete': listdelete,
+  'setadd': setadd,
+  'setremove': setremove,
+  'is_member': lambda value, lst: moo_in(value, lst),
+  'mapkeys': mapkeys,
+  'mapvalues': mapvalues,
+  'mapdelete': mapdelete,
+  'abs': lambda value: abs(value),
+  'min': moo_min_max(min),
+  'max': moo_min_max(max),
+  'random': moo_random,
+  'raise': moo_raise,
+  'time': lambda: int(time.time()),
+}
+
+def arity(function):
+  """The (fewest, most) arguments function can be called with; most is None for any number."""
+  try:
+    parameters = inspect.signature(function).parameters.values()
+  except (TypeError, ValueError):
+    return 0, None
+  fewest = most = 0
+  for parameter in parameters:
+    if parameter.kind is parameter.VAR_POSITIONAL:
+      most = None
+    elif parameter.kind in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD):
+      if parameter.default is parameter.empty:
+        fewest += 1
+      if most is not None:
+        most += 1
+  return fewest, most
+
+BUILTIN_ARITIES = {name: arity(function) for name, function in BUILTINS.items()}
+
+class Engine:
+  """The builtin functions of moo_vm.VM and moo_closures.ClosureEngine.
+
+  Subclasses have world, ticks, max_ticks, max_seconds and next_task_id
+  attributes, and call init_builtins() when they are created.
+  """
+
+  def init_builtins(self):
+    self.started = time.monotonic()
+    self.builtins = dict(BUILTINS)
+    self.builtins.update({
+      'ticks_left': self.ticks_left,
+      'seconds_left': self.seconds_left,
+      'suspend': self.suspend,
+      'valid': self.world.valid,
+    })
+    # Filled in for the other builtins the first time they are called.
+    self.arities = dict(BUILTIN_ARITIES)
+
+  def call_builtin(self, name, args):
+    function = self.builtins.get(name)
+    if function is None:
+      raise MooError(Error.E_VERBNF, "Unknown built-in function: %s" % name)
+    limits = self.arities.get(name)
+    if limits is None:
+      limits = self.arities[name] = arity(function)
+    fewest, most = limits
+    if len(args) < fewest or (most is not None and len(args) > most):
+      raise MooError(Error.E_ARGS, "Wrong number of arguments to %s()" % name)
+    try:
+      return function(*args)
+    except TypeError:
+      # The arguments were of a type the builtin cannot use.
+      raise MooError(Error.E_TYPE, "Wrong type of argument to %s()" % name) from None
+    except (ValueError, ArithmeticError):
+      raise MooError(Error.E_INVARG, "Invalid argument to %s()" % name) from None
+
+  def new_task_id(self, delay):
+    """Check the delay of a fork and return the id of the task it queues."""
+    if type(delay) not in (int, float):
+      raise MooError(Error.E_TYPE)
+    if delay < 0:
+      raise MooError(Error.E_INVARG)
+    task_id = self.next_task_id
+    self.next_task_id += 1
+    return task_id
+
+  def ticks_left(self):
+    return self.max_ticks - self.ticks
+
+  def seconds_left(self):
+    return max(0, int(self.max_seconds - (time.monotonic() - self.started)))
+
+  def suspend(self, seconds=0):
+    self.ticks = 0
+    self.started = time.monotonic()
+    return 0
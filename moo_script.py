@@ -0,0 +1,97 @@
+import re
+
+from attr import attr, attributes
+
+CREATE_RE = re.compile(r'^@create\s+(?P<parent>\S+)\s+named\s+(?P<obj>.+?)\s*$')
+CHPARENT_RE = re.compile(r'^@chparent\s+(?P<obj>\S+)\s+to\s+(?P<parent>\S+)\s*$')
+VERB_RE = re.compile(r'^@verb\s+(?P<obj>[^:\s]+):(?P<verb>\S+)')
+PROGRAM_RE = re.compile(r'^@program\s+(?P<obj>[^:\s]+):(?P<verb>\S+)')
+PROPERTY_RE = re.compile(r'^@property\s+(?P<obj>[^.\s]+)\.(?P<prop>\S+)')
+
+@attributes
+class Unit:
+  """One self-contained command of a MOO build script.
+
+  kind is 'create', 'parent', 'verb', 'property' or 'other'; key identifies the thing the
+  unit defines so that two builds can be compared unit by unit.
+  """
+  kind = attr()
+  key = attr()
+  lines = attr()
+
+  @property
+  def text(self):
+    return "".join(self.lines)
+
+  @property
+  def obj(self):
+    if self.kind == 'other':
+      return None
+    return self.key[1]
+
+def split_units(script):
+  """Split an emitted MOO script into its @create, @chparent, @verb/@program and @property units."""
+  lines = script.splitlines(keepends=True)
+  units = []
+  i = 0
+  while i < len(lines):
+    line = lines[i]
+    start = i
+    i += 1
+    if match := CREATE_RE.match(line):
+      units.append(Unit('create', ('create', match['obj']), lines[start:i]))
+    elif match := CHPARENT_RE.match(line):
+      units.append(Unit('parent', ('parent', match['obj']), lines[start:i]))
+    elif (match := VERB_RE.match(line)) or (match := PROGRAM_RE.match(line)):
+      if line.startswith('@verb') and i < len(lines) and PROGRAM_RE.match(lines[i]):
+        i += 1
+      if PROGRAM_RE.match(lines[i - 1]):
+        while i < len(lines) and lines[i].rstrip("\r\n") != '.':
+          i += 1
+        i += 1
+      units.append(Unit('verb', ('verb', match['obj'], match['verb']), lines[start:i]))
+    elif match := PROPERTY_RE.match(line):
+      if i < len(lines) and lines[i].startswith(';'):
+        i += 1
+      units.append(Unit('property', ('property', match['obj'], match['prop']), lines[start:i]))
+    elif line.strip():
+      units.append(Unit('other', ('other', line), lines[start:i]))
+  return units
+
+def diff_units(old_units, new_units):
+  """Yield the commands needed to bring a MOO built from old_units up to date with new_units.
+
+  Objects that are new are created, new verbs and properties are added in full,
+  changed verbs only get their @program block and changed properties only get
+  their value assignment. Verbs and properties that disappeared from an object
+  which still exists are removed; whole objects are never recycled.
+  """
+  old = {unit.key: unit for unit in old_units}
+  new_keys = set()
+  for unit in new_units:
+    new_keys.add(unit.key)
+    previous = old.get(unit.key)
+    if previous is None:
+      yield unit.text
+    elif previous.lines == unit.lines or unit.kind == 'create':
+      continue
+    elif unit.kind == 'verb' and previous.lines[0] == unit.lines[0] and unit.lines[0].startswith('@verb'):
+      yield "".join(unit.lines[1:])
+    elif unit.kind == 'verb':
+      yield "@rmverb {}:{}\n".format(unit.key[1], unit.key[2])
+      yield unit.text
+    elif unit.kind == 'parent':
+      yield unit.text
+    else:
+      yield "".join(unit.lines[1:])
+  objects = {key[1] for key in new_keys if key[0] == 'create'}
+  for key, unit in old.items():
+    if key in new_keys or unit.obj not in objects:
+      continue
+    if unit.kind == 'verb':
+      yield "@rmverb {}:{}\n".format(key[1], key[2])
+    elif unit.kind == 'property':
+      yield "@rmproperty {}.{}\n".format(key[1], key[2])
+
+def diff_scripts(old_script, new_script):
+  return "".join(diff_units(split_units(old_script), split_units(new_script)))
@@ -0,0 +1,214 @@
+"""Upload an emitted MOO script over telnet connections.
+
+The script is split into units with moo_script.split_units. Each unit is sent
+without waiting for the previous one to be answered, up to a window of
+unacknowledged units per connection. The server brackets the output of every
+command with the markers set through the PREFIX and SUFFIX commands, which is
+how the output is matched back to the unit that caused it.
+
+All the units of one object go over the same connection, in script order, so
+the object exists (and is visible to that player) before its verbs and
+properties are added. Objects created from a parent in the script, or moved
+under one with @chparent, go over their parent's connection for the same
+reason. A MOO only keeps one connection per player, so every connection logs
+in as a different player.
+"""
+import argparse
+import asyncio
+import re
+import sys
+import uuid
+
+from attr import attr, attributes, Factory
+
+from moo_script import CHPARENT_RE, CREATE_RE, split_units
+
+# Output that means a command did not do what the unit asked for.
+ERROR_PATTERNS = [re.compile(pattern) for pattern in (
+  r"^[1-9]\d* errors?\b",
+  r"^Verb not programmed",
+  r"^I (don't|couldn't) understand that",
+  r"^(Invalid|Permission denied|There is no|You can't|That object)",
+  r"^#-?\d+:.*\b(E_\w+)",
+  r"^Line \d+:",
+)]
+
+def count_commands(unit):
+  """The number of commands the server will answer for unit; an @program block and its lines are one command."""
+  commands = 0
+  in_program = False
+  for line in unit.lines:
+    line = line.rstrip("\r\n")
+    if in_program:
+      in_program = line != '.'
+      continue
+    if not line.strip():
+      continue
+    commands += 1
+    in_program = line.startswith('@program')
+  return commands
+
+@attributes
+class Ack:
+  unit = attr()
+  output = attr(default=Factory(list))
+
+  @property
+  def errors(self):
+    return [line for line in self.output if any(pattern.match(line) for pattern in ERROR_PATTERNS)]
+
+  @property
+  def ok(self):
+    return not self.errors
+
+class UploadError(Exception):
+  pass
+
+@attributes
+class Connection:
+  reader = attr()
+  writer = attr()
+  prefix = attr()
+  suffix = attr()
+  timeout = attr(default=30)
+
+  @classmethod
+  async def open(cls, host, port, user, password, timeout=30):
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    marker = uuid.uuid4().hex
+    connection = cls(reader, writer, ">>" + marker + " start", "<<" + marker + " end", timeout)
+    connection.send_lines([
+      "connect {} {}".format(user, password),
+      "PREFIX " + connection.prefix,
+      "SUFFIX " + connection.suffix,
+    ])
+    await writer.drain()
+    return connection
+
+  def send_lines(self, lines):
+    self.writer.write("".join(line + "\n" for line in lines).encode('utf-8'))
+
+  async def read_line(self):
+    line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+    if not line:
+      raise UploadError("Connection closed by the server")
+    return line.decode('utf-8', 'replace').rstrip("\r\n")
+
+  async def read_response(self):
+    """Return the output of the next command, skipping anything printed outside the markers."""
+    while await self.read_line() != self.prefix:
+      pass
+    output = []
+    while (line := await self.read_line()) != self.suffix:
+      output.append(line)
+    return output
+
+  async def upload(self, units, window=8):
+    """Send units in order with up to window of them unacknowledged, returning an Ack for each."""
+    slots = asyncio.Semaphore(window)
+    acks = []
+    async def send():
+      for unit in units:
+        await slots.acquire()
+        text = unit.text
+        self.writer.write((text if text.endswith("\n") else text + "\n").encode('utf-8'))
+        await self.writer.drain()
+    async def receive():
+      for unit in units:
+        ack = Ack(unit)
+        for _ in range(count_commands(unit)):
+          ack.output.extend(await self.read_response())
+        acks.append(ack)
+        slots.release()
+    sender = asyncio.ensure_future(send())
+    try:
+      await receive()
+      await sender
+    finally:
+      sender.cancel()
+    return acks
+
+  async def close(self):
+    self.send_lines(["@quit"])
+    try:
+      await self.writer.drain()
+    except ConnectionError:
+      pass
+    self.writer.close()
+
+def script_parents(units):
+  """Map each object in units to its parent, for parents that are created in units too.
+
+  An object moved with @chparent belongs to the parent it is moved to.
+  """
+  created = {unit.obj: CREATE_RE.match(unit.lines[0])['parent'] for unit in units if unit.kind == 'create'}
+  parents = dict(created)
+  parents.update((unit.obj, CHPARENT_RE.match(unit.lines[0])['parent']) for unit in units if unit.kind == 'parent')
+  return {obj: parent for obj, parent in parents.items() if parent in created}
+
+def assign_connections(units, connections):
+  """Split units into at most connections lists, keeping every object's units together and in order.
+
+  An object goes with the oldest ancestor created in the script, as its parent
+  is only found by name by the player who created it. Returns a list of
+  [(index in units, unit), ...] per connection.
+  """
+  parents = script_parents(units)
+  def root(obj):
+    seen = set()
+    while obj in parents and obj not in seen:
+      seen.add(obj)
+      obj = parents[obj]
+    return obj
+  groups = {}
+  for index, unit in enumerate(units):
+    groups.setdefault(root(unit.obj), []).append((index, unit))
+  lanes = [[] for _ in range(min(connections, len(groups)))]
+  for n, group in enumerate(groups.values()):
+    lanes[n % len(lanes)].extend(group)
+  for lane in lanes:
+    lane.sort(key=lambda item: item[0])
+  return lanes
+
+async def upload(script, host, port, logins, window=8, timeout=30):
+  """Upload script over one connection per (player, password) in logins and return an Ack per unit, in script order."""
+  units = split_units(script)
+  if not units:
+    return []
+  lanes = assign_connections(units, len(logins))
+  opened = await asyncio.gather(*(Connection.open(host, port, user, password, timeout)
+    for user, password in logins[:len(lanes)]))
+  try:
+    results = await asyncio.gather(*(connection.upload([unit for index, unit in lane], window)
+      for connection, lane in zip(opened, lanes)))
+  finally:
+    await asyncio.gather(*(connection.close() for connection in opened), return_exceptions=True)
+  acks = [None] * len(units)
+  for lane, lane_acks in zip(lanes, results):
+    for (index, unit), ack in zip(lane, lane_acks):
+      acks[index] = ack
+  return acks
+
+def main(args):
+  with open(args.script, encoding='UTF-8') as f:
+    script = f.read()
+  logins = [login.partition(":")[::2] for login in args.logins]
+  acks = asyncio.run(upload(script, args.host, args.port, logins, args.window, args.timeout))
+  failed = [ack for ack in acks if not ack.ok]
+  for ack in failed:
+    print("Failed: {}".format(ack.unit.lines[0].rstrip()))
+    for line in ack.errors:
+      print("  " + line)
+  print("Uploaded {} units, {} failed".format(len(acks), len(failed)))
+  return 1 if failed else 0
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("script", help="MOO script written by mooingsnake.py")
+  parser.add_argument("--host", default="localhost")
+  parser.add_argument("--port", type=int, default=7777)
+  parser.add_argument("-l", "--login", help="player:password of a programmer to connect as. Repeat to upload over several connections; each object's units stay on one of them.", action="append", dest="logins", required=True)
+  parser.add_argument("-w", "--window", help="Units sent ahead of their acknowledgement on each connection.", type=int, default=8)
+  parser.add_argument("--timeout", help="Seconds to wait for the server's answer to a command.", type=float, default=30)
+  args = parser.parse_args()
+  sys.exit(main(args))
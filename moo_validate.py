@@ -0,0 +1,99 @@
+"""Check transpiler output with moo.lark before it is uploaded.
+
+Every @program body of a script is parsed in one batch with the shared LALR
+parser. Only when a verb fails is its file converted again, recording which
+Python line each line of the script came from, to say where the problem is.
+"""
+import bisect
+import itertools
+import re
+
+from attr import attr, attributes
+
+import moo_ast
+from moo_db import failure
+from moo_script import PROGRAM_RE
+from mooingsnake import get_frontend, logger
+
+# Lark counts from the start of the verb body, which would be misleading next to a Python line.
+POSITION_RE = re.compile(r'\s*at line -?\d+, column -?\d+\.?$')
+
+@attributes
+class VerbError:
+  fname = attr()
+  obj = attr()
+  verb = attr()
+  message = attr()
+  script_line = attr()
+  source_line = attr(default=None)
+
+  def __str__(self):
+    if self.source_line is None:
+      return "{}: {}:{} (script line {}) does not parse: {}".format(self.fname, self.obj, self.verb, self.script_line, self.message)
+    return "{}:{}: {}:{} does not parse: {}".format(self.fname, self.source_line, self.obj, self.verb, self.message)
+
+def program_bodies(script):
+  """Yield (obj, verb, line, body) for every @program in script, line being the script line its body starts on."""
+  lines = script.splitlines(keepends=True)
+  i = 0
+  while i < len(lines):
+    match = PROGRAM_RE.match(lines[i])
+    i += 1
+    if not match:
+      continue
+    start = i
+    while i < len(lines) and lines[i].rstrip("\r\n") != '.':
+      i += 1
+    yield match['obj'], match['verb'], start + 1, "".join(lines[start:i])
+    i += 1
+
+def check_script(script, fname=None):
+  """Return a VerbError for each verb in script that moo.lark does not parse."""
+  programs = list(program_bodies(script))
+  errors = []
+  for (obj, verb, first_line, body), result in zip(programs, moo_ast.parse_many(body for _, _, _, body in programs)):
+    if not isinstance(result, Exception):
+      continue
+    error = failure(result)
+    if error.line is not None and error.line > 0:
+      line = first_line + error.line - 1
+    else:
+      # The end of the body for an unexpected end, the @program line when there is no position at all.
+      line = first_line + body.count("\n") - 1 if error.line is not None else first_line - 1
+    message = POSITION_RE.sub('', error.message)
+    if error.column is not None and error.column > 0:
+      message += " (column {})".format(error.column)
+    errors.append(VerbError(fname, obj, verb, message, line))
+  return errors
+
+def source_line(line_map, script_line):
+  """The source line that script_line came from, given a converter's (script line, source line) pairs."""
+  i = bisect.bisect_right(line_map, (script_line, float('inf'))) - 1
+  return line_map[i][1] if i >= 0 else None
+
+def locate(errors, converter, fname, script, index=None, optimize=False, inline=None, suspend=None):
+  """Fill in the source line of each error in fname's script by converting fname again."""
+  mapped, line_map = converter.map_lines(fname, index, optimize, inline, suspend)
+  if mapped != script:
+    logger.warning("Converting {} again gave different code; errors are reported by script line".format(fname))
+    return
+  for error in errors:
+    error.source_line = source_line(line_map, error.script_line)
+
+def validate_files(converted, failures, frontend='astroid', index=None, optimize=False, inline=None, suspend=None):
+  """Pass on (fname, chunk) pairs once all of a file's chunks have been checked.
+
+  Each verb that does not parse is logged and a VerbError for it is appended to failures.
+  """
+  converter = get_frontend(frontend)
+  for fname, pairs in itertools.groupby(converted, key=lambda pair: pair[0]):
+    chunks = [chunk for _, chunk in pairs]
+    script = "".join(chunks)
+    errors = check_script(script, fname)
+    if errors:
+      locate(errors, converter, fname, script, index, optimize, inline, suspend)
+    for error in errors:
+      logger.error(str(error))
+    failures.extend(errors)
+    for chunk in chunks:
+      yield fname, chunk
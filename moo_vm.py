@@ -1,8 +1,203 @@
+from array import array
 from attr import attr, attributes, Factory
+from collections import deque
 from typing import List
 from enum import Enum, auto
 import operator
-from moo_opcodes import opcodes
+import time
+from moo_opcodes import opcodes, extended_opcodes, TICKS
+from moo_runtime import (BUILTIN_VARIABLES, UNBOUND, Engine, Error, Frame, MooError, World, catches, moo_add,
+  moo_compare, moo_div, moo_equal, moo_exp, moo_in, moo_index, moo_index_set, moo_mod, moo_mul, moo_negate, moo_range,
+  moo_range_set, moo_sub)
+
+# Operand kinds for opcodes that are followed by operand words in the code.
+# A 'literal' operand is an index into the constants table, a 'label' is an
+# absolute pc, a 'var' is a variable slot and a 'count' is a plain number. An
+# 'index' is a variable slot plus one, or 0 for none.
+# EXTENDED is followed by an extended opcode and then that opcode's operands.
+OPERANDS = {
+  opcodes.IF: ('label',),
+  opcodes.WHILE: ('label',),
+  opcodes.EIF: ('label',),
+  opcodes.FORK: ('label',),
+  opcodes.FORK_WITH_ID: ('var', 'label'),
+  opcodes.FOR_LIST: ('var', 'index', 'label'),
+  opcodes.FOR_RANGE: ('var', 'label'),
+  opcodes.BI_FUNC_CALL: ('literal',),
+  opcodes.IF_QUES: ('label',),
+  opcodes.AND: ('label',),
+  opcodes.OR: ('label',),
+  opcodes.PUT: ('var',),
+  opcodes.PUSH: ('var',),
+  opcodes.PUSH_CLEAR: ('var',),
+  opcodes.IMM: ('literal',),
+  opcodes.JUMP: ('label',),
+}
+
+EXTENDED_OPERANDS = {
+  extended_opcodes.LENGTH: ('count',),
+  # The literal is a tuple of (var, kind, default label) targets, kind being
+  # 'required', 'optional' or 'rest'; the label is where the defaults end.
+  extended_opcodes.SCATTER: ('literal', 'label'),
+  # The literal is a tuple of handler labels, one for each set of codes popped from the stack.
+  extended_opcodes.TRY_EXCEPT: ('literal',),
+  extended_opcodes.END_EXCEPT: ('label',),
+  extended_opcodes.CATCH: ('label',),
+  extended_opcodes.END_CATCH: ('label',),
+  # The count is the stack depth to leave.
+  extended_opcodes.EXIT: ('count', 'label'),
+}
+
+OPCODES_BY_VALUE = [None] * (max(op.value for op in opcodes) + 1)
+for op in opcodes:
+  OPCODES_BY_VALUE[op.value] = op
+
+EXTENDED_BY_VALUE = [None] * (max(op.value for op in extended_opcodes) + 1)
+for op in extended_opcodes:
+  EXTENDED_BY_VALUE[op.value] = op
+
+TICK_COSTS = [0] * len(OPCODES_BY_VALUE)
+for op, cost in TICKS.items():
+  TICK_COSTS[op.value] = cost
+
+class Label:
+  """A position in a program being assembled.
+
+  Place the label in the program where it should point and use the same
+  object as the operand of jumps to it.
+  """
+  __slots__ = ('position',)
+
+  def __init__(self):
+    self.position = None
+
+  def __repr__(self):
+    return "Label(%r)" % self.position
+
+def operand_kinds(op, ext=None):
+  if op is opcodes.EXTENDED:
+    return ('extended',) + EXTENDED_OPERANDS.get(ext, ())
+  return OPERANDS.get(op, ())
+
+def resolve_labels(value):
+  if isinstance(value, Label):
+    if value.position is None:
+      raise ValueError("Label was never placed")
+    return value.position
+  if type(value) is tuple:
+    return tuple(resolve_labels(v) for v in value)
+  return value
+
+def assemble(program, constants=None):
+  """Encode a list of opcodes and their operand values as compact code.
+
+  Returns (code, constants): code is an array of unsigned 16-bit words holding
+  opcode values and operands, and literal operands are moved into constants.
+  Label objects in the program mark jump targets.
+  """
+  if constants is None:
+    constants = []
+  program = list(program)
+  instructions = []
+  position = 0
+  i = 0
+  while i < len(program):
+    op = program[i]
+    i += 1
+    if isinstance(op, Label):
+      op.position = position
+      continue
+    if not isinstance(op, opcodes):
+      raise ValueError("Expected an opcode, got %r" % (op,))
+    kinds = operand_kinds(op, program[i] if op is opcodes.EXTENDED and i < len(program) else None)
+    operands = program[i:i + len(kinds)]
+    if len(operands) < len(kinds):
+      raise ValueError("Missing %s operand for %s" % (kinds[len(operands)], op.name))
+    i += len(kinds)
+    instructions.append((op, kinds, operands))
+    position += 1 + len(kinds)
+  literals = {}
+  code = array('H')
+  for op, kinds, operands in instructions:
+    code.append(op.value)
+    for kind, value in zip(kinds, operands):
+      if kind == 'literal':
+        value = resolve_labels(value)
+        try:
+          key = (type(value), value)
+          index = literals.get(key)
+        except TypeError:
+          key = index = None
+        if index is None:
+          constants.append(value)
+          index = len(constants) - 1
+          if key is not None:
+            literals[key] = index
+        value = index
+      elif kind == 'label':
+        value = resolve_labels(value)
+      elif kind == 'extended':
+        value = value.value
+      code.append(value)
+  return code, constants
+
+def disassemble(code):
+  """Yield (pc, opcode, operands) for every instruction in assembled code."""
+  pc = 0
+  while pc < len(code):
+    op = OPCODES_BY_VALUE[code[pc]]
+    ext = EXTENDED_BY_VALUE[code[pc + 1]] if op is opcodes.EXTENDED else None
+    width = len(operand_kinds(op, ext))
+    yield pc, op, tuple(code[pc + 1:pc + 1 + width])
+    pc += 1 + width
+
+@attributes(slots=True)
+class Program:
+  """An assembled verb, ready to be attached to an object in the World."""
+  code: array = attr()
+  constants: list = attr()
+  var_names: list = attr(default=Factory(lambda: list(BUILTIN_VARIABLES)))
+
+  @classmethod
+  def assemble(cls, program, var_names=None):
+    code, constants = assemble(program)
+    return cls(code, constants, list(var_names if var_names is not None else BUILTIN_VARIABLES))
+
+class MapItems(tuple):
+  """The (key, value) pairs of a map that a for loop is walking."""
+  __slots__ = ()
+
+@attributes(slots=True)
+class Catch:
+  """The stack marker of a try, holding (codes, handler pc) pairs; codes of None catch ANY error."""
+  handlers: tuple = attr()
+
+@attributes
+class ForkedTask:
+  task_id: int = attr()
+  delay = attr()
+  program: Program = attr(repr=False)
+  pc: int = attr()
+  variables: list = attr(repr=False)
+  frame: Frame = attr(repr=False)
+
+@attributes
+class RingBufferTracer:
+  """VM tracer that keeps the last size (pc, opcode, stack depth) records for post-mortem inspection."""
+  size: int = attr(default=64)
+  records: deque = attr(init=False, repr=False)
+
+  def __attrs_post_init__(self):
+    self.records = deque(maxlen=self.size)
+
+  def __call__(self, vm, pc, opcode):
+    self.records.append((pc, opcode, len(vm.stack)))
+
+  def format(self):
+    return "\n".join("%5d %-20s depth=%d" % (pc, OPCODES_BY_VALUE[opcode].name, depth) for pc, opcode, depth in self.records)
+
+def print_tracer(vm, pc, opcode):
+  print(pc, OPCODES_BY_VALUE[opcode].name, vm)
 
 class ExecutionResult(Enum):
   RETURN = auto()
@@ -11,13 +206,65 @@ class ExecutionResult(Enum):
   SUSPEND = auto()
   KILL = auto()
 
+class OutOfTicks(Exception):
+  pass
+
 @attributes
-class VM:
+class VM(Engine):
   stack: List = attr(default=Factory(list))
   pc: int = attr(default=0)
-  code: List = attr(default=Factory(list), repr=False)
+  code: array = attr(default=Factory(lambda: array('H')), repr=False)
   constants: List = attr(default=Factory(list))
   return_value = attr(default=0)
+  # Called as tracer(vm, pc, opcode) before every instruction when set.
+  tracer = attr(default=None, repr=False)
+  world: World = attr(default=Factory(World), repr=False)
+  variables: List = attr(default=Factory(list), repr=False)
+  var_names: List = attr(default=Factory(lambda: list(BUILTIN_VARIABLES)), repr=False)
+  frame: Frame = attr(default=Factory(Frame), repr=False)
+  ticks: int = attr(default=0)
+  max_ticks: int = attr(default=30000)
+  max_seconds: float = attr(default=5.0)
+  max_depth: int = attr(default=50)
+  error = attr(default=None)
+  forked: List = attr(default=Factory(list), repr=False)
+
+  def __attrs_post_init__(self):
+    self.handlers = self.handler_table()
+    self.extended_handlers = self.extended_handler_table()
+    missing = self.missing_handlers()
+    if missing:
+      raise NotImplementedError("No handler for opcodes %s" % ", ".join(op.name for op in missing))
+    self.depth = 0
+    self.temp = None
+    self.next_task_id = 1
+    self.init_builtins()
+
+  @classmethod
+  def handler_table(cls):
+    """Return this class's opcode handlers as a list indexed by opcode value, building it on first use."""
+    table = cls.__dict__.get('_handler_table')
+    if table is None:
+      table = [None] * (max(op.value for op in opcodes) + 1)
+      for op in opcodes:
+        table[op.value] = getattr(cls, 'do_' + op.name.lower(), None)
+      cls._handler_table = table
+    return table
+
+  @classmethod
+  def extended_handler_table(cls):
+    table = cls.__dict__.get('_extended_handler_table')
+    if table is None:
+      table = [getattr(cls, 'do_ext_' + op.name.lower(), None) for op in EXTENDED_BY_VALUE]
+      cls._extended_handler_table = table
+    return table
+
+  @classmethod
+  def missing_handlers(cls):
+    table = cls.handler_table()
+    extended = cls.extended_handler_table()
+    missing = [op for op in opcodes if not callable(table[op.value])]
+    return missing + [op for op in extended_opcodes if not callable(extended[op.value])]
 
   def push(self, what):
     self.stack.append(what)
@@ -30,45 +277,257 @@ class VM:
     address = len(self.constants) - 1
     self.push(address)
 
+  def read_byte(self):
+    pc = self.pc
+    self.pc = pc + 1
+    return self.code[pc]
 
-  def read_bytes(self, amount=1):
-    new_pc = self.pc + amount
-    if new_pc > len(self.code) - 1:
-      return []
-    result = self.code[self.pc:new_pc]
-    self.pc = new_pc
-    return result
+  def read_literal(self):
+    return self.constants[self.read_byte()]
 
-  def read_byte(self):
-    res = self.read_bytes()
-    if res:
-      return res[0]
+  def load(self, code, constants=None, var_names=None):
+    """Load a program, assembling it first if it is a list of opcodes and operands."""
+    if not isinstance(code, array):
+      code, constants = assemble(code)
+    self.code = code
+    self.constants = constants if constants is not None else []
+    self.var_names = list(var_names if var_names is not None else BUILTIN_VARIABLES)
 
-  def run(self, opcodes: List) -> ExecutionResult:
+  def run(self, code, constants=None, frame=None, var_names=None) -> ExecutionResult:
     self.reset()
-    self.code = opcodes
-    while opcode := self.read_byte():
-      print(self)
-      self.dispatch_opcode(opcode)
-    print(self)
+    self.load(code, constants, var_names)
+    self.frame = frame if frame is not None else Frame()
+    self.variables = self.frame.variables(self.var_names)
+    return self.run_guarded()
+
+  def run_program(self, program, frame=None):
+    return self.run(program.code, program.constants, frame, program.var_names)
+
+  def run_guarded(self):
+    try:
+      self.execute()
+    except MooError as e:
+      self.error = e
+      return ExecutionResult.RAISE
+    except OutOfTicks:
+      return ExecutionResult.KILL
+    return ExecutionResult.RETURN
+
+  def execute(self):
+    """Run the loaded code from pc until it returns or falls off the end.
+
+    A MooError goes to the handler of the innermost try on the stack that catches it.
+    """
+    while True:
+      try:
+        return self.dispatch()
+      except MooError as e:
+        if not self.unwind(e):
+          raise
+
+  def unwind(self, error):
+    stack = self.stack
+    for i in range(len(stack) - 1, -1, -1):
+      if type(stack[i]) is Catch:
+        for codes, label in stack[i].handlers:
+          if catches(codes, error.error):
+            del stack[i:]
+            self.push(error.as_value())
+            self.pc = label
+            return True
+    return False
+
+  def dispatch(self):
+    code = self.code
+    end = len(code)
+    handlers = self.handlers
+    costs = TICK_COSTS
+    tracer = self.tracer
+    while self.pc < end:
+      opcode = code[self.pc]
+      self.pc += 1
+      if tracer is not None:
+        tracer(self, self.pc - 1, opcode)
+      self.ticks += costs[opcode]
+      if self.ticks > self.max_ticks:
+        raise OutOfTicks()
+      handlers[opcode](self)
 
   def reset(self):
     self.stack.clear()
     self.pc = 0
+    self.ticks = 0
+    self.error = None
+    self.return_value = 0
+    self.depth = 0
+    self.started = time.monotonic()
 
   def dispatch_opcode(self, opcode):
-    name = opcode.name.lower()
-    func_name = 'do_' + name
-    handler = getattr(self, func_name, None)
-    if not callable(handler):
-      raise NotImplementedError("No handler for opcode %r" % name)
-    handler()
+    self.handlers[opcode](self)
+
+  def call_verb(self, obj, name, args):
+    """Run verb name on obj with args in a new activation and return its value."""
+    verb = self.world.find_verb(obj, name)
+    if callable(verb):
+      return verb(self, obj, args)
+    if self.depth >= self.max_depth:
+      raise MooError(Error.E_MAXREC)
+    saved = (self.code, self.constants, self.pc, self.stack, self.variables, self.var_names, self.frame, self.return_value)
+    self.depth += 1
+    try:
+      self.code, self.constants, self.var_names = verb.code, verb.constants, verb.var_names
+      self.frame = Frame(this=obj, verb=name, args=args, player=saved[6].player, caller=saved[6].this)
+      self.variables = self.frame.variables(verb.var_names)
+      self.stack = []
+      self.pc = 0
+      self.return_value = 0
+      self.execute()
+      return self.return_value
+    finally:
+      self.depth -= 1
+      (self.code, self.constants, self.pc, self.stack, self.variables, self.var_names, self.frame, self.return_value) = saved
+
+  def run_forked(self):
+    """Run queued forked tasks in order of their delay, including any they fork themselves."""
+    results = []
+    while self.forked:
+      self.forked.sort(key=lambda task: task.delay)
+      task = self.forked.pop(0)
+      self.reset()
+      self.load(task.program.code, task.program.constants, task.program.var_names)
+      self.pc = task.pc
+      self.frame = task.frame
+      self.variables = task.variables
+      results.append((task, self.run_guarded()))
+    return results
+
+  def fork(self, var):
+    label = self.read_byte()
+    delay = self.pop()
+    task_id = self.new_task_id(delay)
+    if var is not None:
+      self.variables[var] = task_id
+    program = Program(self.code, self.constants, self.var_names)
+    self.forked.append(ForkedTask(task_id, delay, program, self.pc, list(self.variables), self.frame))
+    self.pc = label
+
+  def jump(self, label):
+    self.pc = label
 
   def do_test(self):
     cond = self.pop()
 
-  def jump(self, label):
-    pass
+  def do_if(self):
+    label = self.read_byte()
+    if not self.pop():
+      self.pc = label
+
+  do_while = do_if
+
+  do_eif = do_if
+
+  do_if_ques = do_if
+
+  def do_jump(self):
+    self.pc = self.read_byte()
+
+  def do_fork(self):
+    self.fork(None)
+
+  def do_fork_with_id(self):
+    self.fork(self.read_byte())
+
+  def do_for_list(self):
+    var = self.read_byte()
+    index_var = self.read_byte()
+    label = self.read_byte()
+    stack = self.stack
+    index = stack[-1]
+    items = stack[-2]
+    if type(items) is dict:
+      # A map is walked as its (key, value) pairs, the key going to the index variable.
+      items = stack[-2] = MapItems(items.items())
+    elif type(items) not in (tuple, MapItems) or type(index) is not int:
+      raise MooError(Error.E_TYPE)
+    if index > len(items):
+      del stack[-2:]
+      self.pc = label
+      return
+    if type(items) is MapItems:
+      key, self.variables[var] = items[index - 1]
+    else:
+      key = index
+      self.variables[var] = items[index - 1]
+    if index_var:
+      self.variables[index_var - 1] = key
+    stack[-1] = index + 1
+
+  def do_for_range(self):
+    var = self.read_byte()
+    label = self.read_byte()
+    stack = self.stack
+    to = stack[-1]
+    start = stack[-2]
+    if type(start) is not type(to) or type(start) is not int:
+      raise MooError(Error.E_TYPE)
+    if start > to:
+      del stack[-2:]
+      self.pc = label
+    else:
+      self.variables[var] = start
+      stack[-2] = start + 1
+
+  def do_index_set(self):
+    value = self.pop()
+    index = self.pop()
+    base = self.pop()
+    self.push(moo_index_set(base, index, value))
+
+  def do_push_get_prop(self):
+    self.push(self.world.get_prop(self.stack[-2], self.stack[-1]))
+
+  def do_get_prop(self):
+    prop = self.pop()
+    obj = self.pop()
+    self.push(self.world.get_prop(obj, prop))
+
+  def do_put_prop(self):
+    value = self.pop()
+    prop = self.pop()
+    obj = self.pop()
+    self.world.put_prop(obj, prop, value)
+    self.push(value)
+
+  def do_call_verb(self):
+    args = self.pop()
+    verb = self.pop()
+    obj = self.pop()
+    if type(args) is not tuple:
+      raise MooError(Error.E_TYPE)
+    self.push(self.call_verb(obj, verb, args))
+
+  def do_bi_func_call(self):
+    name = self.read_literal()
+    args = self.pop()
+    self.push(self.call_builtin(name, args))
+
+  def do_ref(self):
+    index = self.pop()
+    base = self.pop()
+    self.push(moo_index(base, index))
+
+  def do_range_ref(self):
+    to = self.pop()
+    start = self.pop()
+    base = self.pop()
+    self.push(moo_range(base, start, to))
+
+  def do_make_singleton_list(self):
+    self.stack[-1] = (self.stack[-1],)
+
+  def do_check_list_for_splice(self):
+    if type(self.stack[-1]) is not tuple:
+      raise MooError(Error.E_TYPE)
 
   def do_map_create(self):
     new_map = dict()
@@ -78,11 +537,16 @@ class VM:
     key = self.pop()
     value = self.pop()
     map = self.pop()
+    if type(map) is not dict or type(key) in (tuple, dict):
+      raise MooError(Error.E_TYPE)
+    map = dict(map)
+    map[key] = value
+    self.push(map)
 
   def do_add(self):
     rhs = self.pop()
     lhs = self.pop()
-    ans = lhs + rhs
+    ans = moo_add(lhs, rhs)
     self.push(ans)
 
   def do_binary_op(self, operator):
@@ -90,24 +554,181 @@ class VM:
     lhs = self.pop()
     self.push(operator(lhs, rhs))
 
-  do_minus = lambda self: self.do_binary_op(operator.sub)
+  do_minus = lambda self: self.do_binary_op(moo_sub)
+
+  do_mult = lambda self: self.do_binary_op(moo_mul)
+
+  do_div = lambda self: self.do_binary_op(moo_div)
+
+  do_mod = lambda self: self.do_binary_op(moo_mod)
+
+  do_eq = lambda self: self.do_binary_op(lambda l, r: int(moo_equal(l, r)))
+
+  do_ne = lambda self: self.do_binary_op(lambda l, r: int(not moo_equal(l, r)))
+
+  do_lt = lambda self: self.do_binary_op(lambda l, r: int(moo_compare(l, r) < 0))
+
+  do_le = lambda self: self.do_binary_op(lambda l, r: int(moo_compare(l, r) <= 0))
+
+  do_gt = lambda self: self.do_binary_op(lambda l, r: int(moo_compare(l, r) > 0))
+
+  do_ge = lambda self: self.do_binary_op(lambda l, r: int(moo_compare(l, r) >= 0))
+
+  do_in = lambda self: self.do_binary_op(moo_in)
 
-  do_mult = lambda self: self.do_binary_op(operator.mul)
+  def do_and(self):
+    label = self.read_byte()
+    if not self.stack[-1]:
+      self.pc = label
+    else:
+      self.pop()
 
-  do_mod = lambda self: self.do_binary_op(operator.mod)
+  def do_or(self):
+    label = self.read_byte()
+    if self.stack[-1]:
+      self.pc = label
+    else:
+      self.pop()
+
+  def do_unary_minus(self):
+    self.stack[-1] = moo_negate(self.stack[-1])
+
+  def do_not(self):
+    self.stack[-1] = int(not self.stack[-1])
+
+  def do_put(self):
+    self.variables[self.read_byte()] = self.stack[-1]
+
+  def do_push(self):
+    var = self.read_byte()
+    value = self.variables[var]
+    if value is UNBOUND:
+      raise MooError(Error.E_VARNF, "Variable not found: %s" % self.var_names[var])
+    self.push(value)
+
+  def do_push_clear(self):
+    var = self.read_byte()
+    value = self.variables[var]
+    if value is UNBOUND:
+      raise MooError(Error.E_VARNF, "Variable not found: %s" % self.var_names[var])
+    self.variables[var] = UNBOUND
+    self.push(value)
 
   def do_pop(self):
     self.pop()
 
   def do_imm(self):
-    constant = self.read_byte()
-    self.push(constant)
+    self.push(self.read_literal())
+
+  def do_make_empty_list(self):
+    self.push(())
+
+  def do_list_add_tail(self):
+    tail = self.pop()
+    items = self.pop()
+    if type(items) is not tuple or type(tail) is not tuple:
+      raise MooError(Error.E_TYPE)
+    self.push(items + tail)
+
+  def do_list_append(self):
+    value = self.pop()
+    items = self.pop()
+    if type(items) is not tuple:
+      raise MooError(Error.E_TYPE)
+    self.push(items + (value,))
+
+  def do_push_ref(self):
+    self.push(moo_index(self.stack[-2], self.stack[-1]))
+
+  def do_put_temp(self):
+    self.temp = self.stack[-1]
+
+  def do_push_temp(self):
+    self.push(self.temp)
+    self.temp = None
 
   def do_return(self):
     ret_val = self.pop()
     self.return_value = ret_val
+    self.pc = len(self.code)
 
   def do_return_0(self):
-    pass
+    self.return_value = 0
+    self.pc = len(self.code)
 
   do_done = do_return_0
+
+  def do_extended(self):
+    self.ticks += 1
+    self.extended_handlers[self.read_byte()](self)
+
+  def do_ext_rangeset(self):
+    value = self.pop()
+    to = self.pop()
+    start = self.pop()
+    base = self.pop()
+    self.push(moo_range_set(base, start, to, value))
+
+  def do_ext_length(self):
+    value = self.stack[-1 - self.read_byte()]
+    if type(value) not in (tuple, str, dict):
+      raise MooError(Error.E_TYPE)
+    self.push(len(value))
+
+  def do_ext_exp(self):
+    self.do_binary_op(moo_exp)
+
+  def do_ext_scatter(self):
+    targets = self.read_literal()
+    done = self.read_byte()
+    values = self.stack[-1]
+    if type(values) is not tuple:
+      raise MooError(Error.E_TYPE)
+    required = sum(1 for var, kind, default in targets if kind == 'required')
+    optional = sum(1 for var, kind, default in targets if kind == 'optional')
+    has_rest = any(kind == 'rest' for var, kind, default in targets)
+    if len(values) < required or (not has_rest and len(values) > required + optional):
+      raise MooError(Error.E_ARGS)
+    supplied = min(optional, len(values) - required)
+    rest = len(values) - required - supplied
+    position = 0
+    jump = done
+    for var, kind, default in targets:
+      if kind == 'rest':
+        self.variables[var] = values[position:position + rest]
+        position += rest
+      elif kind == 'required' or supplied:
+        if kind == 'optional':
+          supplied -= 1
+        self.variables[var] = values[position]
+        position += 1
+      elif default is not None and jump == done:
+        jump = default
+    self.pc = jump
+
+  def do_ext_try_except(self):
+    labels = self.read_literal()
+    codes = self.stack[-len(labels):]
+    del self.stack[-len(labels):]
+    self.push(Catch(tuple(zip(codes, labels))))
+
+  def do_ext_end_except(self):
+    label = self.read_byte()
+    self.pop()
+    self.pc = label
+
+  def do_ext_catch(self):
+    label = self.read_byte()
+    self.push(Catch(((self.pop(), label),)))
+
+  def do_ext_end_catch(self):
+    label = self.read_byte()
+    value = self.pop()
+    self.stack[-1] = value
+    self.pc = label
+
+  def do_ext_exit(self):
+    depth = self.read_byte()
+    label = self.read_byte()
+    del self.stack[depth:]
+    self.pc = label
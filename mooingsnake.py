@@ -1,18 +1,27 @@
 import argparse
-import astroid
+import glob
 import io
 import os
 import pdb
 import sys
 import importlib
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 import logging
 from logging import getLogger
 logger = getLogger("Transpiler")
 from attr import attr, attributes, Factory
+from constant_folding import NotConstant, constant, fold_binary, fold_bool, fold_compare, moo_truth
+from inlining import DEFAULT_THRESHOLD as DEFAULT_INLINE_THRESHOLD, find_candidate
+from moo_index import ProgramIndex
+from moo_script import diff_scripts, split_units
+from transpile_cache import TranspileCache
 
 logger = getLogger("Transpiler")
-logger.addHandler(logging.StreamHandler())
+# Only once, even when this module is both __main__ and imported by a helper module.
+if not logger.handlers:
+  logger.addHandler(logging.StreamHandler())
 
 DEFAULT_VERB_ARGS = 'tnt'
 DEFAULT_VERB_PERMS = 'RXD'
@@ -27,10 +36,12 @@ transformations_table = {
   'sum': '$math_utils:sum',
 }
 
-def load_ast(fname):
+def read_source(fname):
   with open(fname, encoding='UTF-8') as f:
-    code = f.read()
-  return astroid.parse(code)
+    return f.read()
+
+def load_ast(fname):
+  return PythonToMoo.parse(read_source(fname))
 
 @attributes
 class Context:
@@ -38,17 +49,83 @@ class Context:
   verb = attr(default=None)
   in_function_call = attr(default=False)
   in_index = attr(default=False)
+  # Methods of current_obj that calls are inlined to: name -> (inlining.Candidate, definition).
+  inline = attr(default=Factory(dict))
+  # Parameters of the method being inlined -> the nodes it was called with.
+  bindings = attr(default=None)
+
+
+@attributes
+class SuspendPolicy:
+  """When loops generated with suspend checks give the rest of the server a turn."""
+  ticks = attr(default=2000)
+  seconds = attr(default=1)
+
+
+@attributes
+class UnitWriter:
+  """Collects fragments until a unit (@create, @verb/@program, @property) is complete, then writes it to stream in one call."""
+  stream = attr()
+  parts = attr(default=Factory(list))
+
+  def write(self, string):
+    self.parts.append(string)
+
+  def end_unit(self):
+    if not self.parts:
+      return
+    self.stream.write("".join(self.parts))
+    self.parts.clear()
+    flush = getattr(self.stream, 'flush', None)
+    if flush is not None:
+      flush()
+
+
+class Chunks(list):
+  """A stream for UnitWriter that keeps each unit as a separate string."""
+  write = list.append
 
 
 @attributes
 class PythonToMoo:
+  """Converts astroid trees. astroid is imported on first use so other frontends can start without it."""
+  frontend = 'astroid'
+
   output = attr()
   context = attr(default=Factory(Context))
   debug = attr(default=False)
+  cache = attr(default=None)
+  # A moo_index.ProgramIndex of every input, to resolve parents and check this:verb() calls.
+  index = attr(default=None)
+  # Fold constant expressions and drop branches that can never run.
+  optimize = attr(default=False)
+  # Inline calls to small pure methods of the same class, up to this many expression nodes; None to never inline.
+  inline = attr(default=None)
+  # A SuspendPolicy to make every loop iteration suspend when the task runs low on ticks or seconds.
+  suspend = attr(default=None)
+  # A list to fill with (script line, source line) pairs as nodes are converted; only accurate without a cache.
+  line_map = attr(default=None)
 
   def __attrs_post_init__(self):
+    self.converters = self.register_converters()
+    self.const_converters = {
+      'builtins.int': self.convert_const_int,
+      'builtins.str': self.convert_const_str,
+    }
+    # Converters resolved for each node class seen so far, see find_converter.
+    self.dispatch = {}
+    if logger.isEnabledFor(logging.DEBUG):
+      self.convert_node = self.trace_node
+    if self.line_map is not None:
+      self.lines = 1
+      self.write = self.write_counting
+      self.convert_unmapped = self.convert_node
+      self.convert_node = self.map_node
+
+  def register_converters(self):
     """Register converters here"""
-    self.converters = {
+    import astroid
+    return {
       astroid.ClassDef: self.convert_obj,
       astroid.FunctionDef: self.convert_verb,
       astroid.While: self.convert_while,
@@ -80,12 +157,26 @@ class PythonToMoo:
       astroid.Call: self.convert_call,
       astroid.Index: self.convert_index,
     }
-    self.const_converters = {
-      'builtins.int': self.convert_const_int,
-      'builtins.str': self.convert_const_str,
-    }
+
+  @staticmethod
+  def parse(code):
+    import astroid
+    return astroid.parse(code)
+
+  @staticmethod
+  def node_source(node):
+    return node.as_string()
+
+  @staticmethod
+  def pytype(node):
+    return node.pytype()
 
   def convert_verb(self, node):
+    self.write_cached('verb', node, self.emit_verb)
+    self.context.verb = ""
+    self.end_unit()
+
+  def emit_verb(self, node):
     verb_name = node.name
     obj_name = self.context.current_obj
     default_args = DEFAULT_VERB_ARGS
@@ -97,19 +188,74 @@ class PythonToMoo:
     for subnode in node.body:
       self.convert_node(subnode, )
     self.write(".\n")
-    self.context.verb = ""
 
   def convert_obj(self, node):
+    self.begin_obj(node)
+    for subnode in node.body:
+      self.convert_node(subnode)
+
+  def begin_obj(self, node):
     class_name = node.name
-    self.write("@create #1 named {class_name}\n".format(**locals()))
+    parent = self.index.created_from(class_name) if self.index is not None else None
+    if parent is None:
+      parent = "#1"
+      if self.index is not None and self.index.parent(class_name) is not None:
+        logger.warning("{} is created before its parent {}, so it is created from #1 and moved later".format(
+          class_name, self.index.parent(class_name)))
+    self.write("@create {parent} named {class_name}\n".format(**locals()))
+    if self.index is not None:
+      for child in self.index.reparented(class_name):
+        self.end_unit()
+        self.write("@chparent {child} to {class_name}\n".format(**locals()))
     self.context.current_obj = class_name
+    if self.inline is not None:
+      self.context.inline = self.inline_candidates(node)
+    self.end_unit()
+
+  def inline_candidates(self, node):
+    # this:verb() runs a descendant's override on a descendant, so overridden methods are never inlined.
+    overridden = self.index.overridden(self.context.current_obj) if self.index is not None else set()
+    candidates = {}
     for subnode in node.body:
-      self.convert_node(subnode)
+      if self.find_converter(type(subnode)) == self.convert_verb:
+        candidate = find_candidate(self.node_source(subnode), self.inline)
+        if candidate is not None and candidate.name not in overridden:
+          candidates[candidate.name] = candidate, subnode
+    return candidates
+
+  def write_inlined(self, node):
+    """Write a call to an inlinable method of this object as its expression, returning whether it did."""
+    verb = self.called_verb(node.func)
+    if verb is None or verb not in self.context.inline or verb == self.context.verb:
+      return False
+    candidate, definition = self.context.inline[verb]
+    bindings = candidate.bind(node.args, node.keywords, definition.args.defaults)
+    # Arguments may be used any number of times, so they have to be safe to evaluate again.
+    if bindings is None or not all(self.is_pure(value) for value in bindings.values()):
+      return False
+    logger.info("Inlined {obj}:{verb} into {obj}:{caller}".format(obj=self.context.current_obj, verb=verb, caller=self.context.verb))
+    outer, self.context.bindings = self.context.bindings, bindings
+    self.write("(")
+    self.convert_node(definition.body[-1].value)
+    self.write(")")
+    self.context.bindings = outer
+    return True
+
+  def write_binding(self, name):
+    """Write the argument bound to name if a method is being inlined, returning whether it did."""
+    if not self.context.bindings or name not in self.context.bindings:
+      return False
+    outer, self.context.bindings = self.context.bindings, None
+    self.convert_node(outer[name])
+    self.context.bindings = outer
+    return True
 
-  def convert_scoped_node(self, node, start_token, end_token):
+  def convert_scoped_node(self, node, start_token, end_token, loop=False):
     self.write(start_token + " (")
     self.convert_node(node.test, )
     self.write(")\n")
+    if loop:
+      self.write_suspend_check()
     for subnode in node.body:
       self.convert_node(subnode, )
     if node.orelse:
@@ -123,30 +269,229 @@ class PythonToMoo:
       raise RuntimeError("While loop not supported out of class or function.")
     if self.context.verb is None:
       raise RuntimeError("Loop not supported out of function call.")
-    self.convert_scoped_node(node, "while", "endwhile")
+    if self.static_truth(node.test) is False:
+      for subnode in node.orelse:
+        self.convert_node(subnode)
+      return
+    self.convert_scoped_node(node, "while", "endwhile", loop=True)
 
   def convert_if(self, node):
     if self.context.current_obj is None and self.context.verb is None:
       raise RuntimeError("If statement not supported out of class or function.")
     if self.context.verb is None:
       raise RuntimeError("If not supported out of function call.")
+    truth = self.static_truth(node.test)
+    if truth is not None:
+      for subnode in node.body if truth else node.orelse:
+        self.convert_node(subnode)
+      return
     self.convert_scoped_node(node, "if", "endif")
 
+  def static_truth(self, node):
+    """Whether node is always true or always false when optimizing, or None if that is only known at run time."""
+    if not self.optimize:
+      return None
+    try:
+      return moo_truth(self.fold(node))
+    except NotConstant:
+      return None
+
+  def fold(self, node):
+    """The value of a constant expression, raising NotConstant for anything else."""
+    import astroid
+    if isinstance(node, astroid.Const):
+      return constant(node.value)
+    if isinstance(node, astroid.BinOp):
+      return fold_binary(node.op, self.fold(node.left), self.fold(node.right))
+    if isinstance(node, astroid.Compare):
+      value = self.fold(node.left)
+      for op, operand in node.ops:
+        value = fold_compare(op, value, self.fold(operand))
+      return value
+    if isinstance(node, astroid.BoolOp):
+      return fold_bool(node.op, node.values, self.fold)
+    raise NotConstant()
+
+  def write_folded(self, node):
+    """Write node's value if it is constant and optimizing, returning whether it was written."""
+    if not self.optimize or self.context.in_index:
+      return False
+    try:
+      value = self.fold(node)
+    except NotConstant:
+      return False
+    self.write_constant(value)
+    return True
+
+  def write_constant(self, value):
+    if value is True:
+      self.write("true")
+    elif value is False:
+      self.write("false")
+    elif value is None:
+      self.write("$nothing")
+    elif type(value) is str:
+      self.write_string(value)
+    else:
+      self.write(repr(value))
+
+  def is_noop_update(self, operator, value):
+    """Whether x <operator>= value leaves x as it is, so an optimized build can leave the statement out."""
+    if not self.optimize:
+      return False
+    try:
+      value = self.fold(value)
+    except NotConstant:
+      return False
+    return type(value) in (int, float) and value == {'+': 0, '-': 0, '*': 1, '**': 1}.get(operator)
+
   def convert_for(self, node):
     if self.context.current_obj is None and self.context.verb is None:
       raise RuntimeError("for loop not supported out of class or function.")
     if self.context.verb is None:
       raise RuntimeError("For loop not supported out of function call.")
-    self.write("for ")
-    self.convert_node(node.target)
-    self.write(" in ")
-    self.write("(")
-    self.convert_node(node.iter)
-    self.write(")\n")
+    if not self.lower_range_loop(node):
+      self.write("for ")
+      self.convert_node(node.target)
+      self.write(" in ")
+      self.write("(")
+      self.convert_node(node.iter)
+      self.write(")\n")
+    self.write_suspend_check()
     for subnode in node.body:
       self.convert_node(subnode, )
     self.write("endfor\n")
 
+  def write_suspend_check(self):
+    """Start a loop body by suspending if the task is close to running out of ticks or seconds.
+
+    Every iteration, including one ended by continue, passes the top of the
+    body, so this is as good as checking at the loop's back edge.
+    """
+    if self.suspend is None:
+      return
+    self.write("if ((ticks_left() < {}) || (seconds_left() < {}))\nsuspend(0);\nendif\n".format(
+      self.suspend.ticks, self.suspend.seconds))
+
+  def lower_range_loop(self, node):
+    """Write the header of a loop over range(), reversed(range()) or enumerate() as a MOO range loop.
+
+    MOO's `for i in [a..b]` counts upwards without building a list. Returns
+    False, having written nothing, for any other loop.
+    """
+    names = self.target_names(node.target)
+    call = self.call_parts(node.iter)
+    if names is None or call is None:
+      return False
+    function, args = call
+    if function == 'range' and len(names) == 1:
+      bounds = self.range_bounds(args)
+      if bounds is None:
+        return False
+      self.write("for {} in [".format(names[0]))
+      self.write_bound(bounds[0])
+      self.write("..")
+      self.write_bound(bounds[1], -1)
+      self.write("]\n")
+      return True
+    if function == 'reversed' and len(names) == 1 and len(args) == 1:
+      inner = self.call_parts(args[0])
+      bounds = self.range_bounds(inner[1]) if inner is not None and inner[0] == 'range' else None
+      if bounds is None:
+        return False
+      # Count from -(stop - 1) up to -start and flip the sign, so each bound is evaluated once.
+      self.write("for {} in [".format(names[0]))
+      self.write_bound(bounds[1], -1, negate=True)
+      self.write("..")
+      self.write_bound(bounds[0], negate=True)
+      self.write("]\n{name} = 0 - {name};\n".format(name=names[0]))
+      return True
+    if function == 'enumerate' and len(names) == 2 and len(args) in (1, 2):
+      start = 0
+      if len(args) == 2:
+        start = self.constant_int(args[1])
+        if start is None:
+          return False
+      sequence = args[0]
+      # The sequence is indexed on every iteration, so it has to be a plain variable or property.
+      if not self.is_pure(sequence):
+        return False
+      counter, item = names
+      self.write("for {} in [{}..length(".format(counter, start))
+      self.convert_node(sequence)
+      self.write(")")
+      self.write_offset(start - 1)
+      self.write("]\n{} = ".format(item))
+      self.convert_node(sequence)
+      self.write("[{}".format(counter))
+      self.write_offset(1 - start)
+      self.write("];\n")
+      return True
+    return False
+
+  def range_bounds(self, args):
+    """(start, stop) of range(*args) if it counts up in steps of one, otherwise None."""
+    if len(args) == 1:
+      return 0, args[0]
+    if len(args) == 2 or (len(args) == 3 and self.constant_int(args[2]) == 1):
+      return args[0], args[1]
+    return None
+
+  def constant_int(self, node):
+    try:
+      value = self.fold(node)
+    except NotConstant:
+      return None
+    return value if type(value) is int else None
+
+  def write_bound(self, bound, offset=0, negate=False):
+    value = bound if type(bound) is int else self.constant_int(bound)
+    if value is not None:
+      self.write(str(-(value + offset) if negate else value + offset))
+      return
+    if not negate:
+      self.convert_node(bound)
+      self.write_offset(offset)
+      return
+    # -(bound + offset), written without a unary minus.
+    self.write("{} - ".format(-offset))
+    atomic = self.is_pure(bound) or self.call_parts(bound) is not None
+    self.write("" if atomic else "(")
+    self.convert_node(bound)
+    self.write("" if atomic else ")")
+
+  def write_offset(self, offset):
+    if offset:
+      self.write(" {} {}".format('+' if offset > 0 else '-', abs(offset)))
+
+  @staticmethod
+  def call_parts(node):
+    """(function name, positional arguments) of a plain call like f(a, b), otherwise None."""
+    import astroid
+    if not isinstance(node, astroid.Call) or not isinstance(node.func, astroid.Name) or node.keywords:
+      return None
+    if any(isinstance(arg, astroid.Starred) for arg in node.args):
+      return None
+    return node.func.name, node.args
+
+  @staticmethod
+  def target_names(node):
+    """The variable names a loop assigns to, or None if it assigns to anything else."""
+    import astroid
+    if isinstance(node, astroid.AssignName):
+      return [node.name]
+    if isinstance(node, astroid.Tuple) and all(isinstance(elt, astroid.AssignName) for elt in node.elts):
+      return [elt.name for elt in node.elts]
+    return None
+
+  @classmethod
+  def is_pure(cls, node):
+    """Whether evaluating node again gives the same value without side effects."""
+    import astroid
+    if isinstance(node, (astroid.Name, astroid.Const)):
+      return True
+    return isinstance(node, astroid.Attribute) and cls.is_pure(node.expr)
+
   def convert_break(self, node):
     self.write("break;\n")
 
@@ -166,7 +511,7 @@ class PythonToMoo:
     elif value is "or":
       self.write("||")
     else:
-      converter = self.const_converters.get(node.pytype())
+      converter = self.const_converters.get(self.pytype(node))
       if converter:
         return converter(node)
       else:
@@ -180,16 +525,44 @@ class PythonToMoo:
     self.write(value)
 
   def convert_const_str(self, node):
-    to_write = b"\"" + node.value.encode("unicode_escape") + b"\""
+    self.write_string(node.value)
+
+  def write_string(self, value):
+    to_write = b"\"" + value.encode("unicode_escape") + b"\""
     self.write(to_write.decode('UTF-8'))
 
   def convert_node(self, node):
+    try:
+      converter = self.dispatch[type(node)]
+    except KeyError:
+      converter = self.find_converter(type(node))
+    converter(node)
+
+  def trace_node(self, node):
+    """convert_node with debug logging; used instead of it when the logger is at DEBUG level."""
     node_type = type(node)
     logger.debug("Parsing node type: %r", node_type)
-    converter = self.converters.get(node_type, self.default_converter)
-    if callable(converter):
-      logger.debug("Found converter %r", converter)
-      converter(node, )
+    converter = self.dispatch.get(node_type) or self.find_converter(node_type)
+    logger.debug("Found converter %r", converter)
+    converter(node)
+
+  def map_node(self, node):
+    """convert_node that records the source line of each node; used instead of it when line_map is given."""
+    lineno = getattr(node, 'lineno', None)
+    if lineno is not None:
+      self.line_map.append((self.lines, lineno))
+    self.convert_unmapped(node)
+
+  def find_converter(self, node_type):
+    """Return the converter registered for node_type or its nearest base class, and remember it."""
+    for cls in node_type.__mro__:
+      converter = self.converters.get(cls)
+      if converter is not None:
+        break
+    else:
+      converter = self.default_converter
+    self.dispatch[node_type] = converter
+    return converter
 
   def convert_and(self, node):
     self.write("&&")
@@ -201,6 +574,8 @@ class PythonToMoo:
     self.write("!")
 
   def convert_comparison(self, node):
+    if self.write_folded(node):
+      return
     self.convert_node(node.left)
     for comp_type, subop in node.ops:
       self.write(self.convert_comp_op(comp_type))
@@ -216,11 +591,13 @@ class PythonToMoo:
     return " " + op + " "
 
   def convert_name(self, node):
+    if self.write_binding(node.name):
+      return
     new_name = self.transform_name(node.name)
     self.write(new_name)
 
   def convert_raise(self, node):
-    self.output.write("raise (")
+    self.write("raise (")
     self.convert_node(node.exc.func)
     self.write(");\n")
 
@@ -240,6 +617,10 @@ class PythonToMoo:
       self.write(";\n")
 
   def add_property(self, node):
+    self.write_cached('property', node, self.emit_property)
+    self.end_unit()
+
+  def emit_property(self, node):
     obj = self.context.current_obj
     for prop in node.targets:
       self.write("@property {obj}.".format(**locals()))
@@ -255,14 +636,20 @@ class PythonToMoo:
     self.write(node.name)
 
   def convert_aug_assign(self, node):
+    if self.is_noop_update(node.op[:-1], node.value):
+      return
     self.convert_node(node.target)
     self.write(" = ")
     self.convert_node(node.target)
-    self.write(" " + node.op[0] + " ")
+    self.write(" ")
+    self.write_op(node.op[:-1])
+    self.write(" ")
     self.convert_node(node.value)
     self.write(";\n");
 
   def convert_bin_op(self, node):
+    if self.write_folded(node):
+      return
     self.convert_node(node.left)
     self.write(" ")
     self.write_op(node.op)
@@ -318,6 +705,8 @@ class PythonToMoo:
       self.convert_node(node.upper)
 
   def convert_multi_comparison(self, node):
+    if self.write_folded(node):
+      return
     self.write("(")
     self.convert_node(node.values[0])
     self.write(") ")
@@ -327,7 +716,9 @@ class PythonToMoo:
     self.write(")")
 
   def write_op(self, op):
-    transforms = {'or': '||', 'not': '!', 'and': '&&'}
+    if op == '^':
+      raise RuntimeError("Exclusive or (^) has no MOO equivalent; MOO's ^ is exponentiation.")
+    transforms = {'or': '||', 'not': '!', 'and': '&&', '**': '^'}
     self.write(transforms.get(op, op))
 
   def convert_return(self, node):
@@ -368,6 +759,10 @@ class PythonToMoo:
     self.write(node.attrname)
 
   def convert_call(self, node):
+    if self.context.inline and self.write_inlined(node):
+      return
+    if self.index is not None:
+      self.check_verb_call(node.func)
     self.context.in_function_call = True
     self.convert_node(node.func)
     self.context.in_function_call = False
@@ -391,19 +786,135 @@ class PythonToMoo:
     self.convert_node(node.value)
     self.context.in_index = False
 
+  @staticmethod
+  def called_verb(func):
+    """The verb name if func is self.<verb>, otherwise None."""
+    import astroid
+    if isinstance(func, astroid.Attribute) and isinstance(func.expr, astroid.Name) and func.expr.name == 'self':
+      return func.attrname
+    return None
+
+  def check_verb_call(self, func):
+    verb = self.called_verb(func)
+    obj = self.context.current_obj
+    if verb is None or obj is None:
+      return
+    if self.index.has_verb(obj, verb) is False:
+      logger.warning("{}:{} calls this:{}, which {} and its parents do not define".format(obj, self.context.verb, verb, obj))
+
   def default_converter(self, node):
     if self.debug:
       pdb.set_trace()
 
+  def write_cached(self, kind, node, emit):
+    """Write the output of emit(node), reusing the cached text when the node's source is unchanged."""
+    if self.cache is None:
+      return emit(node)
+    key = self.cache.key(kind, self.frontend, self.optimize, self.inline_key(), self.suspend, self.context.current_obj,
+      self.node_source(node))
+    cached = self.cache.get(key)
+    if cached is None:
+      output, self.output = self.output, io.StringIO()
+      try:
+        emit(node)
+      finally:
+        cached, self.output = self.output.getvalue(), output
+      self.cache.put(key, cached)
+    self.write(cached)
+
+  def inline_key(self):
+    """What inlining makes a verb's output depend on besides its own source."""
+    if self.inline is None:
+      return None
+    return self.inline, sorted(self.node_source(definition) for candidate, definition in self.context.inline.values())
+
+  @classmethod
+  def file_key(cls, cache, fname, code, index=None, optimize=False, inline=None, suspend=None):
+    return cache.key('file', cls.frontend, optimize, inline, suspend, code, index.file_key(fname) if index is not None else None)
+
+  @classmethod
+  def convert_file(cls, fname, output, debug=False, cache=None, index=None, optimize=False, inline=None, suspend=None):
+    if cache is None:
+      return cls.convert_module(cls.parse(read_source(fname)), output, debug, index=index, optimize=optimize, inline=inline,
+        suspend=suspend)
+    code = read_source(fname)
+    key = cls.file_key(cache, fname, code, index, optimize, inline, suspend)
+    cached = cache.get(key)
+    if cached is None:
+      buffer = io.StringIO()
+      cls.convert_module(cls.parse(code), buffer, debug, cache, index, optimize, inline, suspend)
+      cached = buffer.getvalue()
+      cache.put(key, cached)
+    output.write(cached)
+
   @classmethod
-  def convert_file(cls, fname, output, debug=False):
-    loaded = load_ast(fname)
-    new = cls(output, debug=debug)
-    for node in loaded.body:
-      new.convert_node(node)
+  def convert_module(cls, module, output, debug=False, cache=None, index=None, optimize=False, inline=None, suspend=None):
+    new = cls(output, debug=debug, cache=cache, index=index, optimize=optimize, inline=inline, suspend=suspend)
+    for _ in new.iter_module(module):
+      pass
+
+  @classmethod
+  def iter_file(cls, fname, debug=False, cache=None, index=None, optimize=False, inline=None, suspend=None):
+    """Convert fname, yielding the text of each @create, @verb/@program and @property unit as soon as it is complete."""
+    code = read_source(fname)
+    key = cached = None
+    if cache is not None:
+      key = cls.file_key(cache, fname, code, index, optimize, inline, suspend)
+      cached = cache.get(key)
+    if cached is not None:
+      for unit in split_units(cached):
+        yield unit.text
+      return
+    chunks = Chunks()
+    new = cls(UnitWriter(chunks), debug=debug, cache=cache, index=index, optimize=optimize, inline=inline, suspend=suspend)
+    written = []
+    for _ in new.iter_module(cls.parse(code)):
+      if key is not None:
+        written.extend(chunks)
+      yield from chunks
+      chunks.clear()
+    if key is not None:
+      cache.put(key, "".join(written))
+
+  @classmethod
+  def map_lines(cls, fname, index=None, optimize=False, inline=None, suspend=None):
+    """Convert fname, returning the script and the (script line, source line) pairs that map it back to fname."""
+    output = io.StringIO()
+    new = cls(output, index=index, optimize=optimize, inline=inline, suspend=suspend, line_map=[])
+    for _ in new.iter_module(cls.parse(read_source(fname))):
+      pass
+    return output.getvalue(), new.line_map
+
+  def iter_module(self, module):
+    """Convert module one class member at a time, yielding after each so a UnitWriter's units can be consumed."""
+    for node in module.body:
+      if self.find_converter(type(node)) == self.convert_obj:
+        self.begin_obj(node)
+        yield
+        for subnode in node.body:
+          self.convert_node(subnode)
+          yield
+      else:
+        self.convert_node(node)
+      self.end_unit()
+      yield
+
+  def end_unit(self):
+    end_unit = getattr(self.output, 'end_unit', None)
+    if end_unit is not None:
+      end_unit()
 
   def write(self, string):
-    self.output.write(str(string))
+    if type(string) is not str:
+      string = str(string)
+    self.output.write(string)
+
+  def write_counting(self, string):
+    """write that keeps count of the current script line; used instead of it when line_map is given."""
+    if type(string) is not str:
+      string = str(string)
+    self.lines += string.count("\n")
+    self.output.write(string)
 
   def write_comma_separated(self, node_list):
     for node in node_list[:-1]:
@@ -411,29 +922,170 @@ class PythonToMoo:
       self.write(", ")
     self.convert_node(node_list[-1])
 
+def collect_inputs(specs):
+  """Expand files, directories and glob patterns into a sorted list of Python files."""
+  paths = set()
+  for spec in specs:
+    if os.path.isdir(spec):
+      paths.update(glob.glob(os.path.join(spec, '**', '*.py'), recursive=True))
+    elif glob.has_magic(spec):
+      paths.update(glob.glob(spec, recursive=True))
+    elif os.path.isfile(spec):
+      paths.add(spec)
+    else:
+      raise RuntimeError("Input file {} not found.".format(spec))
+  return sorted(p for p in paths if os.path.isfile(p))
+
+FRONTENDS = ('astroid', 'ast')
+
+def get_frontend(name):
+  """Return the converter class for a frontend: 'astroid', or 'ast' for the faster stdlib parser."""
+  if name == 'ast':
+    from stdlib_frontend import StdlibPythonToMoo
+    return StdlibPythonToMoo
+  if name != 'astroid':
+    raise ValueError("Unknown frontend {!r}".format(name))
+  return PythonToMoo
+
+def convert_to_string(fname, debug=False, cache=None, frontend='astroid', index=None, optimize=False, inline=None, suspend=None):
+  output = io.StringIO()
+  get_frontend(frontend).convert_file(fname, output, debug, cache, index, optimize, inline, suspend)
+  return output.getvalue()
+
+def convert_files(fnames, jobs=None, debug=False, cache=None, frontend='astroid', index=None, optimize=False, inline=None,
+    suspend=None):
+  """Yield (fname, moo_code) pairs in the order of fnames, converting in worker processes."""
+  if debug or jobs == 1 or len(fnames) < 2:
+    for fname in fnames:
+      yield fname, convert_to_string(fname, debug, cache, frontend, index, optimize, inline, suspend)
+    return
+  workers = jobs or os.cpu_count() or 1
+  chunksize = max(1, len(fnames) // (4 * workers))
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    yield from zip(fnames, pool.map(convert_to_string, fnames, repeat(debug), repeat(cache), repeat(frontend), repeat(index),
+      repeat(optimize), repeat(inline), repeat(suspend), chunksize=chunksize))
+
+def stream_files(fnames, jobs=None, debug=False, cache=None, frontend='astroid', index=None, optimize=False, inline=None,
+    suspend=None):
+  """Yield (fname, chunk) pairs in the order of fnames.
+
+  Serial conversion yields each unit as it is converted; worker processes yield one chunk per file.
+  """
+  if debug or jobs == 1 or len(fnames) < 2:
+    converter = get_frontend(frontend)
+    for fname in fnames:
+      for chunk in converter.iter_file(fname, debug, cache, index, optimize, inline, suspend):
+        yield fname, chunk
+    return
+  yield from convert_files(fnames, jobs, debug, cache, frontend, index, optimize, inline, suspend)
+
+def output_path(fname, base, output_dir):
+  relative = os.path.relpath(os.path.splitext(fname)[0] + '.moo', base)
+  return os.path.join(output_dir, relative)
+
+def diff_against_previous(converted, previous, base=None):
+  """Replace each converted script with the commands that changed since the previous build.
+
+  previous is the full output of an earlier run: a single script, or a directory
+  laid out like --output-dir when base is given.
+  """
+  for fname, code in converted:
+    old_path = previous if base is None else output_path(os.path.abspath(fname), base, previous)
+    old = read_source(old_path) if os.path.isfile(old_path) else ""
+    yield fname, diff_scripts(old, code)
+
 def main(args):
-  if os.path.isfile(args.input) == False:
-    raise RuntimeError("Input file {} not found.".format(args.input))
-  OUTPUT = io.StringIO()
   if args.debug:
     logger.setLevel(logging.DEBUG)
   else:
     logger.setLevel(logging.INFO)
-  PythonToMoo.convert_file(args.input, OUTPUT, args.debug)
-  OUTPUT.seek(0)
-  if args.output is None:
+  cache = TranspileCache(args.cache_dir) if args.cache_dir else None
+  suspend = SuspendPolicy(args.suspend, args.suspend_seconds) if args.suspend is not None else None
+  if args.serve or args.watch:
+    from transpile_daemon import Transpiler, serve, watch_inputs
+    transpiler = Transpiler(args.frontend, cache, args.debug, optimize=args.optimize, inline=args.inline, suspend=suspend)
+    if args.serve:
+      if args.input:
+        transpiler.index_inputs(collect_inputs(args.input))
+      return serve(transpiler, sys.stdin, sys.stdout)
+  inputs = collect_inputs(args.input)
+  if not inputs:
+    raise RuntimeError("No Python files found in {}.".format(", ".join(args.input)))
+  if args.watch:
+    # The watcher indexes the inputs itself, again whenever one of them changes.
+    return watch_inputs(args.input, transpiler, sys.stdout, args.output_dir, args.interval)
+  index = ProgramIndex.build(inputs)
+  # Parents are created before their children wherever the files allow it.
+  inputs = index.sort_files(inputs)
+  if args.index is not None:
+    index.save(args.index)
+  base = os.path.commonpath([os.path.dirname(os.path.abspath(i)) for i in inputs])
+  if args.previous is None:
+    converted = stream_files(inputs, args.jobs, args.debug, cache, args.frontend, index, args.optimize, args.inline,
+      suspend)
+  else:
+    converted = convert_files(inputs, args.jobs, args.debug, cache, args.frontend, index, args.optimize, args.inline,
+      suspend)
+  failures = []
+  if args.validate:
+    from moo_validate import validate_files
+    converted = validate_files(converted, failures, args.frontend, index, args.optimize, args.inline, suspend)
+  if args.previous is not None and args.output_dir is not None:
+    converted = diff_against_previous(converted, args.previous, base)
+  elif args.previous is not None:
+    combined = "".join(code for fname, code in converted)
+    # Read the previous script now: -o may name the same file, and opening it truncates it.
+    converted = list(diff_against_previous([(None, combined)], args.previous))
+  if args.output_dir is not None:
+    f = current = None
+    try:
+      for fname, code in converted:
+        if fname != current:
+          if f is not None:
+            f.close()
+          current = fname
+          path = output_path(os.path.abspath(fname), base, args.output_dir)
+          os.makedirs(os.path.dirname(path), exist_ok=True)
+          f = open(path, "w")
+        f.write(code)
+    finally:
+      if f is not None:
+        f.close()
+    logger.info("Wrote {} files to {}".format(len(inputs), args.output_dir))
+  elif args.output is None:
+    for fname, code in converted:
+      sys.stdout.write(code)
+      sys.stdout.flush()
     logger.info("Done")
-    print(OUTPUT.read())
-    return
   else:
     with open(args.output, "w") as f:
-      f.write(OUTPUT.read())
+      for fname, code in converted:
+        f.write(code)
+        f.flush()
     logger.info("Wrote {}".format(args.output))
+  if failures:
+    raise SystemExit("{} verbs do not parse".format(len(failures)))
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser()
-  parser.add_argument("-i", "--input", help="Python file to convert to moo code", action="store", required=True)
-  parser.add_argument("-o", "--output", help="File to write the moo code. If not specified, prints to the console.", action="store")
+  parser.add_argument("-i", "--input", help="Python files, directories or glob patterns to convert to moo code", action="store", nargs="+")
+  parser.add_argument("-o", "--output", help="File to write the combined moo code. If not specified, prints to the console.", action="store")
+  parser.add_argument("--output-dir", help="Directory to write one .moo file per input file, mirroring the input layout.", action="store")
+  parser.add_argument("-j", "--jobs", help="Number of worker processes for batch conversion. Defaults to the CPU count.", action="store", type=int)
+  parser.add_argument("--cache-dir", help="Directory for the incremental transpile cache. Unchanged files and verbs are reused from it.", action="store")
+  parser.add_argument("--previous", help="Full output of a previous build (a file, or a directory with --output-dir). Only the @verb, @program and @property commands that changed are emitted.", action="store")
+  parser.add_argument("--frontend", help="Python parser to use. 'ast' uses the standard library and starts much faster than astroid.", choices=FRONTENDS, default='astroid')
+  parser.add_argument("-O", "--optimize", help="Fold constant expressions and leave out if/while branches that can never run.", action="store_true")
+  parser.add_argument("--inline", help="Replace calls to small pure methods of the same class with their expression. The optional value is the largest expression, in nodes, to inline.", nargs="?", type=int, const=DEFAULT_INLINE_THRESHOLD, metavar="NODES")
+  parser.add_argument("--suspend", help="Make every loop iteration call suspend(0) when fewer than TICKS ticks are left. TICKS defaults to 2000.", nargs="?", type=int, const=SuspendPolicy().ticks, metavar="TICKS")
+  parser.add_argument("--suspend-seconds", help="With --suspend, also suspend when fewer than this many seconds are left.", type=int, default=SuspendPolicy().seconds)
+  parser.add_argument("--validate", help="Parse every emitted verb with moo.lark, report the Python line of each one that does not parse and exit with an error if any do not.", action="store_true")
+  parser.add_argument("--index", help="Write the index of every object, verb and property in the inputs to this JSON file.", action="store")
+  parser.add_argument("--watch", help="Keep running and print the commands that changed each time an input is saved. With --output-dir, also rewrite its .moo file.", action="store_true")
+  parser.add_argument("--interval", help="Seconds between checks for changed inputs in --watch mode.", type=float, default=0.5)
+  parser.add_argument("--serve", help="Answer JSON-lines conversion requests on stdin/stdout; see transpile_daemon. With -i, parents are resolved from an index of those inputs.", action="store_true")
   parser.add_argument("-d", "--debug", help="Enable debug mode", action="store_true")
   args = parser.parse_args()
+  if not args.input and not args.serve:
+    parser.error("the following arguments are required: -i/--input")
   main(args)
@@ -1,13 +1,34 @@
-from pyleri import Choice, Grammar, Keyword, List, Optional, Regex, Prio, Ref, Repeat, Sequence, THIS, Token, Tokens
+from array import array
+import re
+
+from attr import attr, attributes, Factory
+from pyleri import Choice, Grammar, Keyword, List, Optional, Regex, Ref, Repeat, Sequence, Token, Tokens
+from pyleri.node import Node
+
+WHITESPACE = re.compile(r'\s*')
+
+# Characters of lookahead given to the grammar's elements; longer lines are cut short except at string literals.
+LOOKAHEAD = 256
 
 class MooGrammar(Grammar):
+  """MOO verb code.
+
+  Every Choice takes its first match and every alternative can be told apart
+  from the others by its first few tokens, so the parser never re-parses a
+  subexpression more than a constant number of times: expressions are an atom
+  followed by subscripts, property references and verb calls, joined by
+  operators, rather than alternatives that each start by parsing an
+  expression.
+  """
   START = Ref()
+  EXPRESSION = Ref()
   # Types we need regular expressions for
+  r_float = Regex(r'-?([0-9]+\.[0-9]+([eE][+-]?[0-9]+)?|[0-9]+[eE][+-]?[0-9]+)')
   r_int = Regex('-?[0-9]+')
-  r_string = Regex(r'(")(?:(?=(\\?))\2.)*?\1')
-  r_float = Regex(r'-?[0-9]+\.?[0-9]+')
-  r_var = Regex(r'\$?[a-zA-Z_][a-zA-Z0-9_]*')
-  r_objnum = Regex('#[0-9]+')
+  r_string = Regex(r'"(?:[^"\\]|\\.)*"')
+  r_var = Regex(r'\$?(?!(?:if|elseif|else|endif|for|endfor|while|endwhile|fork|endfork|try|except|finally|endtry|return|break|continue|in)\b)[a-zA-Z_][a-zA-Z0-9_]*')
+  r_objnum = Regex('#-?[0-9]+')
+  r_operator = Regex(r'(\|\||&&|==|!=|<=|>=|<|>|\+|-(?!>)|\*|/|%|\^|in\b)')
   # Keywords
   k_if = Keyword('if')
   k_else = Keyword('else')
@@ -36,66 +57,132 @@ class MooGrammar(Grammar):
   t_rbracket = Token(']')
   t_lbrace = Token('{')
   t_rbrace = Token('}')
+  t_comma = Token(',')
+  t_range = Token('..')
   t_dot = Token('.')
   t_question = Token('?')
   t_bar = Token('|')
   t_arrow = Token('->')
+  t_at = Token('@')
+  t_dollar = Token('$')
   t_grave = Token('`')
   t_exclamation = Token('!')
   t_eg = Token('=>')
   t_colon = Token(':')
   t_tick = Token("'")
   t_semi = Token(';')
-  # Forward References
-  FUNCTION_CALL = Ref()
-  PROP_REF = Ref()
-  VERB_CALL = Ref()
-  LIST = Ref()
-  MAP = Ref()
-  SUBSCRIPT = Ref()
-  COMPARISON = Ref()
-  MULTI_COMPARISON = Ref()
-  EXPRESSION = Ref()
-  # Complex types
-  VALUE = Choice(r_int, r_objnum, r_string, r_float, LIST, MAP, VERB_CALL, FUNCTION_CALL, PROP_REF, MULTI_COMPARISON, r_var)
-  LIST = Sequence(t_lbrace, List(VALUE), t_rbrace)
-  MAP_KEY_VAL = Sequence(Choice(r_string, r_int), t_arrow, EXPRESSION)
-  MAP = Sequence(t_lbracket, Optional(List(MAP_KEY_VAL)), t_rbracket)
-  PROP_REF = Sequence(Choice(r_objnum, r_var), t_dot, Choice(r_var, Sequence(t_lparen, EXPRESSION, t_rparen)))
-  OP_TOKENS = Tokens('+ - * /')
-  BIN_OP = List(VALUE, mi=2, delimiter=OP_TOKENS)
-  COMP_TOKENS = Tokens('< > <= >= == !=')
-  COMPARISON = Sequence(t_lparen, List(EXPRESSION, delimiter=COMP_TOKENS), t_rparen)
-  COMP_SEP_TOKENS = Tokens('&& ||')
-  MULTI_COMPARISON = Sequence(List(COMPARISON, mi=1, delimiter=COMP_SEP_TOKENS))
-  ASSIGNMENT = Sequence(Choice(PROP_REF, r_var, SUBSCRIPT), t_equals, EXPRESSION)
-  WHILE_LOOP = Sequence(k_while, t_lparen, MULTI_COMPARISON, t_rparen, Optional(START), Optional(k_break), Optional(k_continue), k_endwhile)
-  FOR_CONDITION = Sequence(Choice(r_var, List(r_var, mi=2)), k_in, t_lparen, EXPRESSION, t_rparen)
-  FOR_LOOP = Sequence(k_for, FOR_CONDITION, Optional(START), Optional(k_break), Optional(k_continue), k_endfor)
-  CONDITIONAL = Sequence(k_if, t_lparen, MULTI_COMPARISON, t_rparen, Optional(START), Optional(Sequence(k_elseif, COMPARISON, Optional(START))), Optional(Sequence(k_else, Optional(START))), k_endif)
-  EXCEPTION_HANDLER = Sequence(k_except, Optional(r_var), t_lparen, r_var, t_rparen, Optional(START))
-  TRY = Sequence(k_try, Optional(START), Optional(List(EXCEPTION_HANDLER)), Optional(Sequence(k_finally, Optional(START))), k_endtry)
-  COMPACT_TRY = Sequence(t_grave, EXPRESSION, t_exclamation, Choice(k_any, EXPRESSION), Optional(Sequence(t_eg, EXPRESSION)), t_tick)
-  FORK = Sequence(k_fork, Optional(r_var), t_lparen, EXPRESSION, t_rparen, Optional(START), k_endfork)
-  EXPRESSION = Choice(ASSIGNMENT,BIN_OP, VALUE, SUBSCRIPT, COMPACT_TRY)
-  CALL_ARGS = List(EXPRESSION)
-  OPTIONAL_ARG = Sequence(t_question, ASSIGNMENT)
-  SCATTER_NAMES = Sequence(t_lbrace, List(Choice(r_var, OPTIONAL_ARG)), t_rbrace)
-  SCATTER_ASSIGNMENT = Sequence(SCATTER_NAMES, t_equals, EXPRESSION);
-  FUNCTION_CALL = Sequence(r_var, t_lparen, Optional(CALL_ARGS), t_rparen)
-  VERB_CALL = Sequence(r_var, t_colon, Choice(r_var, Sequence(t_lparen, r_string, t_rparen)), t_lparen, Optional(CALL_ARGS), t_rparen)
-  SUBSCRIPT = Sequence(Choice(VERB_CALL, FUNCTION_CALL, PROP_REF, VALUE), t_lbracket, Choice(VERB_CALL, FUNCTION_CALL, VALUE), t_rbracket)
-  TERNARY = Sequence(EXPRESSION, t_question, EXPRESSION, t_bar, EXPRESSION)
-  RETURN = Sequence(k_return, EXPRESSION)
-  STATEMENT = Sequence(Optional(Choice(RETURN, ASSIGNMENT, VERB_CALL, FUNCTION_CALL, TERNARY, SCATTER_ASSIGNMENT)), t_semi)
-  START = Repeat(Choice(CONDITIONAL, WHILE_LOOP, FOR_LOOP, TRY, FORK, STATEMENT, Sequence(r_string, t_semi)))
+  UNARY_TOKENS = Tokens('! -')
+  # Expressions
+  PAREN = Sequence(t_lparen, EXPRESSION, t_rparen)
+  SPLICE = Sequence(t_at, EXPRESSION)
+  CALL_ARGS = Sequence(t_lparen, List(Choice(SPLICE, EXPRESSION, most_greedy=False)), t_rparen)
+  OPTIONAL_ARG = Sequence(t_question, r_var, Optional(Sequence(t_equals, EXPRESSION)))
+  # Scatter assignments are parsed as lists assigned to.
+  LIST = Sequence(t_lbrace, List(Choice(SPLICE, OPTIONAL_ARG, EXPRESSION, most_greedy=False)), t_rbrace)
+  MAP_KEY_VAL = Sequence(EXPRESSION, t_arrow, EXPRESSION)
+  MAP = Sequence(t_lbracket, List(MAP_KEY_VAL), t_rbracket)
+  COMPACT_TRY = Sequence(t_grave, EXPRESSION, t_exclamation, Choice(k_any, List(EXPRESSION, mi=1), most_greedy=False), Optional(Sequence(t_eg, EXPRESSION)), t_tick)
+  FUNCTION_CALL = Sequence(r_var, CALL_ARGS)
+  VALUE = Choice(r_float, r_int, r_objnum, r_string, LIST, MAP, PAREN, COMPACT_TRY, FUNCTION_CALL, r_var, t_dollar, most_greedy=False)
+  SUBSCRIPT = Sequence(t_lbracket, EXPRESSION, Optional(Sequence(t_range, EXPRESSION)), t_rbracket)
+  VERB_CALL = Sequence(t_colon, Choice(r_var, PAREN, most_greedy=False), CALL_ARGS)
+  PROP_REF = Sequence(t_dot, Choice(r_var, PAREN, most_greedy=False))
+  POSTFIX = Sequence(VALUE, Repeat(Choice(SUBSCRIPT, VERB_CALL, PROP_REF, most_greedy=False)))
+  UNARY = Sequence(Repeat(UNARY_TOKENS), POSTFIX)
+  BIN_OP = List(UNARY, delimiter=r_operator, mi=1)
+  ASSIGNMENT = Sequence(t_equals, EXPRESSION)
+  TERNARY = Sequence(t_question, EXPRESSION, t_bar, EXPRESSION)
+  EXPRESSION = Sequence(BIN_OP, Optional(Choice(ASSIGNMENT, TERNARY, most_greedy=False)))
+  # Statements
+  RETURN = Sequence(k_return, Optional(EXPRESSION))
+  BREAK = Sequence(k_break, Optional(r_var))
+  CONTINUE = Sequence(k_continue, Optional(r_var))
+  STATEMENT = Sequence(Optional(Choice(RETURN, BREAK, CONTINUE, EXPRESSION, most_greedy=False)), t_semi)
+  CONDITIONAL = Sequence(k_if, PAREN, START, Repeat(Sequence(k_elseif, PAREN, START)), Optional(Sequence(k_else, START)), k_endif)
+  WHILE_LOOP = Sequence(k_while, Optional(r_var), PAREN, START, k_endwhile)
+  FOR_RANGE = Sequence(t_lbracket, EXPRESSION, t_range, EXPRESSION, t_rbracket)
+  FOR_LOOP = Sequence(k_for, r_var, Optional(Sequence(t_comma, r_var)), k_in, Choice(PAREN, FOR_RANGE, most_greedy=False), START, k_endfor)
+  EXCEPTION_HANDLER = Sequence(k_except, Optional(r_var), t_lparen, Choice(k_any, List(EXPRESSION, mi=1), most_greedy=False), t_rparen, START)
+  TRY = Sequence(k_try, START, Repeat(EXCEPTION_HANDLER), Optional(Sequence(k_finally, START)), k_endtry)
+  FORK = Sequence(k_fork, Optional(r_var), PAREN, START, k_endfork)
+  START = Repeat(Choice(CONDITIONAL, WHILE_LOOP, FOR_LOOP, TRY, FORK, STATEMENT, most_greedy=False))
 
+  def _walk(self, element, pos, tree, rule, is_required):
+    # pyleri gives each element the whole rest of the code, copying it at every
+    # step. No MOO token spans lines, so the rest of the line is enough.
+    if self._pos != pos:
+      string = self._string
+      start = WHITESPACE.match(string, pos).end()
+      end = string.find('\n', start)
+      if end == -1:
+        end = self._len_string
+      if end - start > LOOKAHEAD and string[start] != '"':
+        end = start + LOOKAHEAD
+      self._s = string[start:end]
+      self._pos = start
+    node = Node(element, self._string, self._pos)
+    self._expecting.set_mode_required(node.start, is_required)
+    return element._get_node_result(self, tree, rule, self._s, node)
 
 def walk(root):
-  yield root
-  for child in root.children:
-    for node in walk(child):
-      yield node
+  """Yield root and every node below it in preorder, without recursion."""
+  stack = [root]
+  while stack:
+    node = stack.pop()
+    yield node
+    stack.extend(reversed(node.children))
+
+@attributes(slots=True)
+class FlatTree:
+  """A parse tree as parallel arrays indexed by node, in preorder.
+
+  Node i spans source[start[i]:end[i]], is an instance of elements[element[i]]
+  and is a child of node parent[i], or -1 for the root. Substrings are only
+  taken from the source when asked for.
+  """
+  source = attr(repr=False)
+  elements = attr(default=Factory(list))
+  start = attr(default=Factory(lambda: array('i')), repr=False)
+  end = attr(default=Factory(lambda: array('i')), repr=False)
+  element = attr(default=Factory(lambda: array('H')), repr=False)
+  parent = attr(default=Factory(lambda: array('i')), repr=False)
+
+  def __len__(self):
+    return len(self.start)
+
+  def string(self, i):
+    return self.source[self.start[i]:self.end[i]]
+
+  def name(self, i):
+    return element_name(self.elements[self.element[i]])
+
+  def children(self, i):
+    """Yield the indexes of node i's children by scanning its subtree, which follows it."""
+    parent = self.parent
+    for j in range(i + 1, len(parent)):
+      if parent[j] < i:
+        break
+      if parent[j] == i:
+        yield j
+
+def flatten(root, source):
+  """Return the tree under root, parsed from source, as a FlatTree."""
+  tree = FlatTree(source)
+  ids = {}
+  stack = [(root, -1)]
+  while stack:
+    node, parent = stack.pop()
+    element_id = ids.get(node.element)
+    if element_id is None:
+      element_id = ids[node.element] = len(tree.elements)
+      tree.elements.append(node.element)
+    index = len(tree.start)
+    tree.start.append(node.start)
+    tree.end.append(node.end)
+    tree.element.append(element_id)
+    tree.parent.append(parent)
+    stack.extend((child, index) for child in reversed(node.children))
+  return tree
 
 def node_props(node, children):
   return {
@@ -107,9 +194,16 @@ def node_props(node, children):
     'children': children}
 
 
-# Recursive method to get the children of a node object:
 def get_children(children):
-  return [node_props(c, get_children(c.children)) for c in children]
+  """Return the properties of children and everything below them as nested dicts, without recursion."""
+  result = []
+  stack = [(child, result) for child in reversed(children)]
+  while stack:
+    node, siblings = stack.pop()
+    props = node_props(node, [])
+    siblings.append(props)
+    stack.extend((child, props['children']) for child in reversed(node.children))
+  return result
 
 
 # View the parse tree:
@@ -118,9 +212,12 @@ def view_parse_tree(res):
   return node_props(start, get_children(start.children))
 
 def name_or_class(node):
-  if hasattr(node.element, 'name'):
-    return node.element.name
-  return node.element.__class__.__name__
+  return element_name(node.element)
+
+def element_name(element):
+  if hasattr(element, 'name'):
+    return element.name
+  return element.__class__.__name__
 
 def error_line(text, position):
   prev_linebreak = text.rfind("\n", 0, position)
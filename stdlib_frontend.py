@@ -0,0 +1,210 @@
+"""A PythonToMoo frontend built on the standard library ast module.
+
+The converter only needs the syntax tree, so this avoids importing astroid and
+building its inference-capable trees. Converters are shared with PythonToMoo;
+the ones overridden here only differ in how ast names its fields.
+"""
+import ast
+
+from constant_folding import NotConstant, constant, fold_binary, fold_bool, fold_compare
+from mooingsnake import PythonToMoo
+
+OPERATORS = {
+  ast.Add: '+',
+  ast.Sub: '-',
+  ast.Mult: '*',
+  ast.Div: '/',
+  ast.FloorDiv: '//',
+  ast.Mod: '%',
+  ast.Pow: '**',
+  ast.LShift: '<<',
+  ast.RShift: '>>',
+  ast.BitOr: '|',
+  ast.BitXor: '^',
+  ast.BitAnd: '&',
+  ast.MatMult: '@',
+  ast.And: 'and',
+  ast.Or: 'or',
+  ast.Not: 'not',
+  ast.Eq: '==',
+  ast.NotEq: '!=',
+  ast.Lt: '<',
+  ast.LtE: '<=',
+  ast.Gt: '>',
+  ast.GtE: '>=',
+  ast.Is: 'is',
+  ast.IsNot: 'is not',
+  ast.In: 'in',
+  ast.NotIn: 'not in',
+}
+
+class StdlibPythonToMoo(PythonToMoo):
+  frontend = 'ast'
+
+  def register_converters(self):
+    return {
+      ast.ClassDef: self.convert_obj,
+      ast.FunctionDef: self.convert_verb,
+      ast.AsyncFunctionDef: self.convert_verb,
+      ast.While: self.convert_while,
+      ast.If: self.convert_if,
+      ast.For: self.convert_for,
+      ast.AsyncFor: self.convert_for,
+      ast.Break: self.convert_break,
+      ast.Continue: self.convert_continue,
+      ast.Constant: self.convert_const,
+      ast.Compare: self.convert_comparison,
+      ast.Slice: self.convert_slice,
+      ast.Name: self.convert_name,
+      ast.Raise: self.convert_raise,
+      ast.Assign: self.convert_assign,
+      ast.arg: self.convert_arg,
+      ast.AugAssign: self.convert_aug_assign,
+      ast.Expr: self.convert_expr,
+      ast.BinOp: self.convert_bin_op,
+      ast.List: self.convert_list,
+      ast.Tuple: self.convert_list,
+      ast.Dict: self.convert_dict,
+      ast.Subscript: self.convert_subscript,
+      ast.BoolOp: self.convert_multi_comparison,
+      ast.Return: self.convert_return,
+      ast.Attribute: self.convert_attribute,
+      ast.arguments: self.convert_args,
+      ast.Call: self.convert_call,
+    }
+
+  @staticmethod
+  def parse(code):
+    module = ast.parse(code)
+    # astroid keeps docstrings out of the body, so leave them out here too.
+    for node in ast.walk(module):
+      if isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)) and ast.get_docstring(node, clean=False) is not None:
+        node.body = node.body[1:]
+    return module
+
+  @staticmethod
+  def node_source(node):
+    return ast.unparse(node)
+
+  @staticmethod
+  def pytype(node):
+    return 'builtins.' + type(node.value).__name__
+
+  @staticmethod
+  def called_verb(func):
+    if isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name) and func.value.id == 'self':
+      return func.attr
+    return None
+
+  def fold(self, node):
+    if isinstance(node, ast.Constant):
+      return constant(node.value)
+    if isinstance(node, ast.BinOp):
+      return fold_binary(OPERATORS[type(node.op)], self.fold(node.left), self.fold(node.right))
+    if isinstance(node, ast.Compare):
+      value = self.fold(node.left)
+      for op, operand in zip(node.ops, node.comparators):
+        value = fold_compare(OPERATORS[type(op)], value, self.fold(operand))
+      return value
+    if isinstance(node, ast.BoolOp):
+      return fold_bool(OPERATORS[type(node.op)], node.values, self.fold)
+    raise NotConstant()
+
+  @staticmethod
+  def call_parts(node):
+    if not isinstance(node, ast.Call) or not isinstance(node.func, ast.Name) or node.keywords:
+      return None
+    if any(isinstance(arg, ast.Starred) for arg in node.args):
+      return None
+    return node.func.id, node.args
+
+  @staticmethod
+  def target_names(node):
+    if isinstance(node, ast.Name):
+      return [node.id]
+    if isinstance(node, ast.Tuple) and all(isinstance(elt, ast.Name) for elt in node.elts):
+      return [elt.id for elt in node.elts]
+    return None
+
+  @classmethod
+  def is_pure(cls, node):
+    if isinstance(node, (ast.Name, ast.Constant)):
+      return True
+    return isinstance(node, ast.Attribute) and cls.is_pure(node.value)
+
+  def convert_name(self, node):
+    if self.write_binding(node.id):
+      return
+    # Assignment targets keep their names, like astroid's AssignName.
+    if isinstance(node.ctx, ast.Store):
+      self.write(node.id)
+    else:
+      self.write(self.transform_name(node.id))
+
+  def convert_arg(self, node):
+    self.write(node.arg)
+
+  def convert_comparison(self, node):
+    if self.write_folded(node):
+      return
+    self.convert_node(node.left)
+    for op, subop in zip(node.ops, node.comparators):
+      self.write(self.convert_comp_op(OPERATORS[type(op)]))
+      self.convert_node(subop)
+
+  def convert_aug_assign(self, node):
+    if self.is_noop_update(OPERATORS[type(node.op)], node.value):
+      return
+    self.convert_node(node.target)
+    self.write(" = ")
+    self.convert_node(node.target)
+    self.write(" ")
+    self.write_op(node.op)
+    self.write(" ")
+    self.convert_node(node.value)
+    self.write(";\n")
+
+  def write_op(self, op):
+    super().write_op(OPERATORS[type(op)])
+
+  def convert_dict(self, node):
+    if not node.keys:
+      self.write("[]")
+      return
+    self.write("[")
+    for n, (key, value) in enumerate(zip(node.keys, node.values)):
+      if n:
+        self.write(", ")
+      self.convert_node(key)
+      self.write(" -> ")
+      self.convert_node(value)
+    self.write("]")
+
+  def convert_attribute(self, node):
+    self.convert_node(node.value)
+    if self.context.in_function_call:
+      self.write(":")
+    else:
+      self.write(".")
+    self.write(node.attr)
+
+  def convert_args(self, node):
+    arguments = node.posonlyargs + node.args
+    positional = [i.arg for i in arguments[:len(arguments) - len(node.defaults)]]
+    if positional and positional[0] == 'self':
+      positional = positional[1:]
+    defaults = list(zip(arguments[len(arguments) - len(node.defaults):], node.defaults))
+    if not positional and not defaults:
+      return
+    self.write("{")
+    self.write(", ".join(positional))
+    if positional and defaults:
+      self.write(", ")
+    for n, (arg, value) in enumerate(defaults):
+      if n:
+        self.write(", ")
+      self.write("?")
+      self.convert_node(arg)
+      self.write("=")
+      self.convert_node(value)
+    self.write("} = args;\n")
@@ -0,0 +1,102 @@
+import lark
+
+import moo_ast
+import moo_parser
+
+def test_parse_builds_verb():
+  verb = moo_ast.parse('x = 1; return x;')
+  assert verb == moo_ast.Verb(body=[
+    moo_ast.Assign(lhs=moo_ast.Variable(name='x'), rhs=moo_ast.Int(1)),
+    moo_ast.Return(moo_ast.Variable(name='x')),
+  ])
+
+def test_parse_many_yields_errors_in_place():
+  results = list(moo_ast.parse_many(['x = 1;', 'x = ;', 'return 2;']))
+  assert isinstance(results[0], moo_ast.Verb)
+  assert isinstance(results[1], lark.exceptions.LarkError)
+  assert results[2] == moo_ast.Verb(body=[moo_ast.Return(moo_ast.Int(2))])
+
+def test_parser_is_built_once():
+  assert moo_parser.parser is moo_parser.get_parser()
+
+def test_grammar_tables_are_cached(tmp_path):
+  cache = tmp_path / 'moo.lark.cache'
+  moo_parser.build_parser(cache=str(cache))
+  assert cache.exists()
+  assert moo_parser.build_parser(cache=str(cache)).parse('return 1;')
+
+def test_every_grammar_rule_builds_nodes():
+  verb = moo_ast.parse("""
+  {a, ?b = 3} = args;
+  m = [1 -> "x"];
+  if (a && !b)
+    this.("p") = x[2..3];
+  else
+    y = a ? `x[1] ! ANY => 0' | #1;
+  endif
+  for i in [1..10]
+    break;
+  endfor
+  while lab (1)
+    continue lab;
+  endwhile
+  try
+    return 1.5;
+  except err (e)
+    return;
+  endtry
+  """)
+  kinds = [type(statement) for statement in verb.body]
+  assert kinds == [moo_ast.ScatterAssign, moo_ast.Assign, moo_ast.If, moo_ast.ForRange, moo_ast.While, moo_ast.Try]
+  assert verb.body[0].lhs[1] == moo_ast.ScatterTarget('b', 'optional', moo_ast.Int(3))
+  assert verb.body[2].orelse[0].rhs.if_true == moo_ast.CompactTry(
+    moo_ast.Subscript(moo_ast.Variable('x'), moo_ast.Int(1)), None, moo_ast.Int(0))
+
+def test_deep_nesting_does_not_recurse():
+  depth = 5000
+  source = "return " + "(" * depth + "1" + ")" * depth + ";"
+  assert moo_ast.parse(source) == moo_ast.Verb(body=[moo_ast.Return(moo_ast.Int(1))])
+  assert moo_ast.build_ast(moo_parser.parser.parse(source)) == moo_ast.parse(source)
+
+def test_operator_precedence_and_associativity():
+  a, b, c = (moo_ast.Variable(name) for name in 'abc')
+  def expression(source):
+    return moo_ast.parse("return %s;" % source).body[0].value
+  assert expression("a * b + c") == moo_ast.BinaryOp(moo_ast.BinaryOp(a, '*', b), '+', c)
+  assert expression("a + b * c") == moo_ast.BinaryOp(a, '+', moo_ast.BinaryOp(b, '*', c))
+  assert expression("a - b - c") == moo_ast.BinaryOp(moo_ast.BinaryOp(a, '-', b), '-', c)
+  assert expression("a ^ b ^ c") == moo_ast.BinaryOp(a, '^', moo_ast.BinaryOp(b, '^', c))
+  assert expression("a == 1 && b") == moo_ast.LogicalOp(moo_ast.Comparison(a, '==', moo_ast.Int(1)), '&&', b)
+  assert expression("a || b && c") == moo_ast.LogicalOp(moo_ast.LogicalOp(a, '||', b), '&&', c)
+  assert expression("a + 1 < b * 2") == moo_ast.Comparison(
+    moo_ast.BinaryOp(a, '+', moo_ast.Int(1)), '<', moo_ast.BinaryOp(b, '*', moo_ast.Int(2)))
+  assert expression("!a + b") == moo_ast.BinaryOp(moo_ast.Not(a), '+', b)
+  assert expression("a ? b | c + 1") == moo_ast.Ternary(a, b, moo_ast.BinaryOp(c, '+', moo_ast.Int(1)))
+  assert expression("a = b = c") == moo_ast.Assign(a, moo_ast.Assign(b, c))
+  assert expression("a = b || c") == moo_ast.Assign(a, moo_ast.LogicalOp(b, '||', c))
+  assert expression("-a ^ 2") == moo_ast.BinaryOp(moo_ast.UnaryMinus(a), '^', moo_ast.Int(2))
+  assert expression("a - -1") == moo_ast.BinaryOp(a, '-', moo_ast.Int(-1))
+  assert expression("a in b.c.d") == moo_ast.Comparison(
+    a, 'in', moo_ast.PropRef(moo_ast.PropRef(b, moo_ast.String('c')), moo_ast.String('d')))
+
+def test_moo_statements():
+  a, b, e = (moo_ast.Variable(name) for name in 'abe')
+  verb = moo_ast.parse("""
+  {a, @b} = {@b, a};
+  a.(b) = a:(b)(@b);
+  fork t (1)
+    return;
+  endfork
+  try
+  except e (E_DIV, E_RANGE)
+  except (ANY)
+  endtry
+  """)
+  assert verb.body[0] == moo_ast.ScatterAssign([moo_ast.ScatterTarget('a'), moo_ast.ScatterTarget('b', 'rest')],
+    moo_ast.List((moo_ast.Splice(b), a)))
+  assert verb.body[1] == moo_ast.Assign(moo_ast.PropRef(a, b), moo_ast.VerbCall(a, b, (moo_ast.Splice(b),)))
+  assert verb.body[2] == moo_ast.Fork(moo_ast.Int(1), [moo_ast.Return()], 't')
+  assert verb.body[3].excepts == [
+    moo_ast.Except(moo_ast.List((moo_ast.Variable('E_DIV'), moo_ast.Variable('E_RANGE'))), 'e', []),
+    moo_ast.Except(None, None, []),
+  ]
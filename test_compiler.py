@@ -0,0 +1,214 @@
+import pytest
+
+import moo_ast
+import moo_closures
+from moo_compiler import compile_verb
+from moo_opcodes import opcodes
+from moo_runtime import Error, Frame, World
+from moo_vm import VM, ExecutionResult, disassemble
+
+x = moo_ast.Variable(name='x')
+
+# x = 2 * 3; if (1 == 1) y = x; endif if (x > 5) return x + 1; endif return 0;
+verb = moo_ast.Verb(body=[
+  moo_ast.Assign(lhs=x, rhs=moo_ast.BinaryOp(lhs=moo_ast.Int(2), operator='*', rhs=moo_ast.Int(3))),
+  moo_ast.If(condition=moo_ast.Comparison(moo_ast.Int(1), '==', moo_ast.Int(1)), body=[
+    moo_ast.Assign(lhs=moo_ast.Variable(name='y'), rhs=x),
+  ]),
+  moo_ast.If(condition=moo_ast.Comparison(x, '>', moo_ast.Int(5)), body=[
+    moo_ast.Return(moo_ast.BinaryOp(lhs=x, operator='+', rhs=moo_ast.Int(1))),
+  ]),
+  moo_ast.Return(moo_ast.Int(0)),
+])
+
+def run(program, **kwargs):
+  vm = VM(**kwargs)
+  assert vm.run_program(program) is ExecutionResult.RETURN
+  return vm
+
+def test_optimized_and_plain_code_agree():
+  plain = run(compile_verb(verb, optimize=False))
+  optimized = run(compile_verb(verb))
+  assert plain.return_value == optimized.return_value == 7
+  assert optimized.ticks < plain.ticks
+
+def test_constant_folding_and_dead_code():
+  ops = [op for pc, op, operands in disassemble(compile_verb(verb).code)]
+  assert opcodes.MULT not in ops
+  assert opcodes.EQ not in ops
+  assert ops.count(opcodes.IF) == 1
+  assert opcodes.DONE not in ops
+
+def test_errors_are_not_folded():
+  division = moo_ast.Verb(body=[moo_ast.Return(moo_ast.BinaryOp(lhs=moo_ast.Int(1), operator='/', rhs=moo_ast.Int(0)))])
+  vm = VM()
+  assert vm.run_program(compile_verb(division)) is ExecutionResult.RAISE
+
+def test_verb_and_function_calls():
+  world = World()
+  thing = world.create()
+  world.add_verb(thing, "double", lambda vm, this, args: args[0] * 2)
+  call = moo_ast.Verb(body=[moo_ast.Return(moo_ast.FunctionCall(
+    function='tostr',
+    args=(moo_ast.VerbCall(obj=moo_ast.Variable(name='this'), verb=moo_ast.String('double'), args=(moo_ast.Int(21),)),)))])
+  vm = VM(world=world)
+  vm.run_program(compile_verb(call), Frame(this=thing))
+  assert vm.return_value == "42"
+
+def test_elseif_and_else():
+  source = """
+  if (x == 1)
+    return "one";
+  elseif (x == 2)
+    return "two";
+  else
+    return "many";
+  endif
+  """
+  for value, expected in [(1, "one"), (2, "two"), (3, "many")]:
+    vm = run(compile_verb(moo_ast.parse("x = %d;" % value + source), optimize=False))
+    assert vm.return_value == expected
+
+@pytest.mark.parametrize('source, expected', [
+  ("return 2 * 3 + 4;", 10),
+  ("return 4 + 2 * 3;", 10),
+  ("return 10 - 2 - 3;", 5),
+  ("return 100 / 10 / 5;", 2),
+  ("return 2 ^ 3 ^ 2;", 512),
+  ("return 7 % 4 * 2;", 6),
+  ("x = 2; return x == 1 && 2;", 0),
+  ("return 1 + 2 == 3;", 1),
+  ("x = y = 4; return x + y;", 8),
+])
+def test_precedence_and_associativity(source, expected):
+  for compile in (compile_verb, moo_closures.compile_verb):
+    engine = VM() if compile is compile_verb else moo_closures.ClosureEngine()
+    assert engine.run_program(compile(moo_ast.parse(source))) is ExecutionResult.RETURN
+    assert engine.return_value == expected
+
+@pytest.mark.parametrize('expression', [
+  moo_ast.BinaryOp(lhs=moo_ast.Float(2.0), operator='^', rhs=moo_ast.Int(10000)),
+  moo_ast.BinaryOp(lhs=moo_ast.Int(10), operator='^', rhs=moo_ast.Int(10000000)),
+  moo_ast.BinaryOp(lhs=moo_ast.BinaryOp(lhs=moo_ast.Int(2), operator='^', rhs=moo_ast.Int(62)), operator='*', rhs=moo_ast.Int(4)),
+  moo_ast.UnaryMinus(moo_ast.BinaryOp(lhs=moo_ast.Int(2), operator='^', rhs=moo_ast.Int(63))),
+])
+def test_overflow_is_not_folded(expression):
+  program = compile_verb(moo_ast.Verb(body=[moo_ast.Return(expression)]))
+  assert any(op is not opcodes.IMM for pc, op, operands in disassemble(program.code) if op is not opcodes.RETURN)
+
+SOURCES = [
+  ("{a, ?b = a + 1, ?c = b * 2} = {5}; return {a, b, c};", (5, 6, 12)),
+  ("{a, ?b = a + 1, ?c = b * 2} = {5, 1}; return {a, b, c};", (5, 1, 2)),
+  ("{a, b} = {1, 2, 3};", Error.E_ARGS),
+  ("x = 0; return x ? \"yes\" | \"no\";", "no"),
+  ("""
+  found = {};
+  for i in [1..5]
+    if (i == 2)
+      continue;
+    endif
+    j = 0;
+    while outer (1)
+      j = j + 1;
+      if (j > 2)
+        break outer;
+      elseif (i == 4)
+        break i;
+      endif
+    endwhile
+    found = listappend(found, {i, j});
+  endfor
+  return found;
+  """, ((1, 3), (3, 3))),
+  ("""
+  s = 0;
+  for x in ({1, 2, 3, 4})
+    try
+      if (x == 3)
+        break;
+      endif
+      s = s + 10 / (x - 2);
+    except e (E_DIV)
+      s = s + 100;
+      continue;
+    endtry
+    s = s + 1;
+  endfor
+  return s;
+  """, -10 + 1 + 100),
+  ("""
+  try
+    x = 1 / 0;
+  except e (E_DIV)
+    return {e[1], `{}[1] ! E_RANGE', `undefined ! ANY => "default"', `1 + 1 ! ANY'};
+  endtry
+  """, (Error.E_DIV, Error.E_RANGE, "default", 2)),
+  ("{a, ?b = -1, @rest} = {@{1, 2, 3}, -4}; return {@rest, -b, a in rest, -(a + 1)};", (3, -4, -2, 0, -2)),
+  ("{a, @rest} = {1}; return {rest, {@rest}, `{@a} ! E_TYPE'};", ((), (), Error.E_TYPE)),
+  ("{a, b, @rest} = {1}; return 0;", Error.E_ARGS),
+  ("return -\"x\";", Error.E_TYPE),
+  ("l = {1, {2, 3}, \"abc\"}; l[2][1] = 5; x = l[3][2] = \"z\"; l[1..1] = {}; return {l, x};", (((5, 3), "azc"), "z")),
+  ("m = [\"a\" -> {1}]; m[\"a\"][1] = 2; m[\"b\"] = 3; s = \"abc\"; s[2..3] = \"x\"; return {m, s};",
+    ({"a": (2,), "b": 3}, "ax")),
+  ("l = {1, 2}; l[1..2][1] = 3; return l;", NotImplementedError),
+  ("l = {}; l[\"a\"..\"b\"] = {}; return l;", Error.E_TYPE),
+  ("r = {}; for v, i in ({\"a\", \"b\"}) r = listappend(r, {i, v}); endfor for v, k in ([\"x\" -> 1]) r = listappend(r, {k, v}); endfor return r;",
+    ((1, "a"), (2, "b"), ("x", 1))),
+  ("try return {}[1]; except (E_DIV) return 0; except e (E_RANGE) return e[1]; endtry", Error.E_RANGE),
+  ("try return 1 / 0; except (E_TYPE) return 0; endtry", Error.E_DIV),
+]
+
+@pytest.mark.parametrize('optimize', [True, False])
+@pytest.mark.parametrize('source, expected', SOURCES)
+def test_parsed_verbs_match_closure_engine(source, expected, optimize):
+  verb = moo_ast.parse(source)
+  if expected is NotImplementedError:
+    for compile in (lambda verb: compile_verb(verb, optimize=optimize), moo_closures.compile_verb):
+      with pytest.raises(NotImplementedError):
+        compile(verb)
+    return
+  results = []
+  for engine, program in ((VM(), compile_verb(verb, optimize=optimize)), (moo_closures.ClosureEngine(), moo_closures.compile_verb(verb))):
+    result = engine.run_program(program)
+    results.append(engine.error.error if result is ExecutionResult.RAISE else engine.return_value)
+  assert results == [expected, expected]
+
+def test_errors_unwind_through_verb_calls():
+  world = World()
+  thing = world.create()
+  world.add_verb(thing, "fail", compile_verb(moo_ast.parse("x = {1, 2}; return x[3];")))
+  vm = VM(world=world)
+  assert vm.run_program(compile_verb(moo_ast.parse("for i in [1..2] r = `this:fail() ! E_RANGE => i'; endfor return r;")), Frame(this=thing)) is ExecutionResult.RETURN
+  assert vm.return_value == 2
+  assert vm.stack == []
+
+def test_fork():
+  verb = moo_ast.parse("""
+  for i in [1..2]
+    fork t (2 - i)
+      return {i, t};
+    endfork
+  endfor
+  return t;
+  """)
+  for engine, program in ((VM(), compile_verb(verb)), (moo_closures.ClosureEngine(), moo_closures.compile_verb(verb))):
+    assert engine.run_program(program) is ExecutionResult.RETURN
+    assert engine.return_value == 2
+    results = engine.run_forked()
+    assert [task.task_id for task, result in results] == [2, 1]
+    assert all(result is ExecutionResult.RETURN for task, result in results)
+    assert engine.return_value == (1, 1)
+    assert engine.run_program(moo_closures.compile_verb(moo_ast.parse("fork (-1) endfork")) if type(engine) is not VM
+      else compile_verb(moo_ast.parse("fork (-1) endfork"))) is ExecutionResult.RAISE
+    assert engine.error.error is Error.E_INVARG
+
+def test_system_properties():
+  verb = moo_ast.parse("$counter = $counter + 1; $list[2] = $counter; return {$counter, $list};")
+  for engine, program in ((VM, compile_verb(verb)), (moo_closures.ClosureEngine, moo_closures.compile_verb(verb))):
+    world = World()
+    system = world.create()
+    world.add_property(system, "counter", 1)
+    world.add_property(system, "list", (0, 0))
+    runner = engine(world=world)
+    assert runner.run_program(program) is ExecutionResult.RETURN
+    assert runner.return_value == (2, (0, 2))
@@ -0,0 +1,62 @@
+import pytest
+
+from constant_folding import NotConstant, fold_binary, fold_compare
+from mooingsnake import convert_to_string
+
+SOURCE = '''
+class Counter(object):
+  def tick(self, n):
+    n += 0
+    n *= 1
+    n **= 1
+    n -= 2
+    n **= 2
+    limit = 60 * 60 * 24
+    big = 2 ** 62 + 10 ** 100
+    label = "a" + "b"
+    if 1 > 2:
+      n = 0
+    elif "Hi" == "hi" and 2 >= 1:
+      n = limit
+    else:
+      n = 1
+    while 0:
+      n = 2
+    return n + 1 * 2
+'''
+
+EXPECTED = """@create #1 named Counter
+@verb Counter:tick tnt RXD
+@program Counter:tick
+{n} = args;
+n = n - 2;
+n = n ^ 2;
+limit = 86400;
+big = 4611686018427387904 + 10 ^ 100;
+label = "ab";
+n = limit;
+return n + 2;
+.
+"""
+
+@pytest.mark.parametrize('frontend', ['astroid', 'ast'])
+def test_optimized_output(tmp_path, frontend):
+  source = tmp_path / 'counter.py'
+  source.write_text(SOURCE)
+  assert convert_to_string(str(source), frontend=frontend, optimize=True) == EXPECTED
+  plain = convert_to_string(str(source), frontend=frontend)
+  assert "60 * 60 * 24" in plain and "while (0)" in plain
+
+def test_follows_moo_semantics():
+  assert fold_compare('==', "ABC", "abc") == 1
+  assert fold_compare('==', 1, 1.0) == 0
+  assert fold_compare('is', None, None) == 1
+  assert fold_binary('+', True, 1) == 2
+  assert fold_binary('**', 2, 62) == 2 ** 62
+  assert fold_binary('**', 2.0, -1.0) == 0.5
+  for op, lhs, rhs in [('/', 7, 2), ('%', -7, 2), ('+', 1, 1.0), ('*', "a", 3), ('*', 2 ** 62, 4), ('**', 2, 63),
+      ('**', 10, 10 ** 7), ('**', 2, -1), ('**', 2.0, 10000), ('**', -8.0, 0.5)]:
+    with pytest.raises(NotConstant):
+      fold_binary(op, lhs, rhs)
+  with pytest.raises(NotConstant):
+    fold_compare('<', 1, "a")
@@ -0,0 +1,78 @@
+import pytest
+
+from inlining import find_candidate
+from moo_index import ProgramIndex
+from mooingsnake import FRONTENDS, convert_to_string
+
+SOURCE = '''
+class Calc(object):
+  rate = 2
+
+  def scale(self, x, factor=3):
+    """Scale x."""
+    return x * factor + self.rate
+
+  def size(self, items):
+    return len(items) + 1
+
+  def noisy(self, x):
+    print(x)
+    return x
+
+  def fact(self, n):
+    return self.fact(n - 1)
+
+  def run(self, a, items):
+    total = self.scale(a) + self.scale(a, factor=4)
+    total = self.size(items) + self.scale(self.rate, 2)
+    total = self.scale(a + 1)
+    return self.noisy(total) + self.fact(3)
+'''
+
+def test_find_candidate():
+  assert find_candidate("def f(self, x, y=1):\n  return x + y\n").params == ['x', 'y']
+  assert find_candidate("def f(a, b, c=3):\n  return a + b * c\n").defaults == 1
+  assert find_candidate("def f(self, x):\n  return self.g(x)\n") is None
+  assert find_candidate("def f(self, x):\n  return y\n") is None
+  assert find_candidate("def f(self, x):\n  x = 1\n  return x\n") is None
+  assert find_candidate("def f(self, *x):\n  return 1\n") is None
+  assert find_candidate("def f(self, x):\n  return x + x + x + x\n", threshold=5) is None
+
+@pytest.mark.parametrize('frontend', FRONTENDS)
+def test_calls_are_inlined(tmp_path, frontend):
+  source = tmp_path / 'calc.py'
+  source.write_text(SOURCE)
+  plain = convert_to_string(str(source), frontend=frontend)
+  assert "total = this:scale(a) + this:scale(a, 4);" in plain
+  run = convert_to_string(str(source), frontend=frontend, inline=12).split("@program Calc:run\n")[1]
+  assert run == """{a, items} = args;
+total = (a * 3 + this.rate) + (a * 4 + this.rate);
+total = (length(items) + 1) + (this.rate * 2 + this.rate);
+total = this:scale(a + 1);
+return this:noisy(total) + this:fact(3);
+.
+"""
+  # The methods are still there for other objects to call.
+  assert "@program Calc:scale\n" in convert_to_string(str(source), frontend=frontend, inline=12)
+
+OVERRIDDEN = """
+class Base(object):
+  def size(self):
+    return 1
+
+  def total(self):
+    return self.size() + 1
+
+class Child(Base):
+  def size(self):
+    return 5
+"""
+
+@pytest.mark.parametrize('frontend', FRONTENDS)
+def test_overridden_methods_are_not_inlined(tmp_path, frontend):
+  source = tmp_path / 'base.py'
+  source.write_text(OVERRIDDEN)
+  index = ProgramIndex.build([str(source)])
+  assert index.overridden('Base') == {'size'}
+  script = convert_to_string(str(source), frontend=frontend, index=index, inline=12)
+  assert "@program Base:total\nreturn this:size() + 1;\n.\n" in script
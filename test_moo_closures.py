@@ -0,0 +1,147 @@
+import pytest
+
+import moo_ast
+import moo_compiler
+from moo_closures import ClosureEngine, compile_verb
+from moo_runtime import Error, Frame, MooError, World
+from moo_vm import VM, ExecutionResult
+
+def run(source, engine=None, frame=None):
+  engine = engine or ClosureEngine()
+  result = engine.run_program(compile_verb(moo_ast.parse(source)), frame)
+  return result, engine.return_value
+
+SHARED = [
+  "x = 0; while (x < 10) x = x + 3; endwhile return x;",
+  "s = 0; for i in [1..5] s = s + i * i; endfor return s;",
+  "s = {}; for x in ({3, 1, 2}) s = listappend(s, x); endfor return s;",
+  "x = 5; if (x > 3 && x < 10) return \"mid\"; elseif (x > 10) return \"big\"; endif return \"small\";",
+  "return !0 || 7;",
+  "l = {1, 2, 3}; return {l[2], l[2..3], \"hello\"[1..4]};",
+]
+
+@pytest.mark.parametrize('source', SHARED)
+def test_engines_agree(source):
+  verb = moo_ast.parse(source)
+  vm = VM()
+  assert vm.run_program(moo_compiler.compile_verb(verb)) is ExecutionResult.RETURN
+  engine = ClosureEngine()
+  assert engine.run_program(compile_verb(verb)) is ExecutionResult.RETURN
+  assert engine.return_value == vm.return_value
+
+def test_labelled_break_and_continue():
+  source = """
+  found = {};
+  for i in [1..5]
+    if (i == 2)
+      continue;
+    endif
+    j = 0;
+    while outer (1)
+      j = j + 1;
+      if (j > 2)
+        break outer;
+      elseif (i == 4)
+        break i;
+      endif
+    endwhile
+    found = listappend(found, {i, j});
+  endfor
+  return found;
+  """
+  assert run(source) == (ExecutionResult.RETURN, ((1, 3), (3, 3)))
+
+def test_try_and_compact_try():
+  source = """
+  try
+    x = 1 / 0;
+  except e (E_DIV)
+    return {e[1], `{}[1] ! E_RANGE', `undefined ! ANY => "default"'};
+  endtry
+  """
+  assert run(source) == (ExecutionResult.RETURN, (Error.E_DIV, Error.E_RANGE, "default"))
+
+def test_uncaught_errors_raise():
+  result, value = run("try return 1 / 0; except (E_TYPE) return 0; endtry")
+  assert result is ExecutionResult.RAISE
+
+def test_assignment_targets():
+  world = World()
+  thing = world.create()
+  world.add_property(thing, "items", (1, (2, 3)))
+  source = """
+  {a, ?b = 5, c} = {1, 2};
+  l = {1, {2, 3}};
+  l[2][1] = a + c;
+  this.items[1] = "x";
+  return {a, b, c, l, this.items};
+  """
+  result, value = run(source, ClosureEngine(world=world), Frame(this=thing))
+  assert value == (1, 5, 2, (1, (3, 3)), ("x", (2, 3)))
+
+def test_verb_calls_share_the_world():
+  world = World()
+  thing = world.create()
+  world.add_verb(thing, "fact", compile_verb(moo_ast.parse(
+    "if (args[1] <= 1) return 1; endif return args[1] * this:fact(args[1] - 1);")))
+  world.add_verb(thing, "native", lambda engine, this, args: len(args))
+  result, value = run("return {this:fact(10), this:native(1, 2)};", ClosureEngine(world=world), Frame(this=thing))
+  assert value == (3628800, 2)
+
+def test_recursion_and_ticks_are_limited():
+  world = World()
+  thing = world.create()
+  world.add_verb(thing, "loop", compile_verb(moo_ast.parse("return this:loop();")))
+  engine = ClosureEngine(world=world)
+  assert run("return this:loop();", engine, Frame(this=thing))[0] is ExecutionResult.RAISE
+  assert engine.error.error is Error.E_MAXREC
+  assert run("while (1) endwhile", ClosureEngine(max_ticks=100))[0] is ExecutionResult.KILL
+
+def test_evaluate():
+  assert moo_ast.Int(3).evaluate() == 3
+  assert moo_ast.parse("return {1, 2 + 3};").body[0].value.evaluate() == (1, 5)
+  with pytest.raises(MooError):
+    moo_ast.parse("return x;").body[0].value.evaluate()
+
+@pytest.mark.parametrize('source, error', [
+  ("return length();", Error.E_ARGS),
+  ("return length({}, 2);", Error.E_ARGS),
+  ("return listinsert({});", Error.E_ARGS),
+  ("return abs(\"x\");", Error.E_TYPE),
+  ("return undefined_builtin();", Error.E_VERBNF),
+])
+def test_builtin_errors(source, error):
+  verb = moo_ast.parse(source)
+  for engine, program in ((VM(), moo_compiler.compile_verb(verb)), (ClosureEngine(), compile_verb(verb))):
+    assert engine.run_program(program) is ExecutionResult.RAISE
+    assert engine.error.error is error
+
+def test_engine_builtins():
+  result, value = run("return {ticks_left() > 0, suspend(), valid(#-1), listinsert({2}, 1)};")
+  assert value == (1, 0, 0, (1, 2))
+
+def test_side_effects_happen_in_the_same_order_as_the_vm():
+  source = "return {[1 -> this:log(1), 2 -> {this:log(2), this:log(3)}], this.log[this:log(1)..this:log(2)]};"
+  logs = []
+  for engine, compile in ((VM, moo_compiler.compile_verb), (ClosureEngine, compile_verb)):
+    world = World()
+    thing = world.create()
+    world.add_property(thing, "log", ())
+    def log(engine, this, args):
+      world.put_prop(this, "log", world.get_prop(this, "log") + args)
+      return args[0]
+    world.add_verb(thing, "log", log)
+    runner = engine(world=world)
+    assert runner.run_program(compile(moo_ast.parse(source)), Frame(this=thing)) is ExecutionResult.RETURN
+    logs.append(world.get_prop(thing, "log"))
+  assert logs[0] == logs[1] == (1, 2, 3, 1, 2)
+
+def test_ticks_are_charged_per_statement():
+  verb = moo_ast.parse("s = 0; for i in [1..10] s = s + i * 2; endfor return s;")
+  vm = VM()
+  engine = ClosureEngine()
+  vm.run_program(moo_compiler.compile_verb(verb))
+  engine.run_program(compile_verb(verb))
+  # Three statements plus a tick per iteration and per statement in the body.
+  assert engine.ticks == 3 + 10 * 2
+  assert engine.ticks < vm.ticks
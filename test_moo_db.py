@@ -0,0 +1,65 @@
+import pytest
+
+import moo_ast
+from moo_db import DumpFormatError, parse_dump, read_programs
+
+DUMP = """** LambdaMOO Database, Format Version 4 **
+2
+4
+0
+1
+#0
+System Object
+
+24
+-1
+#1
+Root
+.
+#0:0
+return 1;
+.
+#0:1
+x = 1 +;
+.
+#1:0
+.
+#1:1
+for i in [1..3]
+  player:tell(i);
+endfor
+.
+0 clocks
+0 queued tasks
+"""
+
+@pytest.fixture
+def dump(tmp_path):
+  (tmp_path / 'test.db').write_text(DUMP)
+  return str(tmp_path / 'test.db')
+
+def test_read_programs_finds_every_program(dump):
+  with open(dump) as f:
+    programs = list(read_programs(f))
+  assert [(p.obj, p.verb) for p in programs] == [(0, 0), (0, 1), (1, 0), (1, 1)]
+  assert programs[0].code == "return 1;\n"
+  assert programs[0].line == 14
+  assert programs[2].code == ""
+
+def test_read_programs_rejects_other_files():
+  with pytest.raises(DumpFormatError):
+    list(read_programs(iter(["hello\n"])))
+
+def test_parse_dump_reports_errors_with_their_verb(dump):
+  results = list(parse_dump(dump, jobs=1, batch_size=3))
+  assert [(r.obj, r.verb) for r in results] == [(0, 0), (0, 1), (1, 0), (1, 1)]
+  assert isinstance(results[0].ast, moo_ast.Verb)
+  assert results[1].ast is None
+  assert results[1].error.line == 1
+  assert results[2].ast == moo_ast.Verb(body=[])
+  assert results[3].error is None
+
+def test_pool_matches_serial(dump):
+  serial = list(parse_dump(dump, jobs=1, batch_size=1))
+  pooled = list(parse_dump(dump, jobs=2, batch_size=1, window=1))
+  assert pooled == serial
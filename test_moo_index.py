@@ -0,0 +1,82 @@
+import logging
+
+import pytest
+
+from moo_index import DuplicateObjectError, ProgramIndex, changed_objects
+from mooingsnake import convert_to_string
+
+BASE = "class Thing(object):\n  weight = 1\n\n  def describe(self):\n    return self.name\n"
+ROOM = "class Room(Thing):\n  exits = []\n\n  def look(self):\n    self.describe()\n    return self.vanish()\n"
+EXTERNAL = "class Gadget(SomethingElse):\n  def use(self):\n    return self.anything()\n"
+
+def write_tree(tmp_path, room=ROOM):
+  files = []
+  for name, source in [('a_base.py', BASE), ('b_room.py', room), ('c_gadget.py', EXTERNAL)]:
+    (tmp_path / name).write_text(source)
+    files.append(str(tmp_path / name))
+  return files
+
+def test_index_records_classes_verbs_and_properties(tmp_path):
+  files = write_tree(tmp_path)
+  index = ProgramIndex.build(files)
+  assert list(index.objects) == ['Thing', 'Room', 'Gadget']
+  room = index.objects['Room']
+  assert (room.file, room.line, room.parents, room.verbs, room.properties) == (files[1], 1, ['Thing'], ['look'], ['exits'])
+  assert index.objects['Thing'].parents == []
+  assert index.parent('Room') == 'Thing'
+  assert index.parent('Gadget') is None
+  assert index.has_verb('Room', 'describe') is True
+  assert index.has_verb('Room', 'vanish') is False
+  assert index.has_verb('Gadget', 'anything') is None
+
+def test_index_round_trips_through_json(tmp_path):
+  index = ProgramIndex.build(write_tree(tmp_path))
+  index.save(str(tmp_path / 'index.json'))
+  assert ProgramIndex.load(str(tmp_path / 'index.json')) == index
+
+def test_changed_objects(tmp_path):
+  old = ProgramIndex.build(write_tree(tmp_path))
+  new = ProgramIndex.build(write_tree(tmp_path, ROOM.replace("exits = []", "exits = [1]"))[:2])
+  assert changed_objects(old, new) == ([], ['Room'], ['Gadget'])
+
+def test_conversion_uses_the_index(tmp_path, caplog):
+  files = write_tree(tmp_path)
+  index = ProgramIndex.build(files)
+  assert convert_to_string(files[1]).startswith("@create #1 named Room\n")
+  with caplog.at_level(logging.WARNING, logger="Transpiler"):
+    for frontend in ('astroid', 'ast'):
+      caplog.clear()
+      assert convert_to_string(files[1], frontend=frontend, index=index).startswith("@create Thing named Room\n")
+      assert [record.getMessage() for record in caplog.records] == [
+        "Room:look calls this:vanish, which Room and its parents do not define"]
+
+def test_duplicate_names_are_rejected(tmp_path):
+  files = write_tree(tmp_path)
+  (tmp_path / 'd_other.py').write_text("class Other(object):\n  pass\n\nclass Room(Other):\n  pass\n")
+  with pytest.raises(DuplicateObjectError, match=r"Room is defined in .*b_room.py:1 and again in .*d_other.py:4"):
+    ProgramIndex.build(files + [str(tmp_path / 'd_other.py')])
+
+def test_files_are_sorted_parents_first(tmp_path):
+  (tmp_path / 'a_child.py').write_text("class Child(Base):\n  pass\n")
+  (tmp_path / 'z_base.py').write_text("class Base(object):\n  pass\n")
+  files = [str(tmp_path / 'a_child.py'), str(tmp_path / 'z_base.py')]
+  index = ProgramIndex.build(files)
+  assert index.sort_files(files) == files[::-1]
+  assert list(index.objects) == ['Base', 'Child']
+  assert "".join(convert_to_string(fname, index=index) for fname in index.sort_files(files)) == (
+    "@create #1 named Base\n@create Base named Child\n")
+
+def test_children_of_later_parents_are_moved_under_them(tmp_path, caplog):
+  (tmp_path / 'a.py').write_text("class Child(Base):\n  pass\n\nclass Other(object):\n  pass\n")
+  (tmp_path / 'b.py').write_text("class Base(object):\n  pass\n\nclass Leaf(Other):\n  pass\n")
+  files = [str(tmp_path / 'a.py'), str(tmp_path / 'b.py')]
+  index = ProgramIndex.build(files)
+  files = index.sort_files(files)
+  assert (index.created_from('Child'), index.created_from('Leaf')) == ('Base', None)
+  assert index.reparented('Other') == ['Leaf']
+  with caplog.at_level(logging.WARNING, logger="Transpiler"):
+    script = "".join(convert_to_string(fname, index=index) for fname in files)
+  assert script == ("@create #1 named Base\n@create #1 named Leaf\n"
+    "@create Base named Child\n@create #1 named Other\n@chparent Leaf to Other\n")
+  assert [record.getMessage() for record in caplog.records] == [
+    "Leaf is created before its parent Other, so it is created from #1 and moved later"]
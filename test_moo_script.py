@@ -0,0 +1,68 @@
+from moo_script import diff_scripts, split_units
+
+old = """\
+@create #1 named Thing
+@property Thing.size
+;Thing.size = 1;
+@property Thing.color
+;Thing.color = "red";
+@verb Thing:a tnt RXD
+@program Thing:a
+return 1;
+.
+@verb Thing:b tnt RXD
+@program Thing:b
+return 2;
+.
+"""
+
+new = """\
+@create #1 named Thing
+@property Thing.size
+;Thing.size = 2;
+@verb Thing:a tnt RXD
+@program Thing:a
+return 1;
+.
+@verb Thing:b tnt RXD
+@program Thing:b
+return 3;
+.
+@verb Thing:c tnt RXD
+@program Thing:c
+return 4;
+.
+"""
+
+def test_split_units():
+  units = split_units(old)
+  assert [unit.key for unit in units] == [
+    ('create', 'Thing'),
+    ('property', 'Thing', 'size'),
+    ('property', 'Thing', 'color'),
+    ('verb', 'Thing', 'a'),
+    ('verb', 'Thing', 'b'),
+  ]
+  assert "".join(unit.text for unit in units) == old
+
+def test_diff_only_emits_changes():
+  assert diff_scripts(old, new) == """\
+;Thing.size = 2;
+@program Thing:b
+return 3;
+.
+@verb Thing:c tnt RXD
+@program Thing:c
+return 4;
+.
+@rmproperty Thing.color
+"""
+
+def test_diff_against_nothing_is_full_script():
+  assert diff_scripts("", new) == new
+
+def test_chparent_units():
+  old_script = "@create #1 named Leaf\n@create #1 named Tree\n@chparent Leaf to Tree\n"
+  assert [unit.key for unit in split_units(old_script)] == [('create', 'Leaf'), ('create', 'Tree'), ('parent', 'Leaf')]
+  assert diff_scripts(old_script, old_script) == ""
+  assert diff_scripts(old_script, old_script.replace("to Tree", "to Bush")) == "@chparent Leaf to Bush\n"
@@ -0,0 +1,155 @@
+import asyncio
+import os
+import re
+
+from moo_script import split_units
+from moo_uploader import assign_connections, count_commands, upload
+from mooingsnake import convert_to_string
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_obj.py')
+
+SCRIPT = """@create #1 named Room
+@verb Room:look tnt RXD
+@program Room:look
+return this.name;
+.
+@property Room.size
+;Room.size = 3;
+@create #1 named Box
+@verb Box:open tnt RXD
+@program Box:open
+return syntax_error;
+.
+@verb Missing:go tnt RXD
+"""
+
+class FakeMoo:
+  """Just enough of a LambdaMOO server to build objects from a script."""
+
+  def __init__(self):
+    self.objects = {}
+    self.owners = {}
+    self.log = []
+
+  async def start(self):
+    self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+    return self.server.sockets[0].getsockname()[1]
+
+  async def handle(self, reader, writer):
+    prefix = suffix = None
+    player = None
+    while line := (await reader.readline()).decode().rstrip("\n"):
+      if line.startswith("connect "):
+        player = line.split()[1]
+        writer.write(b"*** Connected ***\n")
+        continue
+      if line.startswith(("PREFIX ", "SUFFIX ")):
+        if line.startswith("PREFIX "):
+          prefix = line[7:]
+        else:
+          suffix = line[7:]
+        continue
+      if line == "@quit":
+        break
+      body = []
+      if line.startswith("@program"):
+        while (body_line := (await reader.readline()).decode().rstrip("\n")) != ".":
+          body.append(body_line)
+      self.log.append((player, line))
+      output = self.run(player, line, body)
+      writer.write("".join(text + "\n" for text in [prefix] + output + [suffix]).encode())
+      await writer.drain()
+    writer.close()
+
+  def run(self, player, line, body):
+    if match := re.match(r"@create (\S+) named (\w+)", line):
+      parent, name = match[1], match[2]
+      # Only the player who created an object can refer to it by name.
+      if not parent.startswith("#") and self.owners.get(parent) != player:
+        return ['There is no "{}" here.'.format(parent)]
+      self.objects[name] = len(self.objects) + 10
+      self.owners[name] = player
+      return ["You now have {} with object number #{} and parent {}.".format(name, self.objects[name], parent)]
+    if match := re.match(r"@chparent (\w+) to (\w+)", line):
+      if any(self.owners.get(name) != player for name in match.groups()):
+        return ['There is no "{}" here.'.format(match[2])]
+      return ["Parent changed."]
+    match = re.match(r"(@verb|@program|@property|;)\s*(\w+)", line)
+    if not match:
+      return ["I couldn't understand that."]
+    if match[2] not in self.objects:
+      return ['There is no "{}" here.'.format(match[2])]
+    if match[1] == "@program":
+      if any("syntax_error" in text for text in body):
+        return ["Line 1:  syntax error", "1 error.", "Verb not programmed."]
+      return ["0 errors.", "Verb programmed."]
+    return {"@verb": ["Verb added (0)."], "@property": ["Property added with value 0."], ";": ["=> 3"]}[match[1]]
+
+def run_upload(script, logins, window=8):
+  async def go():
+    moo = FakeMoo()
+    port = await moo.start()
+    async with moo.server:
+      acks = await upload(script, '127.0.0.1', port, logins, window=window, timeout=5)
+    return moo, acks
+  return asyncio.run(go())
+
+def test_count_commands():
+  assert [count_commands(unit) for unit in split_units(SCRIPT)] == [1, 2, 2, 1, 2, 1]
+
+def test_assign_connections_keeps_objects_together():
+  lanes = assign_connections(split_units(SCRIPT), 2)
+  assert [[unit.obj for index, unit in lane] for lane in lanes] == [
+    ['Room', 'Room', 'Room', 'Missing'], ['Box', 'Box']]
+
+def test_upload_reports_each_unit():
+  for window in (1, 8):
+    moo, acks = run_upload(SCRIPT, [("wizard", "")], window)
+    assert [ack.ok for ack in acks] == [True, True, True, True, False, False]
+    assert acks[4].errors == ["Line 1:  syntax error", "1 error.", "Verb not programmed."]
+    assert acks[5].errors == ['There is no "Missing" here.']
+    assert len(moo.log) == 9
+
+def test_upload_pins_objects_to_connections():
+  moo, acks = run_upload(SCRIPT, [("one", "x"), ("two", "y")])
+  assert [ack.unit for ack in acks] == split_units(SCRIPT)
+  players = {}
+  for player, line in moo.log:
+    players.setdefault(re.search(r"(Room|Box|Missing)", line)[1], set()).add(player)
+  assert players == {'Room': {'one'}, 'Box': {'two'}, 'Missing': {'one'}}
+
+def test_upload_transpiled_sample():
+  script = convert_to_string(SAMPLE)
+  moo, acks = run_upload(script, [("wizard", "")])
+  assert len(acks) == len(split_units(script))
+  assert all(ack.ok for ack in acks if ack.unit.obj == 'SampleClass')
+
+SUBCLASS_SCRIPT = """@create #1 named Room
+@create #1 named Crate
+@create Room named Kitchen
+@verb Kitchen:cook tnt RXD
+@create Kitchen named Pantry
+@verb Crate:open tnt RXD
+"""
+
+def test_subclasses_share_their_parents_connection():
+  lanes = assign_connections(split_units(SUBCLASS_SCRIPT), 2)
+  assert [[unit.obj for index, unit in lane] for lane in lanes] == [
+    ['Room', 'Kitchen', 'Kitchen', 'Pantry'], ['Crate', 'Crate']]
+  moo, acks = run_upload(SUBCLASS_SCRIPT, [("one", "x"), ("two", "y")])
+  assert all(ack.ok for ack in acks)
+  assert moo.owners == {'Room': 'one', 'Kitchen': 'one', 'Pantry': 'one', 'Crate': 'two'}
+
+MOVED_SCRIPT = """@create #1 named Leaf
+@create #1 named Crate
+@verb Leaf:fall tnt RXD
+@create #1 named Tree
+@chparent Leaf to Tree
+"""
+
+def test_moved_objects_share_their_new_parents_connection():
+  lanes = assign_connections(split_units(MOVED_SCRIPT), 2)
+  assert [[unit.obj for index, unit in lane] for lane in lanes] == [['Leaf', 'Leaf', 'Tree', 'Leaf'], ['Crate']]
+  moo, acks = run_upload(MOVED_SCRIPT, [("one", "x"), ("two", "y")])
+  assert all(ack.ok for ack in acks)
+  assert moo.owners == {'Leaf': 'one', 'Tree': 'one', 'Crate': 'two'}
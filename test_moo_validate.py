@@ -0,0 +1,87 @@
+import pytest
+
+from mooingsnake import FRONTENDS, stream_files
+from moo_validate import check_script, program_bodies, validate_files
+
+SCRIPT = """@create #1 named Thing
+@verb Thing:good tnt RXD
+@program Thing:good
+return 1;
+.
+@verb Thing:bad tnt RXD
+@program Thing:bad
+x = 1;
+y = ;
+.
+"""
+
+SOURCE = """class Thing(object):
+  def fine(self):
+    return 1
+
+  def negate(self, y):
+    x = 1
+    x = -y
+    return x
+"""
+
+# Constructs the transpiler emits that a stricter grammar once rejected.
+ROOM = """class Room(object):
+  def describe(self, who):
+    if who in self.contents and who.location.name != "void":
+      who.location.name = self.name
+    for item in self.contents:
+      self.announce(item.location.owner.name, [1, 2][0])
+    return {"name": self.name}
+"""
+
+# MOO the transpiler does not emit yet but that verbs may contain.
+MOO_SCRIPT = """@verb Thing:all tnt RXD
+@program Thing:all
+{a, ?b = -1, @rest} = {@args, -a};
+fork task (-b)
+  this.(a).name = x:(b)(@rest);
+endfork
+try
+  return `-x ! E_TYPE, E_INVARG => {@rest}';
+except e (E_DIV, E_RANGE)
+  return e;
+except (ANY)
+  return -(1 + -2);
+endtry
+.
+"""
+
+def test_program_bodies():
+  assert list(program_bodies(SCRIPT)) == [('Thing', 'good', 4, "return 1;\n"), ('Thing', 'bad', 8, "x = 1;\ny = ;\n")]
+
+def test_check_script_reports_script_lines():
+  errors = check_script(SCRIPT, 'thing.py')
+  assert [(error.obj, error.verb, error.script_line) for error in errors] == [('Thing', 'bad', 9)]
+  assert "line" not in errors[0].message
+
+@pytest.mark.parametrize('frontend', FRONTENDS)
+def test_errors_are_mapped_to_python_lines(tmp_path, frontend):
+  fname = str(tmp_path / 'thing.py')
+  (tmp_path / 'thing.py').write_text(SOURCE)
+  failures = []
+  converted = list(stream_files([fname], frontend=frontend))
+  assert list(validate_files(iter(converted), failures, frontend)) == converted
+  assert [(error.verb, error.source_line) for error in failures] == [('negate', 7)]
+  assert str(failures[0]).startswith(fname + ":7: Thing:negate does not parse")
+
+def test_valid_output_passes(tmp_path):
+  fname = str(tmp_path / 'thing.py')
+  (tmp_path / 'thing.py').write_text(SOURCE.replace("-y", "0 - y"))
+  failures = []
+  list(validate_files(stream_files([fname]), failures))
+  assert failures == []
+
+def test_valid_constructs_pass(tmp_path):
+  fname = str(tmp_path / 'room.py')
+  (tmp_path / 'room.py').write_text(ROOM)
+  for frontend in FRONTENDS:
+    failures = []
+    list(validate_files(stream_files([fname], frontend=frontend), failures, frontend))
+    assert failures == []
+  assert check_script(MOO_SCRIPT, 'thing.py') == []
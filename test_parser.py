@@ -1,4 +1,4 @@
-from mooparse import grammar
+from mooparse import flatten, grammar, name_or_class, view_parse_tree, walk
 
 empty = ''
 subscript_assignment = 'a["b"] = 1;'
@@ -37,3 +37,50 @@ def test_multi_comparison():
 
 def test_nested_ops():
   assert grammar.parse(nested_ops).is_valid
+
+def test_deeply_nested_calls():
+  assert grammar.parse("x = " + "f(" * 30 + "1" + ")" * 30 + ";").is_valid
+
+def test_long_verbs():
+  assert grammar.parse((nested_ops + "\n") * 200).is_valid
+
+def test_control_flow():
+  code = """\
+for i in [1..10]
+  try
+    x = `m[i] ! E_RANGE => {}';
+  except e (E_TYPE, E_INVARG)
+    continue i;
+  endtry
+endfor
+"""
+  assert grammar.parse(code).is_valid
+
+def test_invalid_code():
+  assert not grammar.parse('x = 1 +;').is_valid
+  assert not grammar.parse('if (x) endwhile').is_valid
+
+def test_walk_is_preorder():
+  tree = grammar.parse(nested_ops).tree
+  nodes = list(walk(tree))
+  assert nodes[0] is tree
+  assert len(nodes) == len(set(map(id, nodes)))
+  for n, node in enumerate(nodes[1:], 1):
+    parent = next(candidate for candidate in reversed(nodes[:n]) if node in candidate.children)
+    assert parent.start <= node.start <= node.end <= parent.end
+
+def test_flat_tree_matches_nodes():
+  tree = grammar.parse(fork).tree
+  flat = flatten(tree, fork)
+  nodes = list(walk(tree))
+  assert len(flat) == len(nodes)
+  for i, node in enumerate(nodes):
+    assert flat.string(i) == node.string
+    assert flat.name(i) == name_or_class(node)
+    assert [nodes[j] for j in flat.children(i)] == node.children
+  assert flat.parent[0] == -1
+
+def test_view_parse_tree():
+  view = view_parse_tree(grammar.parse(nested_ops))
+  assert view['string'] == nested_ops
+  assert view['children'][0]['start'] == 0
@@ -0,0 +1,88 @@
+import io
+import json
+import os
+
+from moo_index import ProgramIndex
+from mooingsnake import SuspendPolicy, convert_to_string
+from transpile_daemon import Transpiler, Watcher, serve
+
+SOURCE = "class Thing:\n  def a(self):\n    return 1\n\n  def b(self):\n    return 2\n"
+
+def touch(path, text):
+  path.write_text(text)
+  # Make sure the change is visible even on filesystems with coarse mtimes.
+  stat = os.stat(path)
+  os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+def test_watcher_emits_only_changed_units(tmp_path):
+  source = tmp_path / 'thing.py'
+  source.write_text(SOURCE)
+  watcher = Watcher([str(tmp_path)])
+  [(fname, script, changed)] = watcher.poll()
+  assert fname == str(source)
+  assert changed == script
+  assert watcher.poll() == []
+  touch(source, SOURCE.replace("return 2", "return 3"))
+  [(fname, script, changed)] = watcher.poll()
+  assert "return 3" in script
+  assert changed == "@program Thing:b\nreturn 3;\n.\n"
+
+def test_watcher_skips_files_that_do_not_parse(tmp_path):
+  source = tmp_path / 'thing.py'
+  source.write_text(SOURCE)
+  watcher = Watcher([str(source)])
+  watcher.poll()
+  touch(source, "class Thing(:\n")
+  assert watcher.poll() == []
+  touch(source, SOURCE.replace("return 1", "return 0"))
+  [(fname, script, changed)] = watcher.poll()
+  assert changed == "@program Thing:a\nreturn 0;\n.\n"
+
+def test_serve_answers_json_lines(tmp_path):
+  source = tmp_path / 'thing.py'
+  source.write_text(SOURCE)
+  requests = io.StringIO("\n".join(json.dumps(request) for request in [
+    {'id': 1, 'op': 'ping'},
+    {'id': 2, 'path': str(source)},
+    {'id': 3, 'op': 'convert', 'source': "class Other:\n  x = 1\n"},
+    {'id': 4, 'op': 'explode'},
+    {'id': 5, 'op': 'shutdown'},
+    {'id': 6, 'op': 'ping'},
+  ]) + "\n")
+  responses = io.StringIO()
+  serve(Transpiler(frontend='ast'), requests, responses)
+  answers = [json.loads(line) for line in responses.getvalue().splitlines()]
+  assert [answer['id'] for answer in answers] == [1, 2, 3, 4, 5]
+  assert answers[1]['code'].startswith("@create #1 named Thing\n")
+  assert answers[2]['code'] == "@create #1 named Other\n@property Other.x\n;Other.x = 1;\n"
+  assert 'error' in answers[3]
+
+BASE = "class Base:\n  def size(self):\n    return 1\n"
+CHILD = "class Child(Base):\n  def total(self):\n    for i in range(3):\n      if 0:\n        return -1\n    return self.size() + 1\n"
+
+def test_watcher_converts_like_a_batch_build(tmp_path):
+  (tmp_path / 'a_base.py').write_text(BASE)
+  (tmp_path / 'b_child.py').write_text(CHILD)
+  options = dict(optimize=True, inline=10, suspend=SuspendPolicy())
+  watcher = Watcher([str(tmp_path)], Transpiler(**options))
+  files = sorted(str(path) for path in tmp_path.iterdir())
+  index = ProgramIndex.build(files)
+  assert {fname: script for fname, script, changed in watcher.poll()} == {
+    fname: convert_to_string(fname, index=index, **options) for fname in files}
+
+def test_watcher_reconverts_children_when_the_index_changes(tmp_path):
+  (tmp_path / 'a_base.py').write_text(BASE)
+  (tmp_path / 'b_child.py').write_text(CHILD)
+  watcher = Watcher([str(tmp_path)])
+  scripts = {os.path.basename(fname): script for fname, script, changed in watcher.poll()}
+  assert scripts['b_child.py'].startswith("@create Base named Child\n")
+  touch(tmp_path / 'a_base.py', BASE.replace("Base", "Root"))
+  watcher.poll()
+  assert watcher.transpiler.outputs[str(tmp_path / 'b_child.py')].startswith("@create #1 named Child\n")
+
+def test_watcher_converts_parents_first(tmp_path):
+  (tmp_path / 'a_child.py').write_text(CHILD)
+  (tmp_path / 'z_base.py').write_text(BASE)
+  results = Watcher([str(tmp_path)]).poll()
+  assert [os.path.basename(fname) for fname, script, changed in results] == ['z_base.py', 'a_child.py']
+  assert results[1][1].startswith("@create Base named Child\n")
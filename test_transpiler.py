@@ -0,0 +1,196 @@
+import io
+import logging
+import os
+import shutil
+import subprocess
+import sys
+
+import astroid
+
+import moo_ast
+from mooingsnake import FRONTENDS, PythonToMoo, SuspendPolicy, UnitWriter, collect_inputs, convert_files, convert_to_string, load_ast, logger
+from transpile_cache import TranspileCache
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_obj.py')
+
+def make_tree(tmp_path):
+  (tmp_path / 'sub').mkdir()
+  shutil.copy(SAMPLE, tmp_path / 'b.py')
+  shutil.copy(SAMPLE, tmp_path / 'sub' / 'a.py')
+  (tmp_path / 'notes.txt').write_text('not python')
+  return tmp_path
+
+def test_collect_inputs_expands_directories_sorted(tmp_path):
+  make_tree(tmp_path)
+  inputs = collect_inputs([str(tmp_path)])
+  assert inputs == [str(tmp_path / 'b.py'), str(tmp_path / 'sub' / 'a.py')]
+
+def test_collect_inputs_expands_globs(tmp_path):
+  make_tree(tmp_path)
+  assert collect_inputs([str(tmp_path / '*.py')]) == [str(tmp_path / 'b.py')]
+
+def test_convert_files_in_parallel_matches_serial(tmp_path):
+  make_tree(tmp_path)
+  inputs = collect_inputs([str(tmp_path)])
+  expected = convert_to_string(SAMPLE)
+  results = list(convert_files(inputs, jobs=2))
+  assert [fname for fname, code in results] == inputs
+  assert all(code == expected for fname, code in results)
+
+def cache_entries(path):
+  return {p for p in path.rglob('*') if p.is_file()}
+
+def test_cache_reuses_unchanged_verbs(tmp_path):
+  cache = TranspileCache(str(tmp_path / 'cache'))
+  source = tmp_path / 'obj.py'
+  source.write_text("class Thing:\n  def a(self):\n    return 1\n\n  def b(self):\n    return 2\n")
+  first = convert_to_string(str(source), cache=cache)
+  assert convert_to_string(str(source), cache=cache) == first
+  assert first == convert_to_string(str(source))
+  source.write_text("class Thing:\n  def a(self):\n    return 1\n\n  def b(self):\n    return 3\n")
+  entries = cache_entries(tmp_path / 'cache')
+  assert convert_to_string(str(source), cache=cache) == first.replace('return 2', 'return 3')
+  # Only the file and verb b are new; verb a is reused.
+  assert len(cache_entries(tmp_path / 'cache') - entries) == 2
+
+def test_iter_file_yields_one_chunk_per_unit(tmp_path):
+  chunks = list(PythonToMoo.iter_file(SAMPLE))
+  assert "".join(chunks) == convert_to_string(SAMPLE)
+  assert sum(chunk.startswith("@create ") for chunk in chunks) == 1
+  assert all(chunk.startswith(("@create ", "@verb ", "@property ")) for chunk in chunks)
+  assert sum(chunk.startswith("@verb ") for chunk in chunks) == sum(chunk.count("@program ") for chunk in chunks)
+
+def test_iter_file_with_cache_matches(tmp_path):
+  cache = TranspileCache(str(tmp_path / 'cache'))
+  first = list(PythonToMoo.iter_file(SAMPLE, cache=cache))
+  assert list(PythonToMoo.iter_file(SAMPLE, cache=cache)) == first
+
+class CountingStream(io.StringIO):
+  writes = 0
+
+  def write(self, string):
+    self.writes += 1
+    return super().write(string)
+
+def test_unit_writer_writes_each_unit_once():
+  stream = CountingStream()
+  PythonToMoo.convert_module(load_ast(SAMPLE), UnitWriter(stream))
+  assert stream.getvalue() == convert_to_string(SAMPLE)
+  assert stream.writes == len(list(PythonToMoo.iter_file(SAMPLE)))
+
+def test_previous_can_be_the_output(tmp_path):
+  source = tmp_path / 'thing.py'
+  output = str(tmp_path / 'out.moo')
+  command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mooingsnake.py'),
+    '-i', str(source), '-o', output]
+  source.write_text("class Thing:\n  def a(self):\n    return 1\n\n  def b(self):\n    return 2\n")
+  subprocess.run(command, check=True, capture_output=True)
+  source.write_text("class Thing:\n  def a(self):\n    return 1\n\n  def b(self):\n    return 3\n")
+  subprocess.run(command + ['--previous', output], check=True, capture_output=True)
+  with open(output) as f:
+    assert f.read() == "@program Thing:b\nreturn 3;\n.\n"
+
+def test_converters_resolve_through_base_classes():
+  converter = PythonToMoo(io.StringIO())
+  assert converter.find_converter(astroid.AsyncFunctionDef) == converter.convert_verb
+  assert converter.find_converter(astroid.Lambda) == converter.default_converter
+  assert converter.dispatch[astroid.AsyncFunctionDef] == converter.convert_verb
+
+def test_debug_logging_uses_tracing_converter(tmp_path):
+  source = tmp_path / 'obj.py'
+  source.write_text("class Thing:\n  def a(self):\n    return 1\n")
+  expected = convert_to_string(str(source))
+  level = logger.level
+  logger.setLevel(logging.DEBUG)
+  try:
+    tracing = PythonToMoo(io.StringIO())
+    assert tracing.convert_node == tracing.trace_node
+    assert convert_to_string(str(source)) == expected
+  finally:
+    logger.setLevel(level)
+
+RICH_SOURCE = '''
+class Room(object):
+  exits = {"north": 1, "south": [1, 2]}
+
+  def look(self, who, verbose=False):
+    items = self.contents[1:3]
+    total = 0
+    for item in items:
+      total += item.weight
+      if item is not None and item.visible or verbose:
+        who.tell(item.name, prefix="  ")
+    if total == 3:
+      raise TypeError("bad")
+    str = len(items) * 2 - 1
+    return self.name
+'''
+
+def test_stdlib_frontend_matches_astroid(tmp_path):
+  source = tmp_path / 'room.py'
+  source.write_text(RICH_SOURCE)
+  for fname in (SAMPLE, str(source)):
+    assert convert_to_string(fname, frontend='ast') == convert_to_string(fname)
+
+def test_frontends_do_not_share_cache_entries(tmp_path):
+  cache = TranspileCache(str(tmp_path / 'cache'))
+  convert_to_string(SAMPLE, cache=cache)
+  entries = cache_entries(tmp_path / 'cache')
+  convert_to_string(SAMPLE, cache=cache, frontend='ast')
+  assert len(cache_entries(tmp_path / 'cache')) == 2 * len(entries)
+
+LOOPS = '''
+class Loops(object):
+  def run(self, n, items):
+    for i in range(10):
+      pass
+    for i in range(2, n + 1):
+      pass
+    for i in range(0, n, 2):
+      pass
+    for i in reversed(range(n)):
+      pass
+    for i in reversed(range(3, 8)):
+      pass
+    for i, item in enumerate(items):
+      pass
+    for i, item in enumerate(self.items, 1):
+      pass
+    for i, item in enumerate(self.get()):
+      pass
+'''
+
+def test_range_loops_are_lowered(tmp_path):
+  source = tmp_path / 'loops.py'
+  source.write_text(LOOPS)
+  for frontend in FRONTENDS:
+    headers = [line for line in convert_to_string(str(source), frontend=frontend).splitlines()
+      if line.startswith("for ") or " = " in line and "args" not in line]
+    assert headers == [
+      "for i in [0..9]",
+      "for i in [2..n + 1 - 1]",
+      "for i in (range(0, n, 2))",
+      "for i in [1 - n..0]",
+      "i = 0 - i;",
+      "for i in [-7..-3]",
+      "i = 0 - i;",
+      "for i in [0..length(items) - 1]",
+      "item = items[i + 1];",
+      "for i in [1..length(this.items)]",
+      "item = this.items[i];",
+      "for {i, item} in (enumerate(this:get()))",
+    ]
+
+def test_suspend_checks_start_every_loop_body(tmp_path):
+  source = tmp_path / 'loops.py'
+  source.write_text("class Busy(object):\n  def run(self, n):\n    while n:\n      for i in range(n):\n        continue\n      n -= 1\n")
+  check = "if ((ticks_left() < 500) || (seconds_left() < 2))\nsuspend(0);\nendif\n"
+  for frontend in FRONTENDS:
+    assert check not in convert_to_string(str(source), frontend=frontend)
+    code = convert_to_string(str(source), frontend=frontend, suspend=SuspendPolicy(500, 2))
+    assert code.count(check) == 2
+    assert "while (n)\n" + check + "for i in [0..n - 1]\n" + check + "continue;\n" in code
+    program = code.split("@program Busy:run\n")[1].rsplit(".\n", 1)[0]
+    statement = moo_ast.parse(program).body[1].body[0]
+    assert statement.body == [moo_ast.FunctionCall(function='suspend', args=(moo_ast.Int(0),))]
+    assert statement.condition.operator == '||'
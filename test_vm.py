@@ -1,5 +1,123 @@
-from moo_vm import VM
-from moo_opcodes import opcodes
+from moo_vm import VM, ExecutionResult, Label, Program, RingBufferTracer, assemble
+from moo_opcodes import opcodes, extended_opcodes
+from moo_runtime import BUILTIN_VARIABLES, Error, Frame, World
 
 vm = VM()
 vm.run([opcodes.IMM, 1, opcodes.IMM, 2, opcodes.ADD, opcodes.IMM, 3, opcodes.MULT, opcodes.RETURN, opcodes.DONE])
+
+def test_handler_table_is_indexed_by_opcode_value():
+  table = VM.handler_table()
+  assert table[opcodes.ADD.value] is VM.do_add
+  assert VM.handler_table() is table
+
+def test_missing_handler_fails_at_construction():
+  class IncompleteVM(VM):
+    do_fork = None
+  try:
+    IncompleteVM()
+  except NotImplementedError as e:
+    assert 'FORK' in str(e)
+  else:
+    assert False, "expected NotImplementedError"
+  assert VM.missing_handlers() == []
+
+def test_assemble_moves_literals_to_constants():
+  code, constants = assemble([opcodes.IMM, "hello", opcodes.RETURN])
+  assert list(code) == [opcodes.IMM.value, 0, opcodes.RETURN.value]
+  assert constants == ["hello"]
+
+def test_final_instruction_runs():
+  vm = VM()
+  vm.run([opcodes.IMM, 5, opcodes.IMM, 6, opcodes.ADD])
+  assert vm.stack == [11]
+
+def test_ring_buffer_tracer_keeps_last_records():
+  tracer = RingBufferTracer(size=2)
+  vm = VM(tracer=tracer)
+  vm.run([opcodes.IMM, 1, opcodes.IMM, 2, opcodes.ADD, opcodes.RETURN])
+  assert list(tracer.records) == [(4, opcodes.ADD.value, 2), (5, opcodes.RETURN.value, 1)]
+  assert 'RETURN' in tracer.format()
+
+VARS = BUILTIN_VARIABLES + ['i', 'total']
+I = VARS.index('i')
+TOTAL = VARS.index('total')
+
+def count_to(n):
+  top = Label()
+  end = Label()
+  return [
+    opcodes.IMM, 0, opcodes.PUT, TOTAL, opcodes.POP,
+    opcodes.IMM, 1, opcodes.IMM, n,
+    top, opcodes.FOR_RANGE, I, end,
+    opcodes.PUSH, TOTAL, opcodes.PUSH, I, opcodes.ADD, opcodes.PUT, TOTAL, opcodes.POP,
+    opcodes.JUMP, top,
+    end, opcodes.PUSH, TOTAL, opcodes.RETURN,
+  ]
+
+def test_for_range_loop_counts_ticks():
+  vm = VM()
+  assert vm.run(count_to(10), var_names=VARS) is ExecutionResult.RETURN
+  assert vm.return_value == 55
+  # POP, JUMP and RETURN are free; everything else costs a tick.
+  assert vm.ticks == 4 + 11 + 10 * 4 + 1
+
+def test_out_of_ticks_kills_task():
+  vm = VM(max_ticks=100)
+  assert vm.run(count_to(1000), var_names=VARS) is ExecutionResult.KILL
+
+def test_errors_are_raised_as_results():
+  vm = VM()
+  assert vm.run([opcodes.IMM, 1, opcodes.IMM, 0, opcodes.DIV]) is ExecutionResult.RAISE
+  assert vm.error.error is Error.E_DIV
+
+def test_map_insert_and_builtins():
+  vm = VM()
+  vm.run([
+    opcodes.MAP_CREATE, opcodes.IMM, 1, opcodes.IMM, "a", opcodes.map_insert,
+    opcodes.MAKE_SINGLETON_LIST, opcodes.BI_FUNC_CALL, "mapkeys", opcodes.RETURN])
+  assert vm.return_value == ("a",)
+
+def test_call_verb_with_scatter_defaults():
+  world = World()
+  thing = world.create(name="thing")
+  names = BUILTIN_VARIABLES + ['a', 'b']
+  a, b = names.index('a'), names.index('b')
+  default = Label()
+  done = Label()
+  world.add_verb(thing, "add", Program.assemble([
+    opcodes.PUSH, names.index('args'),
+    opcodes.EXTENDED, extended_opcodes.SCATTER, ((a, 'required', None), (b, 'optional', default)), done,
+    default, opcodes.IMM, 10, opcodes.PUT, b, opcodes.POP,
+    done, opcodes.POP,
+    opcodes.PUSH, a, opcodes.PUSH, b, opcodes.ADD, opcodes.RETURN,
+  ], names))
+  vm = VM(world=world)
+  call = [opcodes.PUSH, VARS.index('this'), opcodes.IMM, "add", opcodes.IMM, 1, opcodes.MAKE_SINGLETON_LIST, opcodes.CALL_VERB, opcodes.RETURN]
+  vm.run(call, frame=Frame(this=thing))
+  assert vm.return_value == 11
+  vm.run(call[:6] + [opcodes.MAKE_SINGLETON_LIST, opcodes.IMM, 2, opcodes.list_append] + call[7:], frame=Frame(this=thing))
+  assert vm.return_value == 3
+
+def test_fork_queues_body():
+  vm = VM()
+  end = Label()
+  vm.run([opcodes.IMM, 0, opcodes.FORK_WITH_ID, I, end, opcodes.IMM, "forked", opcodes.RETURN, end, opcodes.PUSH, I, opcodes.RETURN], var_names=VARS)
+  assert vm.return_value == 1
+  [(task, result)] = vm.run_forked()
+  assert result is ExecutionResult.RETURN and vm.return_value == "forked"
+
+def test_runtime_errors_are_moo_errors():
+  for code, error in [
+    ([opcodes.MAKE_EMPTY_LIST, opcodes.BI_FUNC_CALL, "min"], Error.E_ARGS),
+    ([opcodes.IMM, 0, opcodes.MAKE_SINGLETON_LIST, opcodes.BI_FUNC_CALL, "random"], Error.E_INVARG),
+    ([opcodes.IMM, 1, opcodes.MAKE_SINGLETON_LIST, opcodes.IMM, 1.5, opcodes.list_append, opcodes.BI_FUNC_CALL, "max"], Error.E_TYPE),
+    ([opcodes.MAKE_EMPTY_LIST, opcodes.IMM, "a", opcodes.IMM, "b", opcodes.MAKE_EMPTY_LIST, opcodes.EXTENDED, extended_opcodes.RANGESET], Error.E_TYPE),
+    ([opcodes.IMM, 10, opcodes.IMM, 10000000, opcodes.EXTENDED, extended_opcodes.EXP], Error.E_FLOAT),
+    ([opcodes.IMM, 2.0, opcodes.IMM, 10000, opcodes.EXTENDED, extended_opcodes.EXP], Error.E_FLOAT),
+  ]:
+    vm = VM()
+    assert vm.run(code) is ExecutionResult.RAISE
+    assert vm.error.error is error
+  vm = VM()
+  vm.run([opcodes.IMM, -2, opcodes.IMM, 63, opcodes.EXTENDED, extended_opcodes.EXP, opcodes.RETURN])
+  assert vm.return_value == -2 ** 63
@@ -0,0 +1,42 @@
+import hashlib
+import os
+
+from attr import attr, attributes
+
+# Bump whenever the converter's output changes so stale entries are never reused.
+CACHE_VERSION = 5
+
+@attributes
+class TranspileCache:
+  """Content-addressed on-disk store of transpiled MOO code.
+
+  Every entry lives in its own file named after its key, so several worker
+  processes can share one cache directory without locking.
+  """
+  path = attr()
+
+  @staticmethod
+  def key(*parts):
+    digest = hashlib.sha256(str(CACHE_VERSION).encode('ascii'))
+    for part in parts:
+      digest.update(b'\0')
+      digest.update(str(part).encode('UTF-8'))
+    return digest.hexdigest()
+
+  def entry_path(self, key):
+    return os.path.join(self.path, key[:2], key[2:])
+
+  def get(self, key):
+    try:
+      with open(self.entry_path(key), encoding='UTF-8') as f:
+        return f.read()
+    except FileNotFoundError:
+      return None
+
+  def put(self, key, value):
+    fname = self.entry_path(key)
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    temp = "{}.{}.tmp".format(fname, os.getpid())
+    with open(temp, "w", encoding='UTF-8') as f:
+      f.write(value)
+    os.replace(temp, fname)
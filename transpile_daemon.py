@@ -0,0 +1,171 @@
+"""Keep the transpiler warm between conversions for editor integrations.
+
+Watcher polls the inputs' modification times and re-emits only the units of
+the files that changed, or whose parents in the index did. serve() answers JSON-lines requests, one per line:
+
+  {"id": 1, "op": "convert", "path": "obj.py"}  -> {"id": 1, "code": ..., "changed": ...}
+  {"id": 2, "op": "convert", "source": "..."}   -> {"id": 2, "code": ...}
+  {"id": 3, "op": "ping"}                       -> {"id": 3, "ok": true}
+  {"id": 4, "op": "shutdown"}                   -> {"id": 4, "ok": true}
+
+"changed" holds only the commands that differ from the previous conversion of
+the same path. Failed requests are answered with {"id": ..., "error": ...}.
+"""
+import io
+import json
+import os
+import time
+
+from attr import attr, attributes, Factory
+
+from moo_index import DuplicateObjectError, ProgramIndex
+from moo_script import diff_scripts
+from mooingsnake import collect_inputs, get_frontend, logger, output_path, read_source
+
+def stamp(fname):
+  stat = os.stat(fname)
+  return stat.st_mtime_ns, stat.st_size
+
+@attributes
+class Transpiler:
+  """A converter that is loaded once and remembers the last output of each file.
+
+  The conversion options mean the same as the arguments of mooingsnake.convert_to_string.
+  """
+  frontend = attr(default='astroid')
+  cache = attr(default=None)
+  debug = attr(default=False)
+  outputs = attr(default=Factory(dict))
+  index = attr(default=None)
+  optimize = attr(default=False)
+  inline = attr(default=None)
+  suspend = attr(default=None)
+
+  def __attrs_post_init__(self):
+    self.converter = get_frontend(self.frontend)
+    # Pay for importing the parser now rather than on the first request.
+    self.converter.parse("")
+
+  def convert_source(self, code):
+    output = io.StringIO()
+    self.converter.convert_module(self.converter.parse(code), output, self.debug, self.cache, self.index, self.optimize,
+      self.inline, self.suspend)
+    return output.getvalue()
+
+  def index_inputs(self, fnames):
+    """Index fnames and return them parents first, keeping the previous index if one cannot be read, most likely mid-save."""
+    try:
+      index = ProgramIndex.build(fnames)
+    except (OSError, UnicodeDecodeError, SyntaxError, DuplicateObjectError) as e:
+      logger.error("Could not index the inputs: {}".format(e))
+      return list(fnames)
+    self.index = index
+    return index.sort_files(fnames)
+
+  def file_key(self, fname):
+    return self.index.file_key(fname) if self.index is not None else None
+
+  def convert(self, fname):
+    """Convert fname, returning its full script and the commands that changed since it was last converted."""
+    code = self.convert_source(read_source(fname))
+    previous = self.outputs.get(fname)
+    self.outputs[fname] = code
+    return code, code if previous is None else diff_scripts(previous, code)
+
+  def forget(self, fname):
+    self.outputs.pop(fname, None)
+
+@attributes
+class Watcher:
+  specs = attr()
+  transpiler = attr(default=Factory(Transpiler))
+  stamps = attr(default=Factory(dict))
+  # What each file's last conversion took from the index.
+  keys = attr(default=Factory(dict))
+
+  def poll(self):
+    """Convert the files added or modified since the last poll, returning (fname, script, changed) for each."""
+    try:
+      inputs = collect_inputs(self.specs)
+    except RuntimeError:
+      # A file given by name is missing, most likely mid-save; look again next time.
+      return []
+    results = []
+    current = {}
+    for fname in inputs:
+      try:
+        current[fname] = stamp(fname)
+      except OSError:
+        continue
+    if current != self.stamps:
+      current = {fname: current[fname] for fname in self.transpiler.index_inputs(list(current))}
+    else:
+      current = {fname: current[fname] for fname in self.stamps}
+    for fname in current:
+      key = self.transpiler.file_key(fname)
+      if self.stamps.get(fname) == current[fname] and self.keys.get(fname) == key:
+        continue
+      self.keys[fname] = key
+      try:
+        script, changed = self.transpiler.convert(fname)
+      except Exception as e:
+        logger.error("Could not convert {}: {}".format(fname, e))
+        continue
+      if changed:
+        results.append((fname, script, changed))
+    for fname in self.stamps.keys() - current.keys():
+      self.transpiler.forget(fname)
+      self.keys.pop(fname, None)
+    self.stamps = current
+    return results
+
+  def watch(self, emit, interval=0.5):
+    """Call emit(fname, script, changed) for every change, forever."""
+    while True:
+      for result in self.poll():
+        emit(*result)
+      time.sleep(interval)
+
+def handle(transpiler, request):
+  op = request.get('op', 'convert')
+  if op in ('ping', 'shutdown'):
+    return {'ok': True}
+  if op != 'convert':
+    raise ValueError("Unknown op {!r}".format(op))
+  if 'source' in request:
+    return {'code': transpiler.convert_source(request['source'])}
+  code, changed = transpiler.convert(request['path'])
+  return {'code': code, 'changed': changed}
+
+def serve(transpiler, requests, responses):
+  """Answer the JSON-lines requests read from requests until it ends or a shutdown request arrives."""
+  for line in requests:
+    if not line.strip():
+      continue
+    request_id = None
+    try:
+      request = json.loads(line)
+      request_id = request.get('id')
+      response = handle(transpiler, request)
+    except Exception as e:
+      request = {}
+      response = {'error': "{}: {}".format(type(e).__name__, e)}
+    response['id'] = request_id
+    responses.write(json.dumps(response) + "\n")
+    responses.flush()
+    if request.get('op') == 'shutdown':
+      return
+
+def watch_inputs(specs, transpiler, output, output_dir=None, interval=0.5):
+  """Write the changed commands of each modified input to output, and its full script under output_dir."""
+  base = os.path.commonpath([os.path.dirname(os.path.abspath(i)) for i in collect_inputs(specs)])
+  def emit(fname, script, changed):
+    if output_dir is not None:
+      path = output_path(os.path.abspath(fname), base, output_dir)
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      with open(path, "w") as f:
+        f.write(script)
+    output.write(changed)
+    output.flush()
+    logger.info("Updated {}".format(fname))
+  Watcher(specs, transpiler).watch(emit, interval)